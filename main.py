@@ -1,5 +1,5 @@
-def main():
-    print("Hello from my-mt3!")
+# my-mt3 のコマンドライン（pip install 後は `my-mt3 ...` でも同じ）
+from my_mt3.cli import main
 
 
 if __name__ == "__main__":
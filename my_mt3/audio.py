@@ -1,28 +1,126 @@
 # amtx/audio.py  (torchaudio版)
+import functools, math
 import numpy as np
+import soundfile as sf
 import torch
 import torchaudio
 
 # ===== 基本パラメータ（MVP既定） =====
 DEFAULT_SR = 22050
 
+class FeatureExtractor:
+    """
+    Resample / MelSpectrogram / AmplitudeToDB を保持して使い回すフロントエンド。
+    Melは center=False で組み、center=True 相当の反射パディングは自前で行う
+    （バッチ内の各要素をそれぞれの長さで端処理するため）。
+    """
+    def __init__(self, sr=DEFAULT_SR, n_fft=2048, hop=256, n_mels=256, power=2.0):
+        self.sr, self.n_fft, self.hop, self.n_mels = sr, n_fft, hop, n_mels
+        self.mel_spec = torchaudio.transforms.MelSpectrogram(
+            sample_rate=sr,
+            n_fft=n_fft,
+            hop_length=hop,
+            n_mels=n_mels,
+            power=power,          # librosaの power=2.0 と同義（パワースペクトログラム）
+            center=False,         # 反射パディングは logmel_batch 側で行う
+            f_min=0.0,
+            f_max=sr / 2.0,
+            norm=None,            # librosaのデフォルトに近づけるなら None を維持
+            mel_scale="htk",      # librosaに合わせたいなら "htk"（好みで "slaney" でも可）
+        )
+        self.amp2db = torchaudio.transforms.AmplitudeToDB(stype="power", top_db=None)
+        self._resamplers = {}     # orig_sr -> Resample（sinc カーネルを使い回す）
+
+    def resample(self, wav: torch.Tensor, orig_sr: int) -> torch.Tensor:
+        if orig_sr == self.sr:
+            return wav
+        return self._resampler(orig_sr)(wav)
+
+    def _resampler(self, orig_sr: int):
+        if orig_sr not in self._resamplers:
+            self._resamplers[orig_sr] = torchaudio.transforms.Resample(orig_freq=orig_sr, new_freq=self.sr)
+        return self._resamplers[orig_sr]
+
+    def load(self, path: str) -> np.ndarray:
+        """WAV読み込み -> mono化 -> self.sr へリサンプル。float32 [T]"""
+        wav, file_sr = torchaudio.load(path)          # wav: [C, T], float32/float64
+        if wav.dim() == 2 and wav.size(0) > 1:        # stereo -> mono (平均)
+            wav = wav.mean(dim=0, keepdim=True)
+        elif wav.dim() == 1:                          # [T] -> [1, T]
+            wav = wav.unsqueeze(0)
+        wav = self.resample(wav, file_sr)
+        wav = wav.squeeze(0).contiguous()             # [T]
+        return wav.numpy().astype(np.float32)
+
+    def num_samples(self, path: str) -> int:
+        """デコードせずにメタデータから self.sr 換算のサンプル数を求める（Resample の出力長と同じ規則）"""
+        info = sf.info(path)
+        if info.samplerate == self.sr:
+            return info.frames
+        g = math.gcd(info.samplerate, self.sr)
+        return math.ceil((self.sr // g) * info.frames / (info.samplerate // g))
+
+    def load_segment(self, path: str, start: int, stop: int) -> torch.Tensor:
+        """
+        self.sr 換算のサンプル範囲 [start, stop) だけを読み込む（ファイル全体はデコードしない）。
+        ファイル端をはみ出す分は反射で埋める（center=True の STFT と同じ端処理）。
+        リサンプルはフィルタ幅ぶんの余白を付けて読むので、load() の結果を切り出したものと一致する。
+        """
+        info = sf.info(path)
+        n = self.num_samples(path)
+        idx = torch.arange(start, stop).abs()
+        idx = torch.where(idx > n - 1, 2 * (n - 1) - idx, idx)      # [0, n-1] に折り返し
+        lo, hi = int(idx.min()), int(idx.max()) + 1
+
+        g = math.gcd(info.samplerate, self.sr)
+        o, m = info.samplerate // g, self.sr // g                    # o 入力サンプル -> m 出力サンプル
+        width = self._resampler(info.samplerate).width if o != m else 0
+        mb = -(-width // o) + 1                                      # 余白（ブロック数）
+        a = max(0, (lo // m - mb) * o)
+        b = min(info.frames, (-(-hi // m) + mb) * o)
+        seg, _ = sf.read(path, start=a, stop=b, dtype="float32", always_2d=True)
+        wav = torch.from_numpy(seg.T).mean(dim=0, keepdim=True)     # [1, T] mono
+        wav = self.resample(wav, info.samplerate).squeeze(0)
+        return wav[idx - a // o * m]
+
+    def frames(self, x: torch.Tensor) -> torch.Tensor:
+        """パディング済み波形 [B, T] -> log-Mel [B, T_spec, n_mels]（center=False）"""
+        return self.amp2db(self.mel_spec(x)).transpose(1, 2)
+
+    def logmel_batch(self, wavs: torch.Tensor, lengths) -> list[np.ndarray]:
+        """
+        ゼロ詰めした波形バッチ [B, T_max] と各長さから、要素ごとの log-Mel [1 + len//hop, n_mels] をまとめて計算する。
+        各要素は自分の長さで反射パディングするので、1本ずつ wav_to_logmel した結果と一致する。
+        """
+        wavs = torch.as_tensor(wavs, dtype=torch.float32)
+        lengths = torch.as_tensor(lengths, dtype=torch.long)
+        pad = self.n_fft // 2
+        # 反射パディングを gather で一括適用: 位置 j は元の j - pad を [0, len-1] で折り返した位置
+        j = torch.arange(wavs.size(1) + 2 * pad) - pad
+        last = (lengths - 1).unsqueeze(1)
+        src = j.abs().unsqueeze(0).expand(len(lengths), -1)
+        src = torch.where(src > last, 2 * last - src, src)
+        valid = j.unsqueeze(0) < (lengths + pad).unsqueeze(1)
+        x = torch.gather(wavs, 1, src.clamp(0, wavs.size(1) - 1)) * valid
+        spec = self.frames(x)
+        return [spec[i, :1 + int(n) // self.hop].contiguous().numpy().astype(np.float32)
+                for i, n in enumerate(lengths)]
+
+    def __call__(self, y: np.ndarray) -> np.ndarray:
+        """波形(y) [T] -> log-Melスペクトログラム [T_spec, n_mels]"""
+        return self.logmel_batch(torch.from_numpy(np.asarray(y, dtype=np.float32)).unsqueeze(0), [len(y)])[0]
+
+@functools.lru_cache(maxsize=None)
+def get_feature_extractor(sr=DEFAULT_SR, n_fft=2048, hop=256, n_mels=256, power=2.0) -> FeatureExtractor:
+    """パラメータごとに1つの FeatureExtractor を共有する"""
+    return FeatureExtractor(sr=sr, n_fft=n_fft, hop=hop, n_mels=n_mels, power=power)
+
 def load_wav_mono(path: str, sr: int = DEFAULT_SR) -> tuple[np.ndarray, int]:
     """
     WAV読み込み -> mono化 -> 目的サンプルレートへリサンプル。
     返り値は (waveform(float32, shape[T]), sr)
     """
-    wav, file_sr = torchaudio.load(path)          # wav: [C, T], float32/float64
-    if wav.dim() == 2 and wav.size(0) > 1:        # stereo -> mono (平均)
-        wav = wav.mean(dim=0, keepdim=True)
-    elif wav.dim() == 1:                          # [T] -> [1, T]
-        wav = wav.unsqueeze(0)
-
-    if file_sr != sr:
-        resampler = torchaudio.transforms.Resample(orig_freq=file_sr, new_freq=sr)
-        wav = resampler(wav)
-
-    wav = wav.squeeze(0).contiguous()             # [T]
-    return wav.numpy().astype(np.float32), sr
+    return get_feature_extractor(sr=sr).load(path), sr
 
 def wav_to_logmel(
     y: np.ndarray,
@@ -36,29 +134,7 @@ def wav_to_logmel(
     波形(y) -> log-Melスペクトログラム。
     返り値は [T, n_mels] の float32（librosa版と互換の転置）
     """
-    # numpy -> torch [1, T]
-    wav = torch.from_numpy(y).float().unsqueeze(0)
-
-    mel_spec = torchaudio.transforms.MelSpectrogram(
-        sample_rate=sr,
-        n_fft=n_fft,
-        hop_length=hop,
-        n_mels=n_mels,
-        power=power,          # librosaの power=2.0 と同義（パワースペクトログラム）
-        center=True,
-        pad_mode="reflect",
-        f_min=0.0,
-        f_max=sr / 2.0,
-        norm=None,            # librosaのデフォルトに近づけるなら None を維持
-        mel_scale="htk",      # librosaに合わせたいなら "htk"（好みで "slaney" でも可）
-    )
-
-    amp2db = torchaudio.transforms.AmplitudeToDB(stype="power", top_db=None)
-    spec = mel_spec(wav)                # [1, n_mels, T_spec]
-    logmel = amp2db(spec).squeeze(0)    # [n_mels, T_spec]
-
-    # 転置して [T, n_mels] に揃える
-    return logmel.transpose(0, 1).contiguous().numpy().astype(np.float32)
+    return get_feature_extractor(sr=sr, n_fft=n_fft, hop=hop, n_mels=n_mels, power=power)(y)
 
 def chunk_indices(total_sec, chunk_sec=2.048, include_last=True):
     t, out, eps = 0.0, [], 5e-3
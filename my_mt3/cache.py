@@ -0,0 +1,166 @@
+# amtx/cache.py
+import hashlib, itertools, json, os, shutil, weakref
+from collections import OrderedDict
+import numpy as np
+
+_DIGESTS = {}  # (path, size, mtime_ns) -> sha1（同一プロセス内で再ハッシュしない）
+_MODEL_DIGESTS = weakref.WeakKeyDictionary()  # model -> (重みの版, digest)
+
+def file_digest(path: str) -> str:
+    st = os.stat(path)
+    memo = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo not in _DIGESTS:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _DIGESTS[memo] = h.hexdigest()
+    return _DIGESTS[memo]
+
+class FeatureCache:
+    """
+    ファイル単位の log-Mel / トークン列のディスクキャッシュ。
+    キーは WAV・MIDI の内容ハッシュ + フロントエンドパラメータ（sr, n_fft, hop, n_mels, step_ms）なので、
+    パラメータを変えると自動的に別エントリになる。読み出しは np.load(mmap_mode="r")。
+
+    root/<key[:2]>/<key>/
+        mel.npy      [T_full, F] float32
+        tok.npy      全チャンクのトークンを連結した int32
+        chunks.json  [[fs, fe, t0, t1, s, e], ...]
+    """
+    def __init__(self, root, **params):
+        self.root = root
+        self.params = params
+        self._tag = json.dumps(params, sort_keys=True)
+
+    def key(self, wav, midi, pid):
+        h = hashlib.sha1()
+        for part in (file_digest(wav), file_digest(midi), str(pid), self._tag):
+            h.update(part.encode()); h.update(b"\0")
+        return h.hexdigest()
+
+    def _dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def load(self, wav, midi, pid):
+        """ヒットなら (mel_full(mmap), [(fs, fe, token_ids, (s, e)), ...])、なければ None"""
+        d = self._dir(self.key(wav, midi, pid))
+        try:
+            with open(os.path.join(d, "chunks.json")) as f:
+                rows = json.load(f)
+            mel = np.load(os.path.join(d, "mel.npy"), mmap_mode="r")
+            tok = np.load(os.path.join(d, "tok.npy"), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        return mel, [(fs, fe, tok[t0:t1], (s, e)) for fs, fe, t0, t1, s, e in rows]
+
+    def store(self, wav, midi, pid, mel_full, entries):
+        d = self._dir(self.key(wav, midi, pid))
+        if os.path.isdir(d):
+            return
+        tmp = f"{d}.tmp-{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        rows, toks, n = [], [], 0
+        for fs, fe, ids, (s, e) in entries:
+            rows.append([fs, fe, n, n + len(ids), s, e])
+            toks.append(np.asarray(ids, dtype=np.int32)); n += len(ids)
+        np.save(os.path.join(tmp, "mel.npy"), np.ascontiguousarray(mel_full, dtype=np.float32))
+        np.save(os.path.join(tmp, "tok.npy"), np.concatenate(toks) if toks else np.zeros(0, np.int32))
+        with open(os.path.join(tmp, "chunks.json"), "w") as f:
+            json.dump(rows, f)
+        try:
+            os.replace(tmp, d)  # 完成したディレクトリだけを公開（並列書き込みでも壊れない）
+        except OSError:  # 他プロセスが先に書いた
+            shutil.rmtree(tmp, ignore_errors=True)
+
+def model_digest(model) -> str:
+    """
+    チャンクキャッシュ用のモデル識別子。load_model / load_engine が付ける ckpt_id（チェックポイントの内容ハッシュ
+    + バリアント）があればそれを、なければ構成と重みのハッシュを返す。
+    state_dict のテンソル（int8 の packed params のタプル内を含む）だけをハッシュし、dtype などの値は飛ばす。
+    書き出したエンジン（ExportedMT3）は重みを持たないので ckpt_id が必要。
+    ハッシュはモデルごとに覚えておき、パラメータ・バッファが差し替えや in-place 更新（学習・load_state_dict）で
+    変わったときだけ計算し直す（転写のたびに全重みを読まない）
+    """
+    ckpt_id = getattr(model, "ckpt_id", None)
+    if ckpt_id is not None:
+        return ckpt_id
+    if not hasattr(model, "state_dict"):
+        raise ValueError(f"{type(model).__name__} has no state_dict to hash; set model.ckpt_id "
+                         "(load_engine does this) to use it with ChunkCache")
+    version = tuple((t.data_ptr(), t._version) for t in itertools.chain(model.parameters(), model.buffers()))
+    memo = _MODEL_DIGESTS.get(model)
+    if memo is not None and memo[0] == version:
+        return memo[1]
+    h = hashlib.sha1(json.dumps(getattr(model, "config", {}), sort_keys=True).encode())
+    for name, v in model.state_dict().items():
+        for i, t in enumerate(_tensors(v)):
+            if t.is_quantized:
+                t = t.dequantize()
+            h.update(f"{name}.{i}".encode()); h.update(t.detach().cpu().contiguous().numpy().tobytes())
+    _MODEL_DIGESTS[model] = (version, h.hexdigest())
+    return h.hexdigest()
+
+def _tensors(v):
+    """state_dict の値 -> その中のテンソル（タプル・リストは展開、テンソル以外は無視）"""
+    if isinstance(v, (tuple, list)):
+        return [t for x in v for t in _tensors(x)]
+    return [v] if hasattr(v, "is_quantized") else []
+
+class ChunkCache:
+    """
+    チャンク転写結果（デコーダ出力のトークン列）の内容アドレス型 LRU キャッシュ。
+    キーは log-Mel を quant_db 刻みに量子化したもの + モデル識別子（model_digest）のハッシュなので、
+    ループ・繰り返し区間のように同じ音のチャンクはデコードせずに済む（quant_db=0 ならバイト一致のみ）。
+    capacity 件を超えたら最も古く使われたものから捨てる。path を指定すると開始時に読み込み、save() で書き出す。
+    hits / misses はキャッシュ自身でも数える
+    """
+    def __init__(self, capacity=4096, path=None, quant_db=0.1):
+        self.capacity, self.path, self.quant_db = capacity, path, quant_db
+        self._d = OrderedDict()
+        self.hits = self.misses = 0
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("quant_db") == quant_db:  # 量子化幅が違えばキーの意味が変わるので読まない
+                for key, ids in data["entries"][-capacity:]:
+                    self._d[key] = ids
+
+    def key(self, mel, model_id) -> str:
+        mel = np.ascontiguousarray(mel, dtype=np.float32)
+        q = np.round(mel / self.quant_db).astype(np.int32) if self.quant_db else mel
+        h = hashlib.sha1(model_id.encode())
+        h.update(str(mel.shape).encode()); h.update(q.tobytes())
+        return h.hexdigest()
+
+    def get(self, key):
+        ids = self._d.get(key)
+        if ids is None:
+            self.misses += 1
+            return None
+        self._d.move_to_end(key)
+        self.hits += 1
+        return list(ids)
+
+    def put(self, key, ids):
+        self._d[key] = [int(t) for t in ids]
+        self._d.move_to_end(key)
+        while len(self._d) > self.capacity:
+            self._d.popitem(last=False)
+
+    def __len__(self):
+        return len(self._d)
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(1, self.hits + self.misses)
+
+    def save(self, path=None):
+        """LRU 順（古い順）のエントリを JSON に書き出す（一時ファイル経由）"""
+        path = path or self.path
+        if path is None:
+            raise ValueError("ChunkCache.save() needs a path (pass path= here or to ChunkCache)")
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump({"quant_db": self.quant_db, "entries": list(self._d.items())}, f)
+        os.replace(tmp, path)
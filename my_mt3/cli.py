@@ -0,0 +1,140 @@
+# amtx/cli.py  (コマンドライン: my-mt3 transcribe / train / eval)
+# 起動を速くするため、このモジュールは標準ライブラリしか import しない。
+# torch / torchaudio / pretty_midi などはサブコマンドの中で必要になってから読み込む
+import argparse, contextlib, os, sys, time
+from .utils import collect_pairs
+
+_T0 = time.perf_counter()
+
+class _Profile:
+    """--profile-startup 用: with prof("name"): ... の経過時間を記録し、最後に stderr へ出す"""
+    def __init__(self, enabled):
+        self.enabled, self.times = enabled, {"cli": time.perf_counter() - _T0}
+    @contextlib.contextmanager
+    def __call__(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - t0
+    def report(self):
+        if not self.enabled:
+            return
+        total = time.perf_counter() - _T0
+        print("[startup] " + "  ".join(f"{k}={v * 1000:.0f}ms" for k, v in self.times.items())
+              + f"  total={total * 1000:.0f}ms", file=sys.stderr)
+
+# ===== サブコマンド =====
+def cmd_transcribe(args, prof):
+    with prof("import"):
+        import torch
+        from .engine import load_engine
+        from .infer import skip_summary, transcribe
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    with prof("load"):
+        engine = load_engine(args.ckpt, args.variant)
+    prof.report()
+    skip = {}
+    for path in args.audio:
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+            out = os.path.join(args.out_dir, os.path.splitext(os.path.basename(path))[0] + ".mid")
+        else:
+            out = args.out if args.out and len(args.audio) == 1 else os.path.splitext(path)[0] + ".mid"
+        t0 = time.perf_counter()
+        pm = transcribe(path, engine, device="cpu", batch_size=args.batch_size, silence_db=args.silence_db,
+                        skip_stats=skip)
+        pm.write(out)
+        print(f"{path} -> {out}  ({sum(len(i.notes) for i in pm.instruments)} notes, {time.perf_counter() - t0:.2f}s)")
+    if args.silence_db is not None and skip.get("chunks"):
+        s = skip_summary(skip)
+        print(f"silent chunks skipped: {s['silent']}/{s['chunks']}")
+
+def cmd_train(args, prof):
+    with prof("import"):
+        import torch
+        from .train import train_loop
+    prof.report()
+    if os.path.exists(os.path.join(args.data, "index.json")):  # pack_shards の出力
+        data = args.data
+    else:
+        data = collect_pairs(os.path.join(args.data, "wavs"), os.path.join(args.data, "midis"))
+        print(f"pairs: {len(data)}")
+    model_cfg = {"preset": args.preset, "subsample": args.subsample, "frontend": args.frontend, "codec": args.codec}
+    device = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+    train_loop(data, epochs=args.epochs, bs=args.bs, lr=args.lr, device=device, cache_dir=args.cache_dir,
+               max_tokens=args.max_tokens, accum_steps=args.accum_steps, save_path=args.out,
+               num_workers=args.num_workers, model_cfg=model_cfg,
+               teacher=args.teacher, log_path=args.log)  # 各エポック後に args.out へ保存される
+    print(f"saved -> {args.out}")
+
+def cmd_eval(args, prof):
+    with prof("import"):
+        import json
+        from .corpus import run_corpus
+    prof.report()
+    pairs = collect_pairs(args.wav_dir, args.midi_dir)
+    summary = run_corpus(pairs, args.ckpt, args.out, workers=args.workers, variant=args.variant,
+                         batch_size=args.batch_size, pred_dir=args.pred_dir,
+                         silence_db=args.silence_db, cache_size=args.cache_size)
+    print(json.dumps(summary, indent=2))
+
+def build_parser():
+    # VARIANTS / PRESETS / CODECS は engine / model / tokenizer を import しないと取れないので、ここでは文字列で持つ（それぞれの側で検証される）
+    variants = ["fp32", "int8", "compile", "torchscript", "onnx"]
+    ap = argparse.ArgumentParser(prog="my-mt3", description="MT3Mini による自動採譜")
+    ap.add_argument("--profile-startup", action="store_true", help="import とチェックポイント読み込みの時間を表示する")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("transcribe", help="音声ファイルを MIDI に転写する")
+    p.add_argument("audio", nargs="+", help="入力音声ファイル")
+    p.add_argument("--ckpt", default="ckpt_piano.pt")
+    p.add_argument("--variant", default="fp32", choices=variants)
+    p.add_argument("-o", "--out", default=None, help="出力 MIDI（入力が1つのとき。既定: 入力と同名の .mid）")
+    p.add_argument("--out_dir", default=None, help="出力先ディレクトリ")
+    p.add_argument("--batch_size", type=int, default=64)
+    p.add_argument("--silence_db", type=float, default=None, help="log-Mel の最大値がこれ未満のチャンクは無音として飛ばす")
+    p.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    p.set_defaults(func=cmd_transcribe)
+
+    p = sub.add_parser("train", help="学習してチェックポイントを保存する")
+    p.add_argument("--data", default="data", help="wavs/ と midis/ を含むディレクトリ、または pack_shards の出力")
+    p.add_argument("--out", default="ckpt_piano.pt")
+    p.add_argument("--epochs", type=int, default=10)
+    p.add_argument("--bs", type=int, default=16)
+    p.add_argument("--lr", type=float, default=2e-4)
+    p.add_argument("--device", default=None, help="既定: cuda があれば cuda")
+    p.add_argument("--preset", default="base", choices=["tiny", "small", "base"])
+    p.add_argument("--subsample", type=int, default=1, choices=[1, 2, 4])
+    p.add_argument("--frontend", default="stack", choices=["stack", "conv"])
+    p.add_argument("--codec", default="absolute", choices=["absolute", "tie", "delta", "delta_tie"],
+                   help="トークンの符号化方式（チェックポイントに保存され、転写時も同じものが使われる）")
+    p.add_argument("--max_tokens", type=int, default=None, help="トークン長バケットのトークン予算")
+    p.add_argument("--accum_steps", type=int, default=1)
+    p.add_argument("--cache_dir", default=None)
+    p.add_argument("--num_workers", type=int, default=2)
+    p.add_argument("--teacher", default=None, help="蒸留元のチェックポイント（ドラフトモデルの学習用）")
+    p.add_argument("--log", default=None, help="ステップごとの計測の出力先（.csv / .jsonl）")
+    p.set_defaults(func=cmd_train)
+
+    p = sub.add_parser("eval", help="テストセットを転写して評価する")
+    p.add_argument("--ckpt", default="ckpt_piano.pt")
+    p.add_argument("--wav_dir", default="data/wavs")
+    p.add_argument("--midi_dir", default="data/midis")
+    p.add_argument("--out", default="eval_results.jsonl")
+    p.add_argument("--pred_dir", default=None)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--variant", default="fp32", choices=variants)
+    p.add_argument("--batch_size", type=int, default=64)
+    p.add_argument("--silence_db", type=float, default=None)
+    p.add_argument("--cache_size", type=int, default=0)
+    p.set_defaults(func=cmd_eval)
+    return ap
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args, _Profile(args.profile_startup))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# amtx/corpus.py  (コーパス一括転写＋評価)
+import json, os, time
+from multiprocessing import Pool
+import pretty_midi, soundfile as sf, torch
+from .cache import ChunkCache
+from .engine import load_engine
+from .infer import skip_summary, transcribe
+from .metrics import _prf, evaluate, onset_f1
+
+STAGES = ("load", "features", "decode", "post", "metrics")
+
+_ENGINE = None
+_CACHE = None
+_OPTS = {}
+
+def _init_worker(ckpt, variant, threads, opts):
+    global _ENGINE, _CACHE, _OPTS
+    torch.set_num_threads(threads)   # ワーカー数 x スレッド数 がコア数を超えないように
+    _ENGINE = load_engine(ckpt, variant)
+    _CACHE = ChunkCache(opts["cache_size"]) if opts["cache_size"] else None  # ワーカーごとのメモリ上キャッシュ
+    _OPTS = opts
+
+def _process(pair):
+    wav, midi, pid = pair
+    rec = {"wav": wav, "midi": midi}
+    try:
+        times, skip = {}, {}
+        pred = transcribe(wav, _ENGINE, device="cpu", batch_size=_OPTS["batch_size"], stats=times,
+                          silence_db=_OPTS["silence_db"], cache=_CACHE, skip_stats=skip)
+        t0 = time.perf_counter()
+        ref = pretty_midi.PrettyMIDI(midi)
+        p, r, f1 = onset_f1(pred, ref, tol_ms=_OPTS["tol_ms"])
+        metrics = evaluate(ref, pred, onset_tol=_OPTS["tol_ms"] / 1000)
+        times["metrics"] = time.perf_counter() - t0
+        notes = [[n.start, n.end, n.pitch] for inst in pred.instruments for n in inst.notes]
+        if _OPTS["pred_dir"]:
+            out = os.path.join(_OPTS["pred_dir"], os.path.splitext(os.path.basename(wav))[0] + ".mid")
+            pred.write(out)
+            rec["pred_midi"] = out
+        rec.update(audio_sec=sf.info(wav).duration, precision=p, recall=r, f1=f1, n_pred=len(notes),
+                   n_ref=sum(len(inst.notes) for inst in ref.instruments), times=times, skip=skip, metrics=metrics, notes=notes)
+    except Exception as e:  # 1ファイルの失敗で全体を止めない（再開時に再試行される）
+        rec["error"] = f"{type(e).__name__}: {e}"
+    return rec
+
+def load_records(out_path):
+    """JSONL の既存レコード（途中で切れた最終行は無視）"""
+    recs = []
+    if os.path.exists(out_path):
+        with open(out_path) as f:
+            for line in f:
+                try:
+                    recs.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+    return recs
+
+def run_corpus(pairs, ckpt, out_path, workers=None, variant="fp32", batch_size=64,
+               pred_dir=None, tol_ms=50, silence_db=None, cache_size=0):
+    """
+    (wav, midi, program_id) のリストをプロセスプールで転写・評価し、1ファイル1行の JSONL に逐次追記する。
+    既に成功レコードがある wav はスキップするので、中断しても同じ out_path で再実行すれば続きから走る。
+    silence_db / cache_size（ワーカーごとの ChunkCache の件数、0 で無効）は無音・重複チャンクのスキップ（transcribe 参照）。
+    返り値は summarize() の集計
+    """
+    done = {r["wav"] for r in load_records(out_path) if "error" not in r}
+    todo = [p for p in pairs if p[0] not in done]
+    workers = max(1, min(workers or os.cpu_count(), len(todo) or 1))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    if pred_dir:
+        os.makedirs(pred_dir, exist_ok=True)
+    opts = {"batch_size": batch_size, "pred_dir": pred_dir, "tol_ms": tol_ms,
+            "silence_db": silence_db, "cache_size": cache_size}
+
+    print(f"pairs: {len(pairs)}  done: {len(done)}  todo: {len(todo)}  "
+          f"workers: {workers} x {threads} threads")
+    t0 = time.perf_counter()
+    if todo:
+        with Pool(workers, initializer=_init_worker, initargs=(ckpt, variant, threads, opts)) as pool, \
+                open(out_path, "a") as f:
+            for rec in pool.imap_unordered(_process, todo):
+                f.write(json.dumps(rec) + "\n"); f.flush()
+                if "error" in rec:
+                    print(f"[error] {rec['wav']}: {rec['error']}")
+    wall = time.perf_counter() - t0
+
+    recs = [r for r in load_records(out_path) if "error" not in r]
+    new = {p[0] for p in todo}
+    summary = summarize(recs)
+    summary.update(summarize([r for r in recs if r["wav"] in new], wall_sec=wall, prefix="run_"))
+    return summary
+
+def summarize(recs, wall_sec=None, prefix=""):
+    """平均 P/R/F1（onset_f1）とピッチ考慮の micro F1、音声秒数、段階ごとの合計時間。wall_sec を渡すと処理速度（音声秒 / 実時間秒）も出す"""
+    n = len(recs)
+    out = {f"{prefix}files": n}
+    if not n:
+        return out
+    audio = sum(r["audio_sec"] for r in recs)
+    out[f"{prefix}audio_sec"] = audio
+    if not prefix:
+        for k in ("precision", "recall", "f1"):
+            out[k] = sum(r[k] for r in recs) / n
+        # ピッチ考慮の指標は一致数を合計した micro 平均
+        for m in ("onset", "onset_offset", "frame"):
+            tp, n_est, n_ref = (sum(r["metrics"][m][c] for r in recs if "metrics" in r) for c in ("tp", "n_est", "n_ref"))
+            out[f"{m}_f1"] = _prf(tp, n_est, n_ref)[2]
+    out[f"{prefix}stage_sec"] = {s: sum(r["times"].get(s, 0.0) for r in recs) for s in STAGES}
+    skip = {}
+    for r in recs:
+        for k, v in r.get("skip", {}).items():
+            skip[k] = skip.get(k, 0) + v
+    if skip.get("chunks"):
+        out[f"{prefix}skip"] = skip_summary(skip)
+    if wall_sec is not None:
+        out[f"{prefix}wall_sec"] = wall_sec
+        out[f"{prefix}audio_sec_per_wall_sec"] = audio / max(wall_sec, 1e-9)
+    return out
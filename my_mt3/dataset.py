@@ -1,58 +1,226 @@
 # amtx/dataset.py
-import torch, pretty_midi, numpy as np
+import pretty_midi, numpy as np
 from torch.utils.data import Dataset
-from .audio import load_wav_mono, wav_to_logmel, chunk_indices, ms_quantize
-from .tokenizer import encode_events, PROGRAMS
+from .audio import load_wav_mono, wav_to_logmel, chunk_indices, get_feature_extractor
+from .tokenizer import get_codec
+from .cache import FeatureCache
 
 
 def sec_to_frame(t_sec: float, sr: int, hop: int) -> int:
     return int(round(t_sec * sr / hop))
 
 class AMTDataset(Dataset):
-    def __init__(self, pairs, sr=22050, hop=256, step_ms=10):
+    def __init__(self, pairs, sr=22050, hop=256, step_ms=10, n_fft=2048, n_mels=256, cache_dir=None,
+                 codec="absolute"):
         self.pairs = pairs  # [(wav_path, midi_path, program_id), ...]
         self.sr, self.hop, self.step_ms = sr, hop, step_ms
+        self.n_fft, self.n_mels = n_fft, n_mels
+        self.codec = get_codec(codec)  # トークンの符号化方式（tokenizer.CODECS）
+        # cache_dir を指定すると log-Mel/トークンをディスクにキャッシュし、2回目以降は mmap をスライスするだけ
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = FeatureCache(cache_dir, **_cache_params(sr, n_fft, hop, n_mels, step_ms, self.codec))
 
     def __len__(self): return len(self.pairs)
     def __getitem__(self, i):
+        mel_full, entries = self.load(i)
+        # ---- ここが重要：Mel をチャンク範囲にスライス ----
+        return [(mel_full[fs:fe, :], token_ids, se) for fs, fe, token_ids, se in entries]
+
+    def load(self, i):
+        """(mel_full, [(fs, fe, token_ids, (s, e)), ...]) を返す。キャッシュがあればそこから読む"""
         wav, midi, pid = self.pairs[i]
-        y, _ = load_wav_mono(wav, sr=self.sr)
-        mel_full = wav_to_logmel(y, sr=self.sr, hop=self.hop)  # [T_full, F]
-        total_sec = len(y) / self.sr
+        if self.cache is not None:
+            hit = self.cache.load(wav, midi, pid)
+            if hit is not None:
+                return hit
+        mel_full, entries = self.build(wav, midi, pid)
+        if self.cache is not None:
+            self.cache.store(wav, midi, pid, mel_full, entries)
+        return mel_full, entries
 
-        # 参照MIDIを読む
-        pm = pretty_midi.PrettyMIDI(midi)
-        notes = [(n.start, n.end, n.pitch)
-                 for inst in pm.instruments for n in inst.notes]
+    def build(self, wav, midi, pid):
+        y, _ = load_wav_mono(wav, sr=self.sr)
+        mel_full = wav_to_logmel(y, sr=self.sr, n_fft=self.n_fft, hop=self.hop, n_mels=self.n_mels)  # [T_full, F]
+        return mel_full, self.chunk_entries(len(y) / self.sr, midi, pid)
 
-        chunks = []
-        # 最大フレーム index（Timeトークンの終端含む定義に対応）
-        frame_max_template = int(round(2.048 * 1000 / self.step_ms))  # ≈205
-        frame_max_template = max(0, frame_max_template - 1)           # 204
+    def chunk_entries(self, total_sec, midi, pid):
+        """長さ total_sec の音声のチャンク境界とトークン列 -> [(fs, fe, token_ids, (s, e)), ...]"""
+        notes = load_notes(midi)
 
+        bounds = []
         for s, e in chunk_indices(total_sec):
-            # ---- ここが重要：Mel をチャンク範囲にスライス ----
             fs = sec_to_frame(s, self.sr, self.hop)
             fe = sec_to_frame(e, self.sr, self.hop)
             if fe <= fs:   # 念のため
                 continue
-            mel = mel_full[fs:fe, :]          # [T_chunk, F] だけ渡す
-
-            ev = []
-            ties = []
-            # チャンク内のノート抽出＋量子化（0..204に収める）
-            frame_max = frame_max_template
-            for on, off, p in notes:
-                if off <= s or on >= e:
+            bounds.append((fs, fe, s, e))
+
+        # 全チャンクのノート抽出＋量子化を一括で
+        per_chunk = assign_notes(notes, [b[2] for b in bounds], [b[3] for b in bounds], self.step_ms)
+        entries = []
+        for (fs, fe, s, e), (ev, ties) in zip(bounds, per_chunk):
+            token_ids = self.codec.encode(ev, pid, ties)
+            entries.append((fs, fe, token_ids, (s, e)))
+        return entries
+
+class AMTChunkDataset(Dataset):
+    """
+    チャンク単位のデータセット。1要素 = (mel[T_chunk,F], token_ids, (s,e))。
+    (ファイル, チャンク) の索引はメタデータ（soundfile.info）の長さだけから一度作り、
+    各要素はそのチャンク + STFT の文脈分のサンプルだけを読んでリサンプルする。
+    """
+    def __init__(self, pairs, sr=22050, hop=256, step_ms=10, n_fft=2048, n_mels=256, cache_dir=None,
+                 codec="absolute"):
+        self.pairs = pairs  # [(wav_path, midi_path, program_id), ...]
+        self.sr, self.hop, self.step_ms = sr, hop, step_ms
+        self.n_fft, self.n_mels = n_fft, n_mels
+        self.codec = get_codec(codec)
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = FeatureCache(cache_dir, **_cache_params(sr, n_fft, hop, n_mels, step_ms, self.codec))
+        self.frontend = get_feature_extractor(sr=sr, n_fft=n_fft, hop=hop, n_mels=n_mels)
+        self._notes = {}  # ワーカー内の MIDI ノートキャッシュ（ファイル index -> notes）
+        self._lengths = None
+
+        self.index = []  # [(file_idx, chunk_no, s, e, fs, fe), ...]
+        for i, (wav, _, _) in enumerate(pairs):
+            total_sec = self.frontend.num_samples(wav) / sr
+            j = 0
+            for s, e in chunk_indices(total_sec):
+                fs, fe = sec_to_frame(s, sr, hop), sec_to_frame(e, sr, hop)
+                if fe <= fs:
+                    continue
+                self.index.append((i, j, s, e, fs, fe)); j += 1
+
+    def __len__(self): return len(self.index)
+    def __getitem__(self, k):
+        i, j, s, e, fs, fe = self.index[k]
+        wav, midi, pid = self.pairs[i]
+        if self.cache is not None:
+            hit = self.cache.load(wav, midi, pid)
+            if hit is not None:
+                mel_full, entries = hit
+                _, _, token_ids, se = entries[j]
+                return mel_full[fs:fe, :], token_ids, se
+
+        # フレーム fs..fe-1 の窓が覆う範囲（center=True の先頭パディング n_fft//2 を含む）
+        pad = self.n_fft // 2
+        y = self.frontend.load_segment(wav, fs * self.hop - pad, (fe - 1) * self.hop - pad + self.n_fft)
+        mel = self.frontend.frames(y.unsqueeze(0))[0].numpy().astype(np.float32)  # [fe-fs, F]
+
+        if i not in self._notes:
+            if len(self._notes) >= 64:
+                self._notes.clear()
+            self._notes[i] = load_notes(midi)
+        ev, ties = chunk_events(self._notes[i], s, e, self.step_ms)
+        return mel, self.codec.encode(ev, pid, ties), (s, e)
+
+    def token_lengths(self):
+        """各チャンクのトークン長。音声はデコードせず、キャッシュのメタデータか MIDI だけから求める"""
+        if self._lengths is None:
+            lengths = np.zeros(len(self.index), dtype=np.int64)
+            by_file = {}
+            for k, (i, j, s, e, _, _) in enumerate(self.index):
+                by_file.setdefault(i, []).append((k, j, s, e))
+            for i, items in by_file.items():
+                wav, midi, pid = self.pairs[i]
+                hit = self.cache.load(wav, midi, pid) if self.cache is not None else None
+                if hit is not None:
+                    for k, j, _, _ in items:
+                        lengths[k] = len(hit[1][j][2])
                     continue
-                on_q  = max(0, min(ms_quantize(on - s, self.step_ms),  frame_max))
-                off_q = max(0, min(ms_quantize(off - s, self.step_ms), frame_max))
-                if on < s:  # 前チャンクから鳴ってる
-                    ties.append((p, ms_quantize(min(off, e) - s, self.step_ms)))
-                    on_q = 0
-                ev.append((on_q, off_q, p))
+                per_chunk = assign_notes(load_notes(midi), [it[2] for it in items], [it[3] for it in items],
+                                         self.step_ms)
+                for (k, _, _, _), (ev, ties) in zip(items, per_chunk):
+                    lengths[k] = len(self.codec.encode(ev, pid, ties))
+            self._lengths = lengths
+        return self._lengths
+
+def _cache_params(sr, n_fft, hop, n_mels, step_ms, codec):
+    # FeatureCache のキーになるパラメータ。absolute のときは codec を含めない（既存のキャッシュをそのまま使う）
+    params = dict(sr=sr, n_fft=n_fft, hop=hop, n_mels=n_mels, step_ms=step_ms)
+    if codec.name != "absolute":
+        params["codec"] = codec.name
+    return params
+
+def load_notes(midi):
+    """参照MIDIを読む -> (on_sec, off_sec, pitch) の配列（元のノート順）"""
+    pm = pretty_midi.PrettyMIDI(midi)
+    ns = [n for inst in pm.instruments for n in inst.notes]
+    return (np.array([n.start for n in ns], dtype=np.float64),
+            np.array([n.end for n in ns], dtype=np.float64),
+            np.array([n.pitch for n in ns], dtype=np.int64))
+
+def _quantize(t_sec, step_ms):
+    # ms_quantize と同じ計算順・同じ偶数丸め
+    return np.round(t_sec * 1000 / step_ms).astype(np.int64)
+
+def assign_notes(notes, starts, ends, step_ms=10):
+    """
+    全チャンク [s, e) へのノート割り当て＋量子化＋Tie判定を一括で行う -> [(ev, ties), ...]
+      ev: [N,3] (on_q, off_q, pitch)（元のノート順）  ties: [M,2] (pitch, remaining_ms)
+    オンセットでソートした索引を searchsorted し、off の累積最大で「もう鳴っていない」前方を飛ばす。
+    """
+    on, off, pitch = notes
+    starts, ends = np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64)
+    # 最大フレーム index（Timeトークンの終端含む定義に対応）
+    frame_max = int(round(2.048 * 1000 / step_ms))  # ≈205
+    frame_max = max(0, frame_max - 1)               # 204
+
+    order = np.argsort(on, kind="stable")
+    hi = np.searchsorted(on[order], ends, side="left")                                # on < e
+    lo = np.searchsorted(np.maximum.accumulate(off[order]), starts, side="right")     # これより前は全て off <= s
+    counts = np.maximum(hi - lo, 0)
+
+    # (チャンク, 候補ノート) を連結して一括処理
+    cid = np.repeat(np.arange(len(starts)), counts)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    idx = order[np.repeat(lo, counts) + np.arange(counts.sum()) - first]
+    s, e = starts[cid], ends[cid]
+    keep = off[idx] > s
+    cid, idx, s, e = cid[keep], idx[keep], s[keep], e[keep]
+    srt = np.lexsort((idx, cid))  # チャンク内は元のノート順（同時刻イベントの並びを従来どおりに）
+    cid, idx, s, e = cid[srt], idx[srt], s[srt], e[srt]
+
+    on_q = np.clip(_quantize(on[idx] - s, step_ms), 0, frame_max)
+    off_q = np.clip(_quantize(off[idx] - s, step_ms), 0, frame_max)
+    tie = on[idx] < s  # 前チャンクから鳴ってる
+    on_q[tie] = 0
+    tie_ms = _quantize(np.minimum(off[idx], e) - s, step_ms)
+
+    ev = np.stack([on_q, off_q, pitch[idx]], axis=1)
+    ties = np.stack([pitch[idx], tie_ms], axis=1)
+    bounds = np.searchsorted(cid, np.arange(len(starts) + 1))
+    return [(ev[a:b], ties[a:b][tie[a:b]]) for a, b in zip(bounds[:-1], bounds[1:])]
 
-            token_ids = encode_events(ev, pid, ties)
-            chunks.append((mel, token_ids, (s, e)))
+def chunk_events(notes, s, e, step_ms=10):
+    """チャンク [s, e) に掛かるノートを抽出＋量子化 -> (ev, ties)"""
+    return assign_notes(notes, [s], [e], step_ms)[0]
 
-        return chunks
+def random_chunks(n_songs, seed=0, song_sec=20.0, repeats=True, step_ms=10):
+    """
+    符号化の往復確認用のランダムな曲をチャンクに割り当てる -> [(ev, ties), ...]。
+    和音（粗いグリッドで同時オンセット）・チャンクをまたぐ長い音・長さ 0 になる短い音を含み、
+    repeats なら同じピッチの連打（直前の音の終わりに打ち直す）も入れる（False なら同じピッチの間を 50ms 以上空ける）
+    """
+    rng = np.random.default_rng(seed)
+    gap = 0.0 if repeats else 0.05
+    out = []
+    for _ in range(n_songs):
+        n = int(rng.integers(1, 80))
+        on = np.sort(rng.choice(np.arange(0, song_sec, 0.05), n))
+        dur = rng.choice([0.003, 0.05, 0.1, 0.5, 1.0, 3.0], n)
+        pitch = rng.integers(40, 80, n)
+        for i in range(1, n):
+            if repeats and rng.random() < 0.1:
+                on[i], pitch[i] = on[i - 1] + dur[i - 1], pitch[i - 1]
+        keep, until = [], {}
+        for i in np.argsort(on, kind="stable"):  # 同じピッチの重なりは MIDI でも表せないので除く
+            if until.get(pitch[i], -1.0) <= on[i] - gap + 1e-9:
+                keep.append(i); until[pitch[i]] = on[i] + dur[i]
+        keep = np.sort(keep)
+        spans = chunk_indices(song_sec + 3.0)
+        out += assign_notes((on[keep], on[keep] + dur[keep], pitch[keep]),
+                            [s for s, _ in spans], [e for _, e in spans], step_ms)
+    return out
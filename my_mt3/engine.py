@@ -0,0 +1,220 @@
+# amtx/engine.py  (CPU推論エンジン: int8動的量子化 / torch.compile / TorchScript・ONNX書き出し)
+import contextlib, os, time
+import numpy as np
+import torch, torch.nn as nn
+from .model import MT3Mini, _block_step, load_checkpoint
+from .cache import file_digest
+
+VARIANTS = ("fp32", "int8", "compile", "torchscript", "onnx")
+
+def load_model(ckpt, device="cpu"):
+    """チェックポイントから（保存された構成どおりの）MT3Mini を復元する。ckpt_id はチェックポイントの内容ハッシュ"""
+    model = load_checkpoint(ckpt, map_location=device).to(device).eval()
+    model.ckpt_id = file_digest(ckpt)
+    return model
+
+def load_engine(ckpt, variant="fp32", export_dir=None):
+    """チェックポイントを読み込み、指定バリアントの推論エンジンを返す（transcribe / greedy_decode にそのまま渡せる）"""
+    engine = build_engine(load_model(ckpt), variant, export_dir=export_dir)
+    engine.ckpt_id = f"{file_digest(ckpt)}:{variant}"  # ChunkCache のキー（バリアントごとに出力が違い得る）
+    return engine
+
+def build_engine(model, variant="fp32", export_dir=None):
+    """
+    fp32 の MT3Mini から推論用バリアントを作る。返り値は model.enc(mel) / model.dec.init_cache / model.dec.step を持つ。
+      fp32        : そのまま
+      int8        : Encoder/Decoder の nn.Linear を動的 int8 量子化
+      compile     : torch.compile（エンコーダと1ステップデコーダ）
+      torchscript : エンコーダ / 1ステップデコーダを別グラフとして trace（export_dir があれば保存）
+      onnx        : 同じ2グラフを ONNX に書き出し onnxruntime で実行（onnx / onnxruntime が必要）
+    """
+    model = model.cpu().eval()
+    if variant == "fp32":
+        return model
+    if variant == "int8":
+        q = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        q.enc = _NoFastPath(q.enc)  # 量子化 Linear は TransformerEncoderLayer の fast path 非対応
+        return q.eval()
+    if variant == "compile":
+        model.enc = torch.compile(model.enc, dynamic=True)
+        model.dec.step = torch.compile(model.dec.step, dynamic=True)
+        return model
+    if variant in ("torchscript", "onnx"):
+        enc, step = EncoderGraph(model).eval(), StepDecoderGraph(model).eval()
+        if variant == "torchscript":
+            enc_g, step_g = _trace(enc, step)
+            if export_dir is not None:
+                os.makedirs(export_dir, exist_ok=True)
+                enc_g.save(os.path.join(export_dir, "encoder.pt"))
+                step_g.save(os.path.join(export_dir, "step_decoder.pt"))
+            return ExportedMT3(enc_g, step_g, model.config)
+        return ExportedMT3(*_onnx_sessions(enc, step, export_dir), model.config)
+    raise ValueError(f"unknown variant: {variant} (choose from {VARIANTS})")
+
+@contextlib.contextmanager
+def _no_fastpath():
+    """nn.TransformerEncoderLayer の fused fast path を一時的に無効化する"""
+    prev = torch.backends.mha.get_fastpath_enabled()
+    torch.backends.mha.set_fastpath_enabled(False)
+    try:
+        yield
+    finally:
+        torch.backends.mha.set_fastpath_enabled(prev)
+
+class _NoFastPath(nn.Module):
+    def __init__(self, mod):
+        super().__init__()
+        self.mod = mod
+    def forward(self, *args):
+        with _no_fastpath():
+            return self.mod(*args)
+
+# ===== 書き出し用グラフ（テンソルのみを入出力に持つ） =====
+class EncoderGraph(nn.Module):
+    """mel [B,T,F] -> 各層の cross-attention K/V [L,B,H,T,Dh] x2（Decoder.init_cache まで含めたエンコーダ）"""
+    def __init__(self, model):
+        super().__init__()
+        self.enc, self.dec = model.enc, model.dec
+    def forward(self, mel):
+        cache = self.dec.init_cache(self.enc(mel))
+        return torch.stack([c[2] for c in cache]), torch.stack([c[3] for c in cache])
+
+class StepDecoderGraph(nn.Module):
+    """1トークンぶんのデコード: (y [B,1], pos [1], self_k/v [L,B,H,S,Dh], mem_k/v) -> (logits [B,V], self_k/v [L,B,H,S+1,Dh])"""
+    def __init__(self, model):
+        super().__init__()
+        self.dec = model.dec
+    def forward(self, y, pos, self_k, self_v, mem_k, mem_v):
+        h = self.dec.emb(y) + self.dec.pos.pe.index_select(0, pos)
+        ks, vs = [], []
+        for l, blk in enumerate(self.dec.blocks):
+            c = [self_k[l], self_v[l], mem_k[l], mem_v[l]]
+            h = _block_step(blk, h, c)
+            ks.append(c[0]); vs.append(c[1])
+        return self.dec.lm(h)[:, -1], torch.stack(ks), torch.stack(vs)
+
+def _example_inputs(model, B=1, T=177, S=3):
+    L = len(model.dec.blocks)
+    H, d = model.dec.blocks[0].self_attn.num_heads, model.dec.emb.embedding_dim
+    mel = torch.randn(B, T, model.enc.n_mels)
+    T = -(-T // model.enc.subsample)  # エンコーダ出力のフレーム数
+    kv = torch.zeros(L, B, H, S, d // H)
+    mem = torch.zeros(L, B, H, T, d // H)
+    return mel, (torch.zeros(B, 1, dtype=torch.long), torch.tensor([S]), kv, kv, mem, mem)
+
+def _trace(enc, step):
+    mel, step_args = _example_inputs(enc)
+    with torch.no_grad():
+        return torch.jit.trace(enc, (mel,)), torch.jit.trace(step, step_args)
+
+def _onnx_sessions(enc, step, export_dir):
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("variant='onnx' には onnx / onnxruntime が必要です: pip install onnx onnxruntime") from e
+    export_dir = export_dir or "onnx_export"
+    os.makedirs(export_dir, exist_ok=True)
+    mel, step_args = _example_inputs(enc)
+    enc_path, step_path = os.path.join(export_dir, "encoder.onnx"), os.path.join(export_dir, "step_decoder.onnx")
+    kv_axes = {1: "batch", 3: "seq"}
+    with torch.no_grad(), _no_fastpath():  # fused encoder op は ONNX 非対応
+        torch.onnx.export(enc, (mel,), enc_path, input_names=["mel"], output_names=["mem_k", "mem_v"],
+                          dynamic_axes={"mel": {0: "batch", 1: "frames"},
+                                        "mem_k": {1: "batch", 3: "frames"}, "mem_v": {1: "batch", 3: "frames"}},
+                          dynamo=False)
+        torch.onnx.export(step, step_args, step_path,
+                          input_names=["y", "pos", "self_k", "self_v", "mem_k", "mem_v"],
+                          output_names=["logits", "new_k", "new_v"],
+                          dynamic_axes={"y": {0: "batch"}, "self_k": kv_axes, "self_v": kv_axes,
+                                        "mem_k": {1: "batch", 3: "frames"}, "mem_v": {1: "batch", 3: "frames"},
+                                        "logits": {0: "batch"}, "new_k": kv_axes, "new_v": kv_axes},
+                          dynamo=False)
+    enc_s, step_s = ort.InferenceSession(enc_path), ort.InferenceSession(step_path)
+
+    def run_enc(mel):
+        k, v = enc_s.run(None, {"mel": mel.numpy()})
+        return torch.from_numpy(k), torch.from_numpy(v)
+    def run_step(*args):
+        names = ["y", "pos", "self_k", "self_v", "mem_k", "mem_v"]
+        return tuple(torch.from_numpy(o) for o in step_s.run(None, {n: a.numpy() for n, a in zip(names, args)}))
+    return run_enc, run_step
+
+class ExportedMT3:
+    """書き出したエンコーダ / 1ステップデコーダを MT3Mini と同じ呼び出し方（enc, dec.init_cache, dec.step）で包む"""
+    def __init__(self, enc, step, config=None):
+        self.config = dict(config or {})  # 元の MT3Mini の構成（codec などを transcribe が参照する）
+        self.enc = lambda mel: enc(mel.cpu())
+        self.dec = _ExportedDecoder(step)
+    def eval(self):
+        return self
+
+class _ExportedDecoder:
+    def __init__(self, step):
+        self.graph = step
+    def init_cache(self, mem):
+        mk, mv = mem
+        L, B, H, _, Dh = mk.shape
+        empty = mk.new_zeros(B, H, 0, Dh)
+        return [[empty, empty, mk[l], mv[l]] for l in range(L)]
+    def step(self, y_new, cache):
+        pos = torch.tensor([cache[0][0].size(2)])
+        stack = lambda i: torch.stack([c[i] for c in cache])
+        logits, k, v = self.graph(y_new.cpu(), pos, stack(0), stack(1), stack(2), stack(3))
+        for l, c in enumerate(cache):
+            c[0], c[1] = k[l], v[l]
+        return logits.unsqueeze(1)
+
+# ===== パリティ検証 / ベンチマーク =====
+def compare_variants(model, mels, variants=VARIANTS, refs=None, export_dir=None, step_ms=10):
+    """
+    fp32 を基準に各バリアントを比較する。基準は variants に関係なく常に元の fp32 モデルでデコードした出力で、
+    agreement / onset_f1_delta はどのバリアントもこれとの比較
+      mels: チャンク log-Mel のリスト
+      refs: 各チャンクの正解 PrettyMIDI（省略時は fp32 出力を正解として onset F1 を測る）
+    batch_agreement / batch_invariant は同じバリアントの batch_greedy_decode（全チャンクを1バッチ）と
+    チャンクごとの greedy_decode の一致。動的 int8 は活性のスケールをバッチ全体から決めるので一致しないことがある
+    返り値: {variant: {agreement, batch_agreement, batch_invariant, onset_f1, onset_f1_delta,
+                       ms_per_chunk, chunks_per_sec, tokens_per_sec}}
+    """
+    from .infer import batch_greedy_decode, greedy_decode, model_codec, to_midi_from_tokens
+    from .metrics import onset_f1
+
+    def run(engine):
+        greedy_decode(engine, mels[0], device="cpu")  # warmup（compile/trace の初回コストを除く）
+        t0 = time.perf_counter()
+        outs = [greedy_decode(engine, m, device="cpu") for m in mels]
+        return outs, time.perf_counter() - t0
+
+    codec = model_codec(model)
+    midi = lambda outs: [to_midi_from_tokens(o, step_ms=step_ms, codec=codec) for o in outs]
+    fp32 = run(_clone(model))
+    base = fp32[0]
+    gts = refs if refs is not None else midi(base)
+    f1 = lambda outs: float(np.mean([onset_f1(p, g)[2] for p, g in zip(midi(outs), gts)]))
+    f1_base = f1(base)
+    results = {}
+    for v in variants:
+        try:
+            engine = build_engine(_clone(model), v, export_dir=export_dir and os.path.join(export_dir, v))
+        except ImportError as e:
+            print(f"[skip] {v}: {e}")
+            continue
+        outs, sec = fp32 if v == "fp32" else run(engine)
+        batched = batch_greedy_decode(engine, mels, device="cpu")
+        score = f1(outs)
+        results[v] = {"agreement": float(np.mean([_agreement(a, b) for a, b in zip(outs, base)])),
+                      "batch_agreement": float(np.mean([_agreement(a, b) for a, b in zip(batched, outs)])),
+                      "batch_invariant": batched == outs, "onset_f1": score, "onset_f1_delta": score - f1_base,
+                      "ms_per_chunk": 1000 * sec / len(mels), "chunks_per_sec": len(mels) / sec,
+                      "tokens_per_sec": sum(map(len, outs)) / sec}
+    return results
+
+def _clone(model):
+    clone = MT3Mini(**model.config)
+    clone.load_state_dict(model.state_dict())
+    return clone.eval()
+
+def _agreement(a, b):
+    """位置ごとのトークン一致率（長さが違う分は不一致）"""
+    n = max(len(a), len(b))
+    return sum(x == y for x, y in zip(a, b)) / max(1, n)
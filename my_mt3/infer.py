@@ -1,16 +1,30 @@
+import contextlib, os, time
+import numpy as np
 import torch, pretty_midi
 from .audio import load_wav_mono, wav_to_logmel, chunk_indices, ms_quantize
-from .tokenizer import VOCAB
+from .cache import model_digest
+from .dataset import sec_to_frame
+from .tokenizer import VOCAB, decode_events, encode_events
 MAX_STEPS = 1024
+# 空チャンクのデコーダ出力（系列は PRG + <eos>。先頭の PRG はデコーダに与える側なので出力には含まない）
+EMPTY_CHUNK = encode_events([], 0, [])[1:]
 
-def greedy_decode(model, mel, device="cuda"):
+def greedy_decode(model, mel, device="cuda", use_cache=True):
+    """
+    1チャンク分の log-Mel [T,F] を貪欲デコードしてトークン列を返す。
+    use_cache=True なら KVキャッシュで新しいトークンだけを処理する（出力は従来版と同一）。
+    """
     model.eval()
     with torch.no_grad():
         mem = model.enc(torch.tensor(mel, dtype=torch.float32).unsqueeze(0).to(device))
-        y = torch.tensor([[list(VOCAB.program.values())[0]]], dtype=torch.long, device=device)  # 例: PRG_0から
+        y = torch.tensor([[int(VOCAB.program_ids[0])]], dtype=torch.long, device=device)  # 例: PRG_0から
+        cache = model.dec.init_cache(mem) if use_cache else None
         out=[]
         for _ in range(MAX_STEPS):
-            logits = model.dec(y, mem)[:,-1,:]  # [B,V]
+            if use_cache:
+                logits = model.dec.step(y[:, -1:], cache)[:,-1,:]
+            else:
+                logits = model.dec(y, mem)[:,-1,:]  # [B,V]
             nxt = logits.argmax(-1)            # [B]
             tok = nxt.item()
             out.append(tok); 
@@ -18,24 +32,267 @@ def greedy_decode(model, mel, device="cuda"):
             y = torch.cat([y, nxt.unsqueeze(0)], dim=1)
     return out
 
-def to_midi_from_tokens(token_ids, sr=22050, step_ms=10):
-    # MVP: 単一プログラムと仮定し、TIM/NOTE_ON/OFFからノートを復元
+def batch_greedy_decode(model, mels, device="cuda"):
+    """
+    複数チャンク [T_i,F] をまとめてエンコードし、バッチで貪欲デコードする。
+    フレーム数の違うチャンク（176/177 など）はゼロ詰めせず長さごとにまとめるので、出力は greedy_decode と同一。
+    返り値は各チャンクのトークン列（greedy_decode と同じく<eos>を含む）
+    """
+    groups = {}
+    for i, mel in enumerate(mels):
+        groups.setdefault(len(mel), []).append(i)
+    out = [None] * len(mels)
+    for idx in groups.values():
+        for i, ids in zip(idx, _batch_greedy_decode([mels[i] for i in idx], model, device)):
+            out[i] = ids
+    return out
+
+def _batch_greedy_decode(mels, model, device):
+    """同じ長さのチャンクをバッチで貪欲デコード。行ごとに<eos>で終了判定し、終わった行はキャッシュごとバッチから外す"""
+    model.eval()
+    with torch.no_grad():
+        x = torch.as_tensor(np.stack(mels), dtype=torch.float32).to(device)
+        mem = model.enc(x)
+        cache = model.dec.init_cache(mem)
+        y = torch.full((len(mels), 1), int(VOCAB.program_ids[0]), dtype=torch.long, device=device)
+        rows = torch.arange(len(mels), device=device)  # 未終了行の元インデックス
+        out = [[] for _ in mels]
+        for _ in range(MAX_STEPS):
+            nxt = model.dec.step(y, cache)[:,-1,:].argmax(-1)  # [B_active]
+            for r, tok in zip(rows.tolist(), nxt.tolist()):
+                out[r].append(tok)
+            live = nxt != VOCAB.eos
+            if not live.any(): break
+            if not live.all():
+                rows, nxt = rows[live], nxt[live]
+                for c in cache:
+                    c[:] = [t[live] for t in c]
+            y = nxt.unsqueeze(1)
+    return out
+
+def check_speculative(model, draft):
+    """
+    speculative_decode に使えるか確かめ、使えなければ ValueError。
+    本体: 検証で k+1 トークンを因果マスク付きで1回の step に流すので、書き出したエンジン（1トークンずつの
+    グラフ）や compile は不可。int8 はバッチ・系列の形で活性のスケールが変わり greedy_decode と一致しないので不可。
+    ドラフト: 未処理分をまとめて流すので nn.Module のデコーダが必要（int8 は可。採用率が変わるだけ）
+    """
+    from .model import MT3Mini
+    if not isinstance(model, MT3Mini) or "step" in vars(model.dec) or _is_quantized(model):
+        raise ValueError("speculative_decode needs an fp32 eager MT3Mini as the main model "
+                         f"(got {type(model).__name__}; int8 / compile / torchscript / onnx variants are not supported)")
+    if not isinstance(draft, torch.nn.Module) or "step" in vars(draft.dec):
+        raise ValueError(f"speculative_decode needs an eager MT3Mini as the draft (got {type(draft).__name__})")
+
+def _is_quantized(model):
+    return isinstance(model, torch.nn.Module) and \
+        any(type(m).__module__.startswith("torch.ao.nn.quantized") for m in model.modules())
+
+def is_batch_invariant(model):
+    """
+    チャンクの出力がバッチに一緒に入った他のチャンクに依らないか。動的 int8 量子化は活性のスケールを
+    バッチ全体から求めるので False（batch_greedy_decode と greedy_decode の出力が変わり得る）
+    """
+    return not _is_quantized(model)
+
+def speculative_decode(model, draft, mel, device="cuda", k=4, stats=None):
+    """
+    小さいドラフトモデル（MT3Mini の tiny プリセットなど）で k トークンを先読みし、本体の Decoder が1回の
+    step で k+1 位置をまとめて検証する投機的デコード。本体の argmax と一致した先頭部分を採用し、最初の
+    不一致位置では本体の予測を採る（全部一致なら k+1 個目も本体の予測）ので、出力は greedy_decode(model, mel) と同一。
+    不採用分は本体・ドラフトの KVキャッシュを切り詰めて捨てる。
+    stats に dict を渡すと rounds / proposed / accepted / tokens / draft_steps を加算する。
+    本体は fp32 の MT3Mini に限る（check_speculative を参照）
+    """
+    check_speculative(model, draft)
+    model.eval(); draft.eval()
+    with torch.no_grad():
+        x = torch.tensor(mel, dtype=torch.float32).unsqueeze(0).to(device)
+        cache, d_cache = model.dec.init_cache(model.enc(x)), draft.dec.init_cache(draft.enc(x))
+        seq = [int(VOCAB.program_ids[0])]  # 本体のキャッシュは常に seq[:-1] まで処理済み
+        d_len = 0                          # ドラフトのキャッシュが処理済みのトークン数
+        out, n_prop, n_acc, n_rounds, n_draft = [], 0, 0, 0, 0
+        while len(out) < MAX_STEPS:
+            # ドラフト: 未処理分をまとめて流し、以降は1トークンずつ k 個提案（<eos> を出したらそこまで）
+            kk = min(k, MAX_STEPS - len(out) - 1)
+            prop, feed = [], seq[d_len:]
+            while len(prop) < kk:
+                nxt = draft.dec.step(torch.tensor([feed], device=device), d_cache)[0, -1].argmax().item()
+                n_draft += 1
+                d_len += len(feed)
+                prop.append(nxt)
+                if nxt == VOCAB.eos:
+                    break
+                feed = [nxt]
+            # 本体: 直前のトークン + 提案を1回で検証
+            pred = model.dec.step(torch.tensor([seq[-1:] + prop], device=device), cache)[0].argmax(-1).tolist()
+            n = 0
+            while n < len(prop) and prop[n] == pred[n]:
+                n += 1
+            new = prop[:n] + [pred[n]]
+            n_rounds += 1; n_prop += len(prop); n_acc += n
+            # 採用した分だけ残してキャッシュを切り詰める（本体は新しい seq[:-1]、ドラフトはその範囲内）
+            past = len(seq) - 1
+            seq += new
+            _truncate_cache(cache, past + 1 + n)
+            d_len = min(d_len, len(seq) - 1)
+            _truncate_cache(d_cache, d_len)
+            out += new
+            if VOCAB.eos in new:
+                out = out[:len(out) - len(new) + new.index(VOCAB.eos) + 1]
+                break
+        out = out[:MAX_STEPS]
+    if stats is not None:
+        for key, v in (("rounds", n_rounds), ("proposed", n_prop), ("accepted", n_acc),
+                       ("tokens", len(out)), ("draft_steps", n_draft)):
+            stats[key] = stats.get(key, 0) + v
+    return out
+
+def speculative_stats(stats):
+    """speculative_decode の stats -> 採用率・1ラウンド（本体1回の step）あたりのトークン数など"""
+    r = dict(stats)
+    r["acceptance_rate"] = stats.get("accepted", 0) / max(1, stats.get("proposed", 0))
+    r["tokens_per_main_step"] = stats.get("tokens", 0) / max(1, stats.get("rounds", 0))
+    return r
+
+def _truncate_cache(cache, n):
+    """Decoder.step の self-attention キャッシュを先頭 n トークンぶんに切り詰める"""
+    for c in cache:
+        if c[0] is not None:
+            c[0], c[1] = c[0][:, :, :n], c[1][:, :, :n]
+
+def chunk_logmels(y, sr=22050, hop=256):
+    """波形全体の log-Mel を AMTDataset と同じ規則でチャンクに切り出す -> [(mel[T,F], (s,e)), ...]"""
+    mel_full = wav_to_logmel(y, sr=sr, hop=hop)
+    out = []
+    for s, e in chunk_indices(len(y) / sr):
+        fs, fe = sec_to_frame(s, sr, hop), sec_to_frame(e, sr, hop)
+        if fe > fs:
+            out.append((mel_full[fs:fe, :], (s, e)))
+    return out
+
+def is_silent(mel, silence_db, edge=5):
+    """
+    チャンクの log-Mel（dB）の最大値が silence_db 未満なら無音とみなす。
+    両端 edge フレーム（既定 5 = n_fft//2 // hop + チャンク境界の丸め 1）は STFT 窓が隣のチャンクの音を拾うので判定に使わない
+    """
+    inner = mel[edge:len(mel) - edge] if len(mel) > 2 * edge else mel
+    return float(np.max(inner)) < silence_db
+
+def transcribe(audio, model, sr=22050, hop=256, device="cuda", batch_size=64, stats=None,
+               draft=None, k=4, spec_stats=None, silence_db=None, cache=None, skip_stats=None, codec=None):
+    """
+    曲全体を転写して PrettyMIDI を返す。
+    audio: WAVパス、または sr でサンプリング済みのモノラル波形 [T]
+    全チャンクを batch_size ずつまとめてエンコード/デコードし、各チャンクのノートを開始時刻だけずらして結合する。
+    stats に dict を渡すと段階ごとの処理時間 [s]（load / features / decode / post）を加算する。
+    draft を渡すとチャンクごとに speculative_decode(model, draft, k=k) でデコードし（出力は同一。本体は fp32 のみ）、
+    spec_stats に採用数などを加算する（speculative_stats で採用率にまとめられる）
+    silence_db を指定すると is_silent なチャンクはモデルを通さず EMPTY_CHUNK にする。
+    cache（ChunkCache）を渡すと同じ内容のチャンク（曲内の繰り返しを含む）はデコードせずキャッシュから返す。
+    skip_stats に chunks / silent / cache_hits / decoded / decode_sec を加算する（skip_summary でまとめられる）
+    codec はトークン列の符号化方式（省略時はモデルの構成のもの。model_codec を参照）
+    """
+    codec = codec or model_codec(model)
+    if draft is not None:
+        check_speculative(model, draft)
+    timer = _StageTimer(stats)
+    with timer("load"):
+        if isinstance(audio, (str, os.PathLike)):
+            y, _ = load_wav_mono(str(audio), sr=sr)
+        else:
+            y = np.asarray(audio, dtype=np.float32)
+    with timer("features"):
+        chunks = chunk_logmels(y, sr=sr, hop=hop)
+
+    # 無音・キャッシュ済みのチャンクを除き、残りを内容ごとに1回だけデコードする
+    token_lists = [None] * len(chunks)
+    pending = {}  # キー -> このチャンク列での位置のリスト
+    n_silent = n_hits = 0
+    model_id = model_digest(model) if cache is not None else None
+    for i, (mel, _) in enumerate(chunks):
+        if silence_db is not None and is_silent(mel, silence_db):
+            token_lists[i] = list(EMPTY_CHUNK); n_silent += 1
+            continue
+        key = cache.key(mel, model_id) if cache is not None else i
+        if key in pending:
+            pending[key].append(i); n_hits += 1
+            continue
+        ids = cache.get(key) if cache is not None else None
+        if ids is not None:
+            token_lists[i] = ids; n_hits += 1
+        else:
+            pending[key] = [i]
+
+    keys = list(pending)
+    t0 = time.perf_counter()
+    for b in range(0, len(keys), batch_size):
+        batch = keys[b:b + batch_size]
+        mels = [chunks[pending[key][0]][0] for key in batch]
+        with timer("decode"):
+            if draft is None:
+                outs = batch_greedy_decode(model, mels, device=device)
+            else:
+                outs = [speculative_decode(model, draft, mel, device=device, k=k, stats=spec_stats) for mel in mels]
+        for key, ids in zip(batch, outs):
+            if cache is not None:
+                cache.put(key, ids)
+            for i in pending[key]:
+                token_lists[i] = list(ids)
+    if skip_stats is not None:
+        for name, v in (("chunks", len(chunks)), ("silent", n_silent), ("cache_hits", n_hits),
+                        ("decoded", len(keys)), ("decode_sec", time.perf_counter() - t0)):
+            skip_stats[name] = skip_stats.get(name, 0) + v
+
+    with timer("post"):
+        return merge_chunks([se for _, se in chunks], token_lists, sr=sr, codec=codec)
+
+def merge_chunks(spans, token_lists, sr=22050, codec="absolute"):
+    """各チャンク (s, e) のトークン列をノートにし、開始時刻 s だけずらして1つの PrettyMIDI にまとめる"""
+    pm = pretty_midi.PrettyMIDI()
+    inst = pretty_midi.Instrument(program=0)
+    for (s, _e), ids in zip(spans, token_lists):
+        for n in to_midi_from_tokens(ids, sr=sr, codec=codec).instruments[0].notes:
+            n.start += s; n.end += s
+            inst.notes.append(n)
+    pm.instruments.append(inst)
+    return pm
+
+def skip_summary(stats):
+    """transcribe の skip_stats -> キャッシュヒット率、スキップしたチャンクの割合、省いたデコード時間の見積り [s]"""
+    r = dict(stats)
+    chunks, silent, hits, decoded = (stats.get(k, 0) for k in ("chunks", "silent", "cache_hits", "decoded"))
+    r["hit_rate"] = hits / max(1, chunks - silent)
+    r["skipped_ratio"] = (silent + hits) / max(1, chunks)
+    r["saved_sec_est"] = (silent + hits) * stats.get("decode_sec", 0.0) / max(1, decoded)
+    return r
+
+class _StageTimer:
+    """with timer("name"): ... の経過時間を stats[name] に加算する（stats=None なら何もしない）"""
+    def __init__(self, stats):
+        self.stats = stats
+    @contextlib.contextmanager
+    def __call__(self, name):
+        if self.stats is None:
+            yield; return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stats[name] = self.stats.get(name, 0.0) + time.perf_counter() - t0
+
+def model_codec(model):
+    """モデルの構成（MT3Mini.config）にある符号化方式。構成を持たないもの・codec の無い旧チェックポイントは absolute"""
+    return getattr(model, "config", {}).get("codec", "absolute")
+
+def to_midi_from_tokens(token_ids, sr=22050, step_ms=10, codec="absolute"):
+    # MVP: 単一プログラムと仮定し、TIM/NOTE_ON/OFFからノートを復元（decode_events で配列のまま処理）
     pm = pretty_midi.PrettyMIDI()
     inst = pretty_midi.Instrument(program=0)
-    cur_ms=0; onsets={}
-    for tid in token_ids:
-        tok = VOCAB.itos[tid]
-        if tok.startswith("TIM_"):
-            cur_ms = int(tok.split("_")[1])*step_ms
-        elif tok.startswith("NON_"):
-            p = int(tok.split("_")[1]); onsets[p]=cur_ms
-        elif tok.startswith("NOF_"):
-            p = int(tok.split("_")[1])
-            if p in onsets:
-                on = onsets.pop(p)
-                inst.notes.append(pretty_midi.Note(velocity=80, pitch=p,
-                                                   start=on/1000.0, end=cur_ms/1000.0))
-        elif tok == "<eos>":
-            break
+    for on, off, p in decode_events(token_ids, codec=codec).tolist():
+        if off <= on:  # 同じ TIM の NON/NOF（長さ 0）は PrettyMIDI が受け付けないので捨てる
+            continue
+        inst.notes.append(pretty_midi.Note(velocity=80, pitch=p,
+                                           start=on*step_ms/1000.0, end=off*step_ms/1000.0))
     pm.instruments.append(inst)
-    return pm
\ No newline at end of file
+    return pm
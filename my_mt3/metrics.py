@@ -1,3 +1,5 @@
+import numpy as np
+
 def onset_f1(pred_pm, ref_pm, tol_ms=50):
     def onsets(pm):
         return sorted(int(n.start*1000) for inst in pm.instruments for n in inst.notes)
@@ -9,4 +11,151 @@ def onset_f1(pred_pm, ref_pm, tol_ms=50):
         else: j+=1
     prec = tp/max(1,len(P)); rec = tp/max(1,len(R))
     f1 = 2*prec*rec/max(1e-9,prec+rec)
-    return prec, rec, f1
\ No newline at end of file
+    return prec, rec, f1
+
+# ===== NumPy版: ピッチ考慮のノート/フレーム評価（onset_f1 は比較用に残す） =====
+
+def notes_from_pm(pm):
+    """PrettyMIDI -> (onset_sec, offset_sec, pitch) の配列"""
+    ns = [n for inst in pm.instruments for n in inst.notes]
+    return (np.array([n.start for n in ns], dtype=np.float64),
+            np.array([n.end for n in ns], dtype=np.float64),
+            np.array([n.pitch for n in ns], dtype=np.int64))
+
+def _as_notes(x):
+    """PrettyMIDI / (on, off, pitch) のタプル / [N,3] 配列を (on, off, pitch) にそろえる"""
+    if hasattr(x, "instruments"):
+        return notes_from_pm(x)
+    if isinstance(x, tuple):
+        return tuple(np.asarray(a) for a in x)
+    x = np.asarray(x, dtype=np.float64).reshape(-1, 3)
+    return x[:, 0], x[:, 1], x[:, 2].astype(np.int64)
+
+def _candidates(ref, est, onset_tol, offset_ratio, offset_min):
+    """同じピッチでオンセット差が onset_tol 以内（offset_ratio があればオフセット条件も）の (ref, est) 組"""
+    r_on, r_off, r_p = ref
+    e_on, e_off, e_p = est
+    if not len(r_on) or not len(e_on):
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    # (ピッチ, オンセット) を1本の軸に並べて窓を searchsorted で切る
+    stride = max(r_on.max(), e_on.max()) - min(r_on.min(), e_on.min()) + 2 * onset_tol + 1.0
+    key_e = e_p * stride + e_on
+    order = np.argsort(key_e, kind="stable")
+    key_e = key_e[order]
+    key_r = r_p * stride + r_on
+    lo = np.searchsorted(key_e, key_r - onset_tol - 1e-9, side="left")
+    hi = np.searchsorted(key_e, key_r + onset_tol + 1e-9, side="right")
+    counts = hi - lo
+    ri = np.repeat(np.arange(len(r_on)), counts)
+    ei = order[np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+    keep = e_p[ei] == r_p[ri]
+    if offset_ratio is not None:
+        tol = np.maximum(offset_min, offset_ratio * (r_off[ri] - r_on[ri]))
+        keep &= np.abs(e_off[ei] - r_off[ri]) <= tol + 1e-9
+    return ri[keep], ei[keep]
+
+def _max_matching(ri, ei):
+    """候補辺 (ri, ei) 上の最大二部マッチング（増加路法）。一致数を返す"""
+    if not len(ri):
+        return 0
+    # 候補が1対1しかない辺は即確定（大半のノートはここで終わる）
+    r_deg = np.bincount(ri); e_deg = np.bincount(ei)
+    simple = (r_deg[ri] == 1) & (e_deg[ei] == 1)
+    n = int(simple.sum())
+    ri, ei = ri[~simple], ei[~simple]
+    adj = {}
+    for r, e in zip(ri.tolist(), ei.tolist()):
+        adj.setdefault(r, []).append(e)
+    match_e, match_r = {}, {}
+    for root in adj:
+        # BFS で root から未マッチの est への交互路を探す
+        parent, frontier, seen, found = {}, [root], set(), None
+        while frontier and found is None:
+            nxt = []
+            for r in frontier:
+                for e in adj[r]:
+                    if e in seen:
+                        continue
+                    seen.add(e); parent[e] = r
+                    if e not in match_e:
+                        found = e; break
+                    nxt.append(match_e[e])
+                if found is not None:
+                    break
+            frontier = nxt
+        e = found
+        while e is not None:  # 交互路に沿って付け替え
+            r = parent[e]
+            e_prev = match_r.get(r)
+            match_e[e], match_r[r] = r, e
+            e = e_prev
+        n += found is not None
+    return n
+
+def _prf(tp, n_est, n_ref):
+    p = tp / max(1, n_est); r = tp / max(1, n_ref)
+    return p, r, 2 * p * r / max(1e-9, p + r)
+
+def note_prf(ref, est, onset_tol=0.05, with_offset=False, offset_ratio=0.2, offset_min=0.05):
+    """
+    ピッチ考慮のノート単位 P/R/F1（最大二部マッチング）。
+    with_offset=True ならオフセットも max(offset_min, offset_ratio * 正解ノート長) 以内を要求する（mir_eval と同じ規約）
+    """
+    ref, est = _as_notes(ref), _as_notes(est)
+    ri, ei = _candidates(ref, est, onset_tol, offset_ratio if with_offset else None, offset_min)
+    return _prf(_max_matching(ri, ei), len(est[0]), len(ref[0]))
+
+def _frame_counts(ref, est, fps):
+    """
+    ピアノロールを作らずに (両方で鳴っているフレーム数, 予測のフレーム数, 正解のフレーム数) を数える。
+    (ピッチ, フレーム) 順に並べた開始/終了イベントを累積し、イベント間の区間長を足し合わせる
+    """
+    frames = lambda t: np.maximum(np.round(t * fps).astype(np.int64), 0)
+    p = np.concatenate([ref[2], ref[2], est[2], est[2]]).astype(np.int64)
+    f = np.concatenate([frames(ref[0]), frames(ref[1]), frames(est[0]), frames(est[1])])
+    nr, ne = len(ref[0]), len(est[0])
+    dr = np.concatenate([np.ones(nr), -np.ones(nr), np.zeros(2 * ne)]).astype(np.int64)
+    de = np.concatenate([np.zeros(2 * nr), np.ones(ne), -np.ones(ne)]).astype(np.int64)
+    if not len(p):
+        return 0, 0, 0
+    key = p * (f.max() + 1) + f
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    ar, ae = np.cumsum(dr[order]) > 0, np.cumsum(de[order]) > 0
+    # ピッチの最後のイベント後は累積が 0 に戻るので、ピッチをまたぐ区間は数えられない
+    length = np.diff(key)
+    ar, ae = ar[:-1], ae[:-1]
+    return int(length[ar & ae].sum()), int(length[ae].sum()), int(length[ar].sum())
+
+def frame_prf(ref, est, fps=100):
+    """ピアノロール（fps フレーム/秒 × 128 ピッチ）上のフレーム単位 P/R/F1"""
+    return _prf(*_frame_counts(_as_notes(ref), _as_notes(est), fps))
+
+def _counts(ref, est, onset_tol, offset_ratio, offset_min, fps):
+    ref, est = _as_notes(ref), _as_notes(est)
+    out = {}
+    for name, ratio in (("onset", None), ("onset_offset", offset_ratio)):
+        ri, ei = _candidates(ref, est, onset_tol, ratio, offset_min)
+        out[name] = (_max_matching(ri, ei), len(est[0]), len(ref[0]))
+    out["frame"] = _frame_counts(ref, est, fps)
+    return out
+
+def evaluate(ref, est, onset_tol=0.05, offset_ratio=0.2, offset_min=0.05, fps=100):
+    """1組の (正解, 予測) について onset / onset_offset / frame の P/R/F1 と一致数をまとめて返す"""
+    c = _counts(ref, est, onset_tol, offset_ratio, offset_min, fps)
+    return {k: dict(zip(("precision", "recall", "f1"), _prf(*v)), tp=v[0], n_est=v[1], n_ref=v[2])
+            for k, v in c.items()}
+
+def evaluate_batch(pairs, onset_tol=0.05, offset_ratio=0.2, offset_min=0.05, fps=100):
+    """
+    多数の (正解, 予測) 組を評価する。
+    返り値: (ファイルごとの evaluate 結果のリスト, 集計 {指標: micro(一致数の総和から) と macro(平均) の P/R/F1})
+    """
+    per = [evaluate(r, e, onset_tol, offset_ratio, offset_min, fps) for r, e in pairs]
+    agg = {}
+    for k in ("onset", "onset_offset", "frame"):
+        tp, n_est, n_ref = (sum(p[k][c] for p in per) for c in ("tp", "n_est", "n_ref"))
+        micro = dict(zip(("precision", "recall", "f1"), _prf(tp, n_est, n_ref)))
+        macro = {m: float(np.mean([p[k][m] for p in per])) if per else 0.0 for m in ("precision", "recall", "f1")}
+        agg[k] = {"micro": micro, "macro": macro}
+    return per, agg
@@ -1,35 +1,75 @@
 # amtx/model.py
-import torch, torch.nn as nn, math
+import os, math, contextlib
+import torch, torch.nn as nn, torch.nn.functional as F
+from .tokenizer import CODECS, VOCAB
 
 class PosEmb(nn.Module):
     def __init__(self, d, max_len=16384):
         super().__init__()
-        pe = torch.zeros(max_len, d)
-        pos = torch.arange(0, max_len).unsqueeze(1)
-        div = torch.exp(torch.arange(0, d, 2)*(-math.log(10000.0)/d))
+        # 定数表なので常に CPU で作る（meta デバイス上で組むと演算のために torch._dynamo の import が走り 0.7s ほどかかる）
+        pe = torch.zeros(max_len, d, device="cpu")
+        pos = torch.arange(0, max_len, device="cpu").unsqueeze(1)
+        div = torch.exp(torch.arange(0, d, 2, device="cpu")*(-math.log(10000.0)/d))
         pe[:,0::2] = torch.sin(pos*div); pe[:,1::2] = torch.cos(pos*div)
         self.register_buffer("pe", pe)
 
-    def forward(self, x):  # [B,T,D]
-        return x + self.pe[:x.size(1)]
+    def forward(self, x, offset=0):  # [B,T,D]
+        return x + self.pe[offset:offset + x.size(1)]
+
+# モデルサイズのプリセット（Encoder / Decoder 共通）。base が従来の MT3Mini
+PRESETS = {
+    "tiny":  dict(d=128, L=2, nhead=4, ff=512),
+    "small": dict(d=256, L=4, nhead=4, ff=1024),
+    "base":  dict(d=384, L=6, nhead=6, ff=1536),
+}
+FRONTENDS = ("stack", "conv")
 
 class Encoder(nn.Module):
-    def __init__(self, n_mels=256, d=384, L=6, nhead=6, ff=1536):
+    """
+    log-Mel [B,T,F] -> [B,ceil(T/subsample),D]。subsample > 1 ではフレームを間引いてから Transformer に入れる
+    （自己注意と、デコーダの各ステップの cross-attention のコストが約 1/subsample になる）
+      frontend="stack": 隣接 subsample フレームを連結して Linear（末尾は 0 で埋める）
+      frontend="conv" : kernel 3 / stride 2 の Conv1d + GELU を log2(subsample) 段
+    """
+    def __init__(self, n_mels=256, d=384, L=6, nhead=6, ff=1536, dropout=0.1, subsample=1, frontend="stack"):
         super().__init__()
-        self.proj = nn.Linear(n_mels, d)
+        assert subsample in (1, 2, 4), subsample
+        assert frontend in FRONTENDS, frontend
+        self.n_mels, self.subsample, self.frontend = n_mels, subsample, frontend
+        if subsample > 1 and frontend == "conv":
+            layers, c = [], n_mels
+            for _ in range(subsample.bit_length() - 1):
+                layers += [nn.Conv1d(c, d, 3, stride=2, padding=1), nn.GELU()]
+                c = d
+            self.conv = nn.Sequential(*layers)
+            self.proj = nn.Linear(d, d)
+        else:
+            self.proj = nn.Linear(n_mels * subsample, d)
         self.pos = PosEmb(d)
-        self.blocks = nn.ModuleList([nn.TransformerEncoderLayer(d, nhead, ff, 0.1, batch_first=True) for _ in range(L)])
+        self.blocks = nn.ModuleList([nn.TransformerEncoderLayer(d, nhead, ff, dropout, batch_first=True) for _ in range(L)])
+
+    def downsample(self, x):  # [B,T,F] -> [B,ceil(T/k),F*k] / [B,ceil(T/k),D]
+        k = self.subsample
+        if k == 1:
+            return x
+        if self.frontend == "conv":
+            return self.conv(x.transpose(1, 2)).transpose(1, 2)
+        pad = -x.size(1) % k
+        if pad:
+            x = F.pad(x, (0, 0, 0, pad))
+        return x.reshape(x.size(0), -1, k * x.size(2))
+
     def forward(self, x):  # [B,T,F]
-        h = self.pos(self.proj(x))
+        h = self.pos(self.proj(self.downsample(x)))
         for blk in self.blocks: h = blk(h)
-        return h  # [B,T,D]
+        return h  # [B,T/subsample,D]
 
 class Decoder(nn.Module):
-    def __init__(self, vocab_size, d=384, L=6, nhead=6, ff=1536):
+    def __init__(self, vocab_size, d=384, L=6, nhead=6, ff=1536, dropout=0.1):
         super().__init__()
         self.emb = nn.Embedding(vocab_size, d)
         self.pos = PosEmb(d)
-        self.blocks = nn.ModuleList([nn.TransformerDecoderLayer(d, nhead, ff, 0.1, batch_first=True) for _ in range(L)])
+        self.blocks = nn.ModuleList([nn.TransformerDecoderLayer(d, nhead, ff, dropout, batch_first=True) for _ in range(L)])
         self.lm = nn.Linear(d, vocab_size)
     def forward(self, y_in, mem):  # y_in: [B,S], mem: [B,T,D]
         tgt = self.pos(self.emb(y_in))
@@ -38,12 +78,126 @@ class Decoder(nn.Module):
         for blk in self.blocks: h = blk(h, mem, tgt_mask=tgt_mask)
         return self.lm(h)
 
+    # ===== 逐次デコード用（KVキャッシュ） =====
+    def init_cache(self, mem):
+        """
+        mem から各層の cross-attention K/V を一度だけ計算し、空の self-attention キャッシュと合わせて返す。
+        返り値は層ごとの [self_k, self_v, mem_k, mem_v]（各 [B,H,T,Dh]、self_* は最初 None）
+        """
+        cache = []
+        for blk in self.blocks:
+            attn = blk.multihead_attn
+            d = attn.embed_dim
+            w, b = attn.in_proj_weight, attn.in_proj_bias
+            mk = _split_heads(F.linear(mem, w[d:2*d], b[d:2*d]), attn.num_heads)
+            mv = _split_heads(F.linear(mem, w[2*d:], b[2*d:]), attn.num_heads)
+            cache.append([None, None, mk, mv])
+        return cache
+
+    def step(self, y_new, cache):
+        """
+        新しいトークン y_new: [B,S_new] だけを処理し logits [B,S_new,V] を返す。
+        cache（init_cache の返り値）は self-attention の K/V を追記して in-place 更新する。
+        eval 時（dropout無効）は forward(y, mem) の対応位置と一致する。
+        """
+        past = 0 if cache[0][0] is None else cache[0][0].size(2)
+        h = self.pos(self.emb(y_new), offset=past)
+        n = h.size(1)
+        mask = None
+        if n > 1:  # ブロック内だけ因果マスク（過去キャッシュは全て可視）
+            mask = torch.ones(n, past + n, dtype=torch.bool, device=h.device).tril(past)
+        for blk, c in zip(self.blocks, cache):
+            h = _block_step(blk, h, c, mask)
+        return self.lm(h)
+
+def _block_step(blk, h, c, mask=None):
+    """TransformerDecoderLayer（post-norm）1層ぶんの逐次計算。c = [self_k, self_v, mem_k, mem_v] を in-place 更新"""
+    sa = blk.self_attn
+    d, H = sa.embed_dim, sa.num_heads
+    q, k, v = F.linear(h, sa.in_proj_weight, sa.in_proj_bias).split(d, dim=-1)
+    k, v = _split_heads(k, H), _split_heads(v, H)
+    if c[0] is not None:
+        k, v = torch.cat([c[0], k], dim=2), torch.cat([c[1], v], dim=2)
+    c[0], c[1] = k, v
+    x = _merge_heads(F.scaled_dot_product_attention(_split_heads(q, H), k, v, attn_mask=mask))
+    h = blk.norm1(h + F.linear(x, sa.out_proj.weight, sa.out_proj.bias))
+
+    ca = blk.multihead_attn
+    d = ca.embed_dim
+    q = F.linear(h, ca.in_proj_weight[:d], ca.in_proj_bias[:d])
+    x = _merge_heads(F.scaled_dot_product_attention(_split_heads(q, ca.num_heads), c[2], c[3]))
+    h = blk.norm2(h + F.linear(x, ca.out_proj.weight, ca.out_proj.bias))
+
+    return blk.norm3(h + blk.linear2(blk.activation(blk.linear1(h))))
+
+def _split_heads(x, nhead):  # [B,S,D] -> [B,H,S,Dh]
+    return x.unflatten(-1, (nhead, -1)).transpose(1, 2)
+
+def _merge_heads(x):  # [B,H,S,Dh] -> [B,S,D]
+    return x.transpose(1, 2).flatten(2)
+
 class MT3Mini(nn.Module):
-    def __init__(self, vocab_size, n_mels=256):
+    """
+    preset でサイズ（d, L, nhead, ff）を選び、個別の値はキーワードで上書きできる。
+    subsample / frontend は Encoder を参照。構成は self.config に残り、save_checkpoint で一緒に保存される。
+    codec は学習・転写で使うトークンの符号化方式（tokenizer.CODECS）。モデル自体は使わないが構成として持ち回る
+    """
+    def __init__(self, vocab_size, n_mels=256, dropout=0.1, preset="base", subsample=1, frontend="stack",
+                 codec="absolute", **size):
         super().__init__()
-        self.enc = Encoder(n_mels=n_mels)
-        self.dec = Decoder(vocab_size=vocab_size)
+        if preset not in PRESETS:
+            raise ValueError(f"unknown preset: {preset} (choose from {list(PRESETS)})")
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec: {codec} (choose from {list(CODECS)})")
+        unknown = set(size) - set(PRESETS[preset])
+        if unknown:
+            raise TypeError(f"unexpected arguments: {sorted(unknown)}")
+        size = {**PRESETS[preset], **size}
+        self.config = dict(vocab_size=vocab_size, n_mels=n_mels, dropout=dropout, preset=preset,
+                           subsample=subsample, frontend=frontend, codec=codec, **size)
+        self.enc = Encoder(n_mels=n_mels, dropout=dropout, subsample=subsample, frontend=frontend, **size)
+        self.dec = Decoder(vocab_size=vocab_size, dropout=dropout, **size)
     def forward(self, mel, y_in):
         mem = self.enc(mel)
         logits = self.dec(y_in, mem)
         return logits
+
+# ===== チェックポイント（構成 + state_dict） =====
+def save_checkpoint(model, path):
+    """{"config": model.config, "state_dict": ...} を一時ファイル経由で保存する"""
+    tmp = f"{path}.tmp"
+    torch.save({"config": dict(model.config), "state_dict": model.state_dict()}, tmp)
+    os.replace(tmp, path)
+
+def load_checkpoint(path, map_location="cpu", mmap=True, **overrides):
+    """
+    save_checkpoint の出力から同じ構成の MT3Mini を作って重みを読む。
+    旧形式（state_dict のみ）は base 構成とみなす（codec が無い構成は absolute）。overrides は構成の上書き（dropout など）
+    mmap=True ではファイルを torch.load(mmap=True) で写像し、meta デバイスで組んだモデルにそのまま割り当てる
+    （乱数初期化とコピーを省き、同じチェックポイントを読む複数プロセスで重みのページを共有できる。書き込むとそのページだけ複製される）
+    """
+    try:
+        ckpt = torch.load(path, map_location=map_location, mmap=mmap, weights_only=True)
+    except RuntimeError:  # 旧シリアライズ形式（zip でない）は mmap できない
+        ckpt = torch.load(path, map_location=map_location, weights_only=True)
+    if "state_dict" in ckpt and "config" in ckpt:
+        config, state = ckpt["config"], ckpt["state_dict"]
+    else:
+        config, state = {"vocab_size": len(VOCAB.itos)}, ckpt
+    with torch.device("meta"), _skip_init():
+        model = MT3Mini(**{**config, **overrides})
+    model.load_state_dict(state, assign=True)
+    return model
+
+@contextlib.contextmanager
+def _skip_init():
+    """重みの初期化（nn.init.*_）を何もしない関数に差し替える。どうせ上書きされるうえ、meta 上の normal_ は torch._dynamo の import を引き起こす"""
+    names = ("normal_", "uniform_", "kaiming_uniform_", "xavier_uniform_", "constant_", "zeros_", "ones_")
+    saved = {n: getattr(nn.init, n) for n in names}
+    for n in names:
+        setattr(nn.init, n, lambda tensor, *a, **k: tensor)
+    try:
+        yield
+    finally:
+        for n, f in saved.items():
+            setattr(nn.init, n, f)
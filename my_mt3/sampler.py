@@ -0,0 +1,61 @@
+# amtx/sampler.py
+import numpy as np
+from torch.utils.data import Sampler
+
+class BucketBatchSampler(Sampler):
+    """
+    トークン長の近いチャンクを同じバッチにまとめる batch_sampler。
+    バッチは固定 bs ではなく「バッチ内最大長 × 件数 <= max_tokens」の予算で組む。
+    lengths は事前計算済みの長さ（AMTChunkDataset.token_lengths() など）を渡すので、音声はデコードしない。
+    num_replicas > 1（DDP）では全体で組んだバッチを rank ごとに振り分ける（端数のバッチは捨てて全ランク同数にそろえる）
+    """
+    def __init__(self, lengths, max_tokens, bucket_width=8, shuffle=True, seed=0, rank=0, num_replicas=1):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        if len(self.lengths) and self.lengths.max() > max_tokens:
+            raise ValueError(f"max_tokens={max_tokens} < longest sequence {self.lengths.max()}")
+        self.max_tokens, self.bucket_width = max_tokens, bucket_width
+        self.shuffle, self.seed = shuffle, seed
+        self.rank, self.num_replicas = rank, num_replicas
+        self.epoch = 0
+        self._cache = None  # (epoch, batches)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _batches(self):
+        if self._cache is not None and self._cache[0] == self.epoch:
+            return self._cache[1]
+        rng = np.random.default_rng((self.seed, self.epoch))
+        bucket = self.lengths // self.bucket_width
+        # バケット順に並べ、バケット内はランダム（shuffle=False なら長さ順で安定）
+        tie = rng.random(len(bucket)) if self.shuffle else np.arange(len(bucket))
+        order = np.lexsort((tie, bucket))
+
+        batches, cur, cur_max = [], [], 0
+        for i in order.tolist():
+            L = int(self.lengths[i])
+            if cur and max(cur_max, L) * (len(cur) + 1) > self.max_tokens:
+                batches.append(cur); cur, cur_max = [], 0
+            cur.append(i); cur_max = max(cur_max, L)
+        if cur:
+            batches.append(cur)
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        n = len(batches) // self.num_replicas * self.num_replicas
+        batches = batches[self.rank:n:self.num_replicas]
+        self._cache = (self.epoch, batches)
+        return batches
+
+    def __iter__(self):
+        return iter(self._batches())
+
+    def __len__(self):
+        return len(self._batches())
+
+    def stats(self):
+        """現在のエポックのパディング効率（実トークン / パディング込みトークン）"""
+        batches = self._batches()
+        real = sum(int(self.lengths[b].sum()) for b in batches)
+        padded = sum(int(self.lengths[b].max()) * len(b) for b in batches)
+        return {"batches": len(batches), "tokens": real, "padded_tokens": padded,
+                "efficiency": real / max(1, padded)}
@@ -0,0 +1,193 @@
+# amtx/server.py  (ローカル転写サーバ: asyncio HTTP + リクエスト横断の動的バッチング)
+import asyncio, collections, io, json, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
+import torch
+from .audio import get_feature_extractor, DEFAULT_SR
+from .infer import batch_greedy_decode, chunk_logmels, is_batch_invariant, merge_chunks, model_codec
+
+class TranscriptionServer:
+    """
+    POST /transcribe に音声ファイル（soundfile が読める形式）を送ると MIDI（audio/midi）を返す HTTP サーバ。
+    各リクエストの音声は chunk_logmels（chunk_indices と同じ規則）でチャンクに切り、全リクエストのチャンクを
+    1つのキューに積む。バッチャーはキューから最大 max_batch 個、最初の1個から最大 max_wait_ms 待って集めたチャンクを
+    batch_greedy_decode でまとめてデコードする（デコードは workers 本のスレッドで、実行中も次のバッチを集める）。
+      GET /metrics : キュー長、処理中リクエスト数、バッチサイズのヒストグラム、リクエスト遅延の p50/p99 など
+      GET /health  : ok
+    チャンクの出力が同じバッチの他のリクエストに依らないよう、バッチ不変でないモデル（動的 int8 量子化。
+    infer.is_batch_invariant）は max_batch=1 でしか受け付けない
+    """
+    def __init__(self, model, host="127.0.0.1", port=8000, max_batch=32, max_wait_ms=10, workers=1,
+                 device="cpu", sr=DEFAULT_SR, hop=256, max_body_mb=100):
+        if max_batch > 1 and not is_batch_invariant(model):
+            raise ValueError("dynamic int8 quantization is not batch-invariant: a request's MIDI would depend on the "
+                             "other requests in its batch. Use max_batch=1 or an fp32 / torchscript / onnx engine")
+        self.model, self.device = model.eval() if hasattr(model, "eval") else model, device
+        self.host, self.port = host, port
+        self.max_batch, self.max_wait = max_batch, max_wait_ms / 1000
+        self.workers, self.sr, self.hop = workers, sr, hop
+        self.max_body = max_body_mb << 20
+        self.frontend = get_feature_extractor(sr=sr, hop=hop)
+        self._decode_pool = ThreadPoolExecutor(workers, thread_name_prefix="decode")
+        self._feature_pool = ThreadPoolExecutor(1, thread_name_prefix="features")
+        self.batch_hist = collections.Counter()        # バッチサイズ -> 回数
+        self.latencies = collections.deque(maxlen=10000)  # リクエストごとの遅延 [s]
+        self.requests = self.errors = self.chunks = self.in_flight = 0
+        self.decode_sec = 0.0
+        self.t_start = time.perf_counter()
+        self._queue = None
+
+    # ===== 起動 =====
+    async def serve(self, ready=None):
+        """サーバを起動して止められるまで動かす。ready（asyncio.Event など set() を持つもの）は待ち受け開始で set する"""
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        batcher = asyncio.create_task(self._batcher())
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]  # port=0 なら実際に割り当てられた番号
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    def run(self):
+        print(f"listening on http://{self.host}:{self.port}  (max_batch={self.max_batch}, "
+              f"max_wait_ms={self.max_wait * 1000:g}, workers={self.workers})")
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    # ===== バッチング =====
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()  # デコード中も空きスロットがあるまでは集め続ける
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.batch_hist[len(batch)] += 1
+            fut = loop.run_in_executor(self._decode_pool, self._decode, [mel for mel, _ in batch])
+            fut.add_done_callback(lambda f, batch=batch: self._deliver(f, batch))
+
+    def _decode(self, mels):
+        t0 = time.perf_counter()
+        out = batch_greedy_decode(self.model, mels, device=self.device)
+        self.decode_sec += time.perf_counter() - t0
+        return out
+
+    def _deliver(self, f, batch):
+        self._slots.release()
+        for i, (_, waiter) in enumerate(batch):
+            if waiter.cancelled():
+                continue
+            if f.exception() is not None:
+                waiter.set_exception(f.exception())
+            else:
+                waiter.set_result(f.result()[i])
+
+    # ===== リクエスト処理 =====
+    async def transcribe(self, data: bytes) -> bytes:
+        """音声ファイルのバイト列 -> MIDI ファイルのバイト列"""
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(self._feature_pool, self._features, data)
+        waiters = []
+        for mel, _ in chunks:
+            waiters.append(loop.create_future())
+            self._queue.put_nowait((mel, waiters[-1]))
+        self.chunks += len(chunks)
+        token_lists = await asyncio.gather(*waiters)
+        buf = io.BytesIO()
+        merge_chunks([se for _, se in chunks], token_lists, sr=self.sr, codec=model_codec(self.model)).write(buf)
+        return buf.getvalue()
+
+    def _features(self, data):
+        y, file_sr = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+        wav = torch.from_numpy(y.T).mean(dim=0, keepdim=True)  # [1, T] mono
+        y = self.frontend.resample(wav, file_sr).squeeze(0).numpy()
+        return chunk_logmels(y, sr=self.sr, hop=self.hop)
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                method, path, headers, body = await _read_request(reader, self.max_body)
+            except ValueError as e:
+                return await _respond(writer, 400, str(e).encode(), "text/plain")
+            path = path.split("?")[0]
+            if path == "/health" and method == "GET":
+                return await _respond(writer, 200, b"ok", "text/plain")
+            if path == "/metrics" and method == "GET":
+                return await _respond(writer, 200, json.dumps(self.metrics()).encode(), "application/json")
+            if path != "/transcribe":
+                return await _respond(writer, 404, b"not found", "text/plain")
+            if method != "POST":
+                return await _respond(writer, 405, b"use POST", "text/plain")
+            t0 = time.perf_counter()
+            self.in_flight += 1
+            try:
+                midi = await self.transcribe(body)
+            except (sf.LibsndfileError, RuntimeError, ValueError) as e:  # 読めない音声・短すぎる音声など
+                self.errors += 1
+                return await _respond(writer, 400, f"{type(e).__name__}: {e}".encode(), "text/plain")
+            finally:
+                self.in_flight -= 1
+            self.latencies.append(time.perf_counter() - t0)
+            self.requests += 1
+            await _respond(writer, 200, midi, "audio/midi")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def metrics(self) -> dict:
+        lat = np.asarray(self.latencies) * 1000
+        n_batches = sum(self.batch_hist.values())
+        up = time.perf_counter() - self.t_start
+        return {"queue_depth": self._queue.qsize() if self._queue else 0,
+                "in_flight": self.in_flight,
+                "requests": self.requests, "errors": self.errors, "chunks": self.chunks,
+                "batches": n_batches,
+                "batch_size_mean": sum(k * v for k, v in self.batch_hist.items()) / max(1, n_batches),
+                "batch_size_hist": {str(k): v for k, v in sorted(self.batch_hist.items())},
+                "latency_ms_p50": float(np.percentile(lat, 50)) if len(lat) else 0.0,
+                "latency_ms_p99": float(np.percentile(lat, 99)) if len(lat) else 0.0,
+                "decode_sec": self.decode_sec,
+                "uptime_sec": up,
+                "requests_per_sec": self.requests / up if up else 0.0}
+
+# ===== 最小限の HTTP/1.1（1接続1リクエスト） =====
+async def _read_request(reader, max_body):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, path, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise ValueError(f"bad request line: {lines[0]!r}")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    n = int(headers.get("content-length", 0))
+    if n > max_body:
+        raise ValueError(f"body too large: {n} bytes")
+    body = await reader.readexactly(n) if n else b""
+    return method, path, headers, body
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+async def _respond(writer, status, body, content_type):
+    writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: {content_type}\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
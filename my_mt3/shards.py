@@ -0,0 +1,214 @@
+# amtx/shards.py  (シャード形式の学習データ: パッカー + ストリーミング IterableDataset)
+import json, os, random
+from multiprocessing import Pool
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+from .audio import get_feature_extractor
+from .dataset import AMTDataset
+
+MANIFEST = "index.json"
+# シャードのレコード索引。offset はシャード内のバイト位置、n_feat は mel のフレーム数 / audio のサンプル数
+INDEX_DTYPE = np.dtype([("offset", "<i8"), ("n_feat", "<i8"), ("n_tok", "<i8"), ("s", "<f8"), ("e", "<f8")])
+
+# ===== 書き出し =====
+class ShardWriter:
+    """
+    チャンク単位のレコードを大きなシャードファイルに追記していく。
+      root/shard-00000.bin      レコードを連結したもの（特徴量 float32 の直後にトークン int32）
+      root/shard-00000.idx.npy  INDEX_DTYPE のレコード索引
+      root/index.json           シャード一覧と特徴量の種類・パラメータ
+    シャードは shard_bytes を超えたら次のファイルに切り替える
+    """
+    def __init__(self, root, kind="mel", shard_bytes=512 << 20, **params):
+        assert kind in ("mel", "audio"), kind
+        self.root, self.kind, self.shard_bytes, self.params = root, kind, shard_bytes, params
+        os.makedirs(root, exist_ok=True)
+        self.shards = []
+        self._f = None
+
+    def _open(self):
+        name = f"shard-{len(self.shards):05d}"
+        self._name, self._rows, self._pos = name, [], 0
+        self._f = open(os.path.join(self.root, name + ".bin.tmp"), "wb")
+
+    def _close(self):
+        if self._f is None:
+            return
+        self._f.close()
+        base = os.path.join(self.root, self._name)
+        np.save(base + ".idx.npy", np.array(self._rows, dtype=INDEX_DTYPE))
+        os.replace(base + ".bin.tmp", base + ".bin")
+        self.shards.append({"name": self._name, "records": len(self._rows), "bytes": self._pos})
+        self._f = None
+
+    def write(self, feat, token_ids, se):
+        if self._f is None:
+            self._open()
+        feat = np.ascontiguousarray(feat, dtype=np.float32)
+        tok = np.asarray(token_ids, dtype=np.int32)
+        self._rows.append((self._pos, len(feat), len(tok), se[0], se[1]))
+        self._f.write(feat.tobytes()); self._f.write(tok.tobytes())
+        self._pos += feat.nbytes + tok.nbytes
+        if self._pos >= self.shard_bytes:
+            self._close()
+
+    def close(self):
+        """最後のシャードを閉じて index.json を書く（index.json があるディレクトリだけが完成品）"""
+        self._close()
+        manifest = {"kind": self.kind, "params": self.params, "shards": self.shards,
+                    "records": sum(s["records"] for s in self.shards)}
+        with open(os.path.join(self.root, MANIFEST + ".tmp"), "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(os.path.join(self.root, MANIFEST + ".tmp"), os.path.join(self.root, MANIFEST))
+        return manifest
+
+_DS, _KIND = None, None
+
+def _init_packer(pairs, kind, params, cache_dir):
+    # Pool の initializer（workers=1 のときはメインプロセスで直接呼ぶ）
+    global _DS, _KIND
+    _DS, _KIND = AMTDataset(pairs, cache_dir=cache_dir, **params), kind
+
+def _records(i):
+    """ファイル i のチャンクレコード [(feat, token_ids, (s, e)), ...]"""
+    if _KIND == "mel":
+        return [(np.asarray(mel), ids, se) for mel, ids, se in _DS[i]]
+    # audio: 各チャンクの窓が覆う波形（center=True の反射パディング込み）を保存し、読み出し時に mel にする
+    ds = _DS
+    wav, midi, pid = ds.pairs[i]
+    y = get_feature_extractor(sr=ds.sr, n_fft=ds.n_fft, hop=ds.hop, n_mels=ds.n_mels).load(wav)
+    entries = ds.chunk_entries(len(y) / ds.sr, midi, pid)
+    y = np.pad(y, ds.n_fft // 2, mode="reflect")
+    return [(y[fs * ds.hop:(fe - 1) * ds.hop + ds.n_fft], ids, se) for fs, fe, ids, se in entries]
+
+def pack_shards(pairs, out_dir, kind="mel", shard_bytes=512 << 20, workers=1, shuffle=True, seed=0,
+                cache_dir=None, sr=22050, hop=256, step_ms=10, n_fft=2048, n_mels=256, codec="absolute"):
+    """
+    (wav, midi, program_id) のリストをチャンク単位のシャードに詰める。
+    kind="mel" は log-Mel [T,F] を、kind="audio" は波形（STFT 文脈込み）を保存する。
+    トークンは codec で符号化したものを保存する（index.json の params に残り、train_loop が照合する）
+    shuffle=True ならファイル順をシャッフルしてから詰める（シャード内の偏りを減らす）
+    """
+    params = dict(sr=sr, hop=hop, step_ms=step_ms, n_fft=n_fft, n_mels=n_mels, codec=codec)
+    order = list(range(len(pairs)))
+    if shuffle:
+        random.Random(seed).shuffle(order)
+    writer = ShardWriter(out_dir, kind=kind, shard_bytes=shard_bytes, **params)
+    if workers > 1:
+        with Pool(workers, initializer=_init_packer, initargs=(pairs, kind, params, cache_dir)) as pool:
+            for recs in pool.imap(_records, order, chunksize=4):
+                for r in recs:
+                    writer.write(*r)
+    else:
+        _init_packer(pairs, kind, params, cache_dir)
+        for i in order:
+            for r in _records(i):
+                writer.write(*r)
+    return writer.close()
+
+# ===== 読み出し =====
+def read_manifest(root):
+    with open(os.path.join(root, MANIFEST)) as f:
+        return json.load(f)
+
+def iter_shard(root, name, n_mels=None, kind="mel", buffer_bytes=8 << 20, start=0, step=1):
+    """
+    1シャードを先頭から順に読む -> (feat, token_ids, (s, e))。
+    step > 1 なら start 番目から step 件おきのレコードだけを読む（間は前方へ seek して飛ばす）
+    """
+    rows = np.load(os.path.join(root, name + ".idx.npy"))[start::step]
+    with open(os.path.join(root, name + ".bin"), "rb", buffering=buffer_bytes) as f:
+        for offset, n_feat, n_tok, s, e in rows.tolist():
+            if step > 1:
+                f.seek(offset)
+            feat = _read(f, np.float32, (n_feat, n_mels) if kind == "mel" else (n_feat,))
+            tok = _read(f, np.int32, (n_tok,))
+            yield feat, tok.astype(np.int64), (s, e)
+
+def _read(f, dtype, shape):
+    out = np.empty(shape, dtype=dtype)  # 書き込み可能な配列に直接読む（frombuffer は読み取り専用になる）
+    if f.readinto(memoryview(out).cast("B")) != out.nbytes:
+        raise EOFError(f"truncated shard: {f.name}")
+    return out
+
+class ShardDataset(IterableDataset):
+    """
+    pack_shards の出力をストリーミングで読む IterableDataset。1要素 = (mel[T,F], token_ids, (s,e))（AMTChunkDataset と同じ）。
+    - シャードの順番はエポックごとにシャッフルし、その順に並べたレコードを (rank, DataLoader のワーカー) に
+      1件ずつ順番に配る（各ワーカーは全シャードを前から順に、自分の分だけ読む）。
+      シャードが1つでも全 rank・全ワーカーに行き渡る
+    - 全ランクのステップ数を一致させるため、各 (rank, ワーカー) の件数は 全件数 // (rank 数 x ワーカー数) にそろえる
+      （はみ出した端数はそのエポックでは読まない）。1件も配られない (rank, ワーカー) があれば ValueError
+    - shuffle_buffer 件のバッファからランダムに取り出すことで、シャード内の順序も崩す
+    - kind="audio" のシャードは読み出し時に frontend.frames で log-Mel にする
+    """
+    def __init__(self, root, shuffle_buffer=1024, shuffle=True, seed=0, rank=0, num_replicas=1):
+        self.root = root
+        self.manifest = read_manifest(root)
+        self.kind, self.params = self.manifest["kind"], self.manifest["params"]
+        self.shuffle_buffer = shuffle_buffer if shuffle else 0
+        self.shuffle, self.seed, self.epoch = shuffle, seed, 0
+        self.rank, self.num_replicas = rank, num_replicas
+
+    def __len__(self):
+        """この rank が読む件数（ワーカー1つと仮定した目安）"""
+        return self._assignment(1)[2]
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _assignment(self, num_workers):
+        """
+        このエポックの割り当て -> (シャードの順番, スロット数, スロットごとの読む件数)。
+        スロットは (rank, ワーカー) の組で、ワーカー w・rank r は w * num_replicas + r。
+        シャード順は全 rank・全ワーカーで同じ乱数で決めるので、どのスロットも同じ並びから自分の分を取る
+        """
+        shards = list(self.manifest["shards"])
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        slots = self.num_replicas * num_workers
+        total = sum(s["records"] for s in shards)
+        if total < slots:
+            raise ValueError(f"{self.root}: {total} records cannot feed {self.num_replicas} rank(s) x "
+                             f"{num_workers} DataLoader worker(s); pack more data or use fewer processes/workers")
+        return shards, slots, total // slots
+
+    def _records(self):
+        p = self.params
+        frontend = get_feature_extractor(sr=p["sr"], n_fft=p["n_fft"], hop=p["hop"], n_mels=p["n_mels"]) \
+            if self.kind == "audio" else None
+        info = get_worker_info()
+        wid, nw = (info.id, info.num_workers) if info is not None else (0, 1)
+        shards, slots, left = self._assignment(nw)
+        slot = wid * self.num_replicas + self.rank
+        seen = 0  # これまでのシャードのレコード数（全体の通し番号 % slots == slot が自分の分）
+        for shard in shards:
+            start = (slot - seen) % slots
+            seen += shard["records"]
+            for feat, ids, se in iter_shard(self.root, shard["name"], n_mels=p["n_mels"], kind=self.kind,
+                                            start=start, step=slots):
+                if left <= 0:
+                    return
+                left -= 1
+                if frontend is not None:
+                    with torch.no_grad():
+                        feat = frontend.frames(torch.from_numpy(feat).unsqueeze(0))[0].numpy()
+                yield feat, ids, se
+
+    def __iter__(self):
+        if not self.shuffle_buffer:
+            yield from self._records()
+            return
+        info = get_worker_info()
+        rng = random.Random(hash((self.seed, self.epoch, self.rank, info.id if info else 0)))
+        buf = []
+        for rec in self._records():
+            if len(buf) < self.shuffle_buffer:
+                buf.append(rec)
+                continue
+            k = rng.randrange(len(buf))
+            yield buf[k]
+            buf[k] = rec
+        rng.shuffle(buf)
+        yield from buf
@@ -0,0 +1,165 @@
+# amtx/stream.py  (リアルタイム/ストリーミング転写)
+import time
+import numpy as np
+import torch, pretty_midi
+from .audio import get_feature_extractor, DEFAULT_SR
+from .dataset import sec_to_frame
+from .infer import batch_greedy_decode, model_codec, to_midi_from_tokens
+from .tokenizer import CHUNK_SEC
+
+class StreamingTranscriber:
+    """
+    任意サイズの音声ブロックを push() で受け取り、チャンクが揃い次第デコードしてノートを返す。
+
+    - log-Mel はリングバッファから増分計算する（確定したフレームだけを1回ずつ STFT し、
+      次のフレームに必要な n_fft//2 + hop ぶんのサンプルだけを保持する）
+    - 窓は chunk_indices と同じ規則で hop_sec ごとに進み、覆うフレームが揃った時点で encoder/decoder を走らせる
+    - hop_sec < chunk_sec の場合、前の窓の終端より後に始まるノートだけを出力する
+    - 終端の反射パディングや最後の窓は flush() で処理するので、hop_sec == chunk_sec ならオフラインの transcribe と一致する
+    """
+    def __init__(self, model, sr=DEFAULT_SR, hop=256, n_fft=2048, n_mels=256,
+                 chunk_sec=CHUNK_SEC, hop_sec=None, device="cpu"):
+        self.model, self.device = model, device
+        self.sr, self.hop, self.n_fft = sr, hop, n_fft
+        self.chunk_sec = chunk_sec
+        self.hop_sec = chunk_sec if hop_sec is None else hop_sec
+        self.frontend = get_feature_extractor(sr=sr, n_fft=n_fft, hop=hop, n_mels=n_mels)
+        self.reset()
+
+    def reset(self):
+        self.n_in = 0                               # 受け取った総サンプル数
+        self._wave = torch.zeros(0)                 # 保持中のサンプル（絶対位置 _wave_start から）
+        self._wave_start = 0
+        self._head = torch.zeros(0)                 # 先頭の反射パディング用（最初の n_fft//2+1 サンプル）
+        self._mel = torch.zeros(0, self.frontend.n_mels)  # 計算済みフレーム（絶対位置 _mel_start から）
+        self._mel_start = 0
+        self.next_frame = 0                         # 次に計算するフレーム
+        self._t = 0.0                               # 次の窓の開始秒（chunk_indices と同じ浮動小数の累積）
+        self._emitted_until = 0.0
+        self.notes = []
+        self.latencies = []                         # 窓ごとの処理時間 [s]
+        self.busy_sec = 0.0                         # push/flush に費やした総時間 [s]
+
+    # ===== 入力 =====
+    def push(self, block) -> list:
+        """音声ブロック（self.sr のモノラル波形）を追加し、新たに確定したノートを返す"""
+        t0 = time.perf_counter()
+        block = torch.as_tensor(np.asarray(block, dtype=np.float32)).flatten()
+        self._wave = torch.cat([self._wave, block])
+        self.n_in += len(block)
+        pad = self.n_fft // 2
+        if len(self._head) <= pad:
+            self._head = torch.cat([self._head, block])[:pad + 1]
+        if self.n_in > pad:
+            self._compute_frames((self.n_in - pad) // self.hop + 1)
+        notes = self._run_windows(final=False)
+        self.busy_sec += time.perf_counter() - t0
+        return notes
+
+    def flush(self) -> list:
+        """入力終端: 残りのフレームを終端反射で計算し、残った窓をデコードする"""
+        t0 = time.perf_counter()
+        notes = []
+        if self.n_in > 0:
+            self._compute_frames(1 + self.n_in // self.hop, final=True)
+            notes = self._run_windows(final=True)
+        self.busy_sec += time.perf_counter() - t0
+        return notes
+
+    def midi(self) -> pretty_midi.PrettyMIDI:
+        """ここまでに出力したノートを PrettyMIDI にまとめる"""
+        pm = pretty_midi.PrettyMIDI()
+        inst = pretty_midi.Instrument(program=0)
+        inst.notes.extend(self.notes)
+        pm.instruments.append(inst)
+        return pm
+
+    def stats(self) -> dict:
+        """窓ごとのレイテンシと実時間係数（処理時間 / 入力音声長）"""
+        lat = np.asarray(self.latencies) * 1000
+        audio_sec = self.n_in / self.sr
+        return {"chunks": len(lat),
+                "latency_ms_mean": float(lat.mean()) if len(lat) else 0.0,
+                "latency_ms_p50": float(np.percentile(lat, 50)) if len(lat) else 0.0,
+                "latency_ms_max": float(lat.max()) if len(lat) else 0.0,
+                "audio_sec": audio_sec,
+                "rtf": self.busy_sec / audio_sec if audio_sec else 0.0}
+
+    # ===== 内部 =====
+    def _samples(self, a, b, final):
+        """
+        絶対サンプル範囲 [a, b)。先頭は反射、final なら終端も反射（center=True の STFT と同じ端処理）。
+        入力が n_fft//2 + 1 サンプルより短い場合も FeatureExtractor.logmel_batch と同じく先頭 -> 終端の順に1回ずつ
+        折り返し、はみ出した分は [0, n_in-1] に丸める
+        """
+        idx = torch.arange(a, b)
+        src = idx.abs()
+        if final:
+            last = self.n_in - 1
+            src = torch.where(src > last, 2 * last - src, src).clamp(0, last)
+        neg = idx < 0
+        out = torch.empty(len(idx))
+        out[neg] = self._head[src[neg]]
+        out[~neg] = self._wave[src[~neg] - self._wave_start]
+        return out
+
+    def _compute_frames(self, upto, final=False):
+        """フレーム [next_frame, upto) を計算して追記し、不要になったサンプルを捨てる"""
+        if upto <= self.next_frame:
+            return
+        pad = self.n_fft // 2
+        a = self.next_frame * self.hop - pad
+        y = self._samples(a, (upto - 1) * self.hop - pad + self.n_fft, final)
+        with torch.no_grad():
+            new = self.frontend.frames(y.unsqueeze(0))[0]  # [upto - next_frame, F]
+        self._mel = torch.cat([self._mel, new])
+        self.next_frame = upto
+        keep = max(0, self.next_frame * self.hop - pad)   # 次のフレームの窓の先頭
+        if keep > self._wave_start:
+            self._wave = self._wave[keep - self._wave_start:]
+            self._wave_start = keep
+
+    def _run_windows(self, final):
+        """揃った窓をまとめてデコードし、ノートを返す"""
+        eps = 5e-3  # chunk_indices と同じ許容
+        total_sec = self.n_in / self.sr
+        ready = []
+        while True:
+            s, e = self._t, self._t + self.chunk_sec
+            if e > total_sec + eps:
+                break
+            e = min(e, total_sec) if final else e
+            fs, fe = sec_to_frame(s, self.sr, self.hop), sec_to_frame(e, self.sr, self.hop)
+            if fe > self.next_frame:   # まだフレームが揃っていない
+                break
+            ready.append((s, e, fs, fe))
+            self._t += self.hop_sec
+        if final and not ready and self._t == 0.0 and total_sec > 0:
+            # chunk_indices(include_last=True) と同じく、1窓にも満たない入力は先頭から1窓だけ処理
+            e = min(self.chunk_sec, total_sec)
+            ready.append((0.0, e, 0, sec_to_frame(e, self.sr, self.hop)))
+            self._t = self.hop_sec
+        ready = [w for w in ready if w[3] > w[2]]
+        if not ready:
+            return []
+
+        t0 = time.perf_counter()
+        mels = [self._mel[fs - self._mel_start:fe - self._mel_start].numpy() for _, _, fs, fe in ready]
+        token_lists = batch_greedy_decode(self.model, mels, device=self.device)
+        self.latencies.extend([(time.perf_counter() - t0) / len(ready)] * len(ready))
+
+        out = []
+        for (s, e, _, _), ids in zip(ready, token_lists):
+            for n in to_midi_from_tokens(ids, sr=self.sr, codec=model_codec(self.model)).instruments[0].notes:
+                n.start += s; n.end += s
+                if n.start >= self._emitted_until - 1e-9:
+                    out.append(n)
+            self._emitted_until = e
+        self.notes.extend(out)
+
+        # 次の窓の先頭より前のフレームは不要
+        drop = sec_to_frame(self._t, self.sr, self.hop) - self._mel_start
+        if drop > 0:
+            self._mel = self._mel[drop:]
+            self._mel_start += drop
+        return out
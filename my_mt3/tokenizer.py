@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 import math
+import numpy as np
 TIME_STEP_MS = 10
 CHUNK_SEC = 2.048
 NUM_TIME = int(round(CHUNK_SEC * 1000 / TIME_STEP_MS)) + 1   # ≈205
@@ -7,12 +8,22 @@ NUM_TIME = int(round(CHUNK_SEC * 1000 / TIME_STEP_MS)) + 1   # ≈205
 PROGRAMS = ["piano","guitar","bass","drums","vocal"]  # MVP
 PITCHES = list(range(128))
 
+# トークン種別（Vocab.kind の値）
+KIND_PAD, KIND_EOS, KIND_END_TIE, KIND_PROGRAM, KIND_NOTE_ON, KIND_NOTE_OFF, KIND_TIME = range(7)
+
 @dataclass
 class Vocab:
     # 例: [PAD, EOS, END_TIE] + PROGRAM_x + NOTE_ON_p + NOTE_OFF_p + TIME_t
     pad: int; eos: int; end_tie: int
     program: dict; note_on: dict; note_off: dict; time: dict
     itos: list
+    # 配列ルックアップ表（文字列を介さずに token id <-> (種別, 値) を引く）
+    kind: np.ndarray          # token id -> KIND_*
+    value: np.ndarray         # token id -> プログラム番号 / ピッチ / 時間ステップ（特殊トークンは 0）
+    program_ids: np.ndarray   # プログラム番号 -> token id
+    note_on_ids: np.ndarray   # ピッチ -> token id
+    note_off_ids: np.ndarray  # ピッチ -> token id
+    time_ids: np.ndarray      # 時間ステップ -> token id
 
 def build_vocab():
     itos = []
@@ -22,33 +33,163 @@ def build_vocab():
     note_on = {p: add(f"NON_{p}") for p in PITCHES}
     note_off= {p: add(f"NOF_{p}") for p in PITCHES}
     time    = {t: add(f"TIM_{t}") for t in range(NUM_TIME)}
-    return Vocab(pad,eos,end_tie,program,note_on,note_off,time,itos)
+
+    kind = np.zeros(len(itos), dtype=np.int8); value = np.zeros(len(itos), dtype=np.int64)
+    kind[[pad, eos, end_tie]] = [KIND_PAD, KIND_EOS, KIND_END_TIE]
+    for k, table in [(KIND_PROGRAM, dict(enumerate(program.values()))),
+                     (KIND_NOTE_ON, note_on), (KIND_NOTE_OFF, note_off), (KIND_TIME, time)]:
+        ids = np.fromiter(table.values(), dtype=np.int64)
+        kind[ids] = k; value[ids] = np.fromiter(table.keys(), dtype=np.int64)
+    as_ids = lambda d: np.fromiter(d.values(), dtype=np.int64)
+    return Vocab(pad,eos,end_tie,program,note_on,note_off,time,itos,
+                 kind,value,as_ids(program),as_ids(note_on),as_ids(note_off),as_ids(time))
 
 VOCAB = build_vocab()
 
-def encode_events(note_events, program_id, ties):
+@dataclass(frozen=True)
+class EventCodec:
+    """
+    ノート列 <-> トークン列の符号化方式。語彙（VOCAB）は共通で、TIM_t の意味と並べ方だけが違う。
+      tie_section  : 先頭の Tie 節に持ち越しノートを NON_p で列挙して <end_tie> で閉じ、本文ではその NON を省く
+                     （False なら持ち越しがあるとき <end_tie> だけを宣言し、時刻 0 の NON として本文に書く）
+      delta        : TIM_t を「直前の時刻点から t ステップ進む」として使う（False なら絶対時刻）
+      offsets_first: 同時刻は NOF -> 長さ 0 のノート（NON, NOF）-> NON の順（同じピッチの連打を取り違えない）。
+                     先頭の時刻 0 には TIM を出さない（どちらの時刻の意味でも省略時の現在時刻は 0）
+    同時刻のイベントはどの方式でも1つの TIM の下にまとめる。
     """
-    note_events: [(on_ms, off_ms, pitch), ...]  ※チャンク内絶対msで量子化済み
+    name: str
+    tie_section: bool = False
+    delta: bool = False
+    offsets_first: bool = False
+
+    def encode(self, note_events, program_id, ties):
+        return _encode(self, note_events, program_id, ties)
+    def decode(self, token_ids):
+        return _decode(self, token_ids)
+
+# 選べる符号化方式（MT3Mini(codec=...) / AMTDataset(codec=...) などに名前で渡す）。absolute が従来の方式
+CODECS = {c.name: c for c in [
+    EventCodec("absolute"),
+    EventCodec("tie", tie_section=True, offsets_first=True),
+    EventCodec("delta", delta=True, offsets_first=True),
+    EventCodec("delta_tie", tie_section=True, delta=True, offsets_first=True),
+]}
+
+def get_codec(codec="absolute"):
+    """名前（None は absolute）または EventCodec -> EventCodec"""
+    if isinstance(codec, EventCodec):
+        return codec
+    codec = codec or "absolute"
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec: {codec} (choose from {list(CODECS)})")
+    return CODECS[codec]
+
+def encode_events(note_events, program_id, ties, codec="absolute"):
+    """
+    note_events: [(on_ms, off_ms, pitch), ...] または [N,3] 配列  ※チャンク内絶対msで量子化済み
     program_id: int (PRG)
     ties: [(pitch, remaining_ms), ...] チャンク先頭で鳴り続けている音
+    codec: CODECS の名前または EventCodec
     """
-    ids = [list(VOCAB.program.values())[program_id]]
-    if ties:  # Tie宣言節
-        ids += [VOCAB.end_tie]
-        # （MVPではTie詳細を持たせず宣言のみ。改良版で詳細符号化しても良い）
-    # 時系列をTIM→NON/NOFの順に並べる（同一時刻は[NON*,NOF*]の順で安定）
-    timeline = {}
-    for on,off,p in note_events:
-        timeline.setdefault(on, []).append(("on",p))
-        timeline.setdefault(off,[]).append(("off",p))
-    for t in sorted(timeline.keys()):
-        t_clamped = min(t, NUM_TIME - 1)    # ★保険
-        ids.append(VOCAB.time[t])
-        for kind,p in sorted(timeline[t], key=lambda x: 0 if x[0]=="on" else 1):
-            ids.append(VOCAB.note_on[p] if kind=="on" else VOCAB.note_off[p])
-    ids.append(VOCAB.eos)
-    return ids
-
-def decode_events(token_ids):
-    # 逆変換（MVP: プログラム検出/時間復元/ノート組み立て）
-    pass
\ No newline at end of file
+    return get_codec(codec).encode(note_events, program_id, ties)
+
+def _encode(codec, note_events, program_id, ties):
+    ev = np.asarray(note_events, dtype=np.int64).reshape(-1, 3)
+    head = [int(VOCAB.program_ids[program_id])]
+    tied = np.zeros(len(ev), dtype=bool)  # Tie節に書くノート
+    if len(ties) and codec.tie_section:  # Tie節: 持ち越しピッチを列挙
+        tied = _tied_rows(ev, ties)
+        head += VOCAB.note_on_ids[ev[tied, 2]].tolist() + [VOCAB.end_tie]
+    elif len(ties):  # Tie宣言節（宣言のみ）
+        head += [VOCAB.end_tie]
+    # 時系列をTIM→NON/NOFの順に並べる（同一時刻内の順は offsets_first で決まり、各々ノート順で安定）
+    n = len(ev)
+    on = np.flatnonzero(~tied) if tied.any() else np.arange(n)  # NON を本文に書くノート
+    t = np.concatenate([ev[on, 0], ev[:, 1]])
+    kind = np.repeat([0, 1], [len(on), n])
+    pitch = np.concatenate([ev[on, 2], ev[:, 2]])
+    note = np.concatenate([on, np.arange(n)])
+    if codec.offsets_first:  # NOF -> 長さ 0 のノート（ノートごとに NON, NOF）-> NON
+        zero = ev[:, 1] <= ev[:, 0]
+        rank = np.concatenate([np.where(zero[on], 1, 2), np.where(zero, 1, 0)])
+        srt = np.lexsort((kind, note, rank, t))
+    else:
+        srt = np.lexsort((note, kind, t))
+    t, kind, pitch = t[srt], kind[srt], pitch[srt]
+    ev_ids = np.where(kind == 0, VOCAB.note_on_ids[pitch], VOCAB.note_off_ids[pitch])
+
+    # 時刻が変わる位置の直前に TIM を差し込む
+    new_t = np.ones(len(t), dtype=bool); new_t[1:] = t[1:] != t[:-1]
+    if codec.offsets_first and len(t) and t[0] == 0:
+        new_t[0] = False
+    ev_pos = np.arange(len(t)) + np.cumsum(new_t)
+    body = np.empty(len(t) + int(new_t.sum()), dtype=np.int64)
+    body[ev_pos] = ev_ids
+    tim = t[new_t]
+    if codec.delta:
+        tim = np.diff(tim, prepend=0)
+    body[ev_pos[new_t] - 1] = VOCAB.time_ids[tim]
+    return head + body.tolist() + [VOCAB.eos]
+
+def _tied_rows(ev, ties):
+    """ties の各ピッチに、時刻 0 に始まる同じピッチの ev の行を1つずつ対応させる -> [N] bool"""
+    tied = np.zeros(len(ev), dtype=bool)
+    for p in np.asarray(ties, dtype=np.int64).reshape(-1, 2)[:, 0]:
+        cand = np.flatnonzero((ev[:, 0] == 0) & (ev[:, 2] == p) & ~tied)
+        if len(cand):
+            tied[cand[0]] = True
+    return tied
+
+def decode_events(token_ids, codec="absolute"):
+    """
+    トークン列 -> ノート配列 [N,3] (on, off, pitch)（時間は TIM と同じステップ単位）。
+    2次元配列やトークン列のリストを渡すとバッチとして処理し、配列のリストを返す。
+    規則は to_midi_from_tokens と同じ: <eos> で打ち切り、TIM で現在時刻を更新し（delta なら加算）、
+    NOF は同じピッチの直前のイベントが NON ならそのオンセットと組にする（ノートは NOF の順に並ぶ）。
+    Tie 節の NON は最初の TIM より前にあるので時刻 0 のオンセットになる。
+    """
+    return get_codec(codec).decode(token_ids)
+
+def _decode(codec, token_ids):
+    if isinstance(token_ids, np.ndarray):
+        single = token_ids.ndim == 1
+    else:
+        single = len(token_ids) == 0 or np.ndim(token_ids[0]) == 0
+    seqs = [token_ids] if single else list(token_ids)
+    # <eos> で打ち切って連結
+    cut = []
+    for ids in seqs:
+        ids = np.asarray(ids, dtype=np.int64)
+        stop = np.flatnonzero(ids == VOCAB.eos)
+        cut.append(ids[:stop[0]] if len(stop) else ids)
+    lengths = np.array([len(c) for c in cut], dtype=np.int64)
+    ids = np.concatenate(cut) if cut else np.zeros(0, dtype=np.int64)
+    row = np.repeat(np.arange(len(cut)), lengths)
+    row_start = np.cumsum(lengths) - lengths
+    kind, value = VOCAB.kind[ids], VOCAB.value[ids]
+    pos = np.arange(len(ids))
+
+    if codec.delta:
+        # 各位置の現在時刻 = 同じ行でそこまでの TIM の値の和
+        shift = np.where(kind == KIND_TIME, value, 0)
+        total = np.cumsum(shift)
+        cur = total - (total - shift)[row_start[row]] if len(ids) else pos
+    else:
+        # 各位置の現在時刻 = 同じ行で直近の TIM の値（なければ 0）
+        last = np.maximum.accumulate(np.where(kind == KIND_TIME, pos, -1)) if len(ids) else pos
+        cur = np.where(last >= row_start[row], value[np.maximum(last, 0)], 0)
+
+    # (行, ピッチ) ごとに NON/NOF を位置順に並べ、「直前が NON の NOF」を組にする
+    note = np.flatnonzero((kind == KIND_NOTE_ON) | (kind == KIND_NOTE_OFF))
+    note = note[np.lexsort((note, value[note], row[note]))]
+    r, p, k = row[note], value[note], kind[note]
+    match = np.zeros(len(note), dtype=bool)
+    match[1:] = (k[1:] == KIND_NOTE_OFF) & (k[:-1] == KIND_NOTE_ON) & (p[1:] == p[:-1]) & (r[1:] == r[:-1])
+    off_pos = note[match]
+    on_pos = note[np.flatnonzero(match) - 1]
+    srt = np.argsort(off_pos, kind="stable")
+    off_pos, on_pos = off_pos[srt], on_pos[srt]
+    notes = np.stack([cur[on_pos], cur[off_pos], value[off_pos]], axis=1)
+    bounds = np.searchsorted(row[off_pos], np.arange(len(cut) + 1))
+    out = [notes[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    return out[0] if single else out
@@ -1,13 +1,21 @@
-import torch, torch.nn as nn, torch.optim as optim
-from torch.utils.data import DataLoader
+import contextlib, csv, json, os, socket, tempfile, time
+import torch, torch.nn as nn, torch.nn.functional as F, torch.optim as optim
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.profiler import record_function
+from torch.utils.data import DataLoader, DistributedSampler
 from tqdm import tqdm    
-from .model import MT3Mini
+from .model import MT3Mini, save_checkpoint, load_checkpoint
 from .tokenizer import VOCAB
-from .dataset import AMTDataset
+from .dataset import AMTDataset, AMTChunkDataset
+from .sampler import BucketBatchSampler
+from .shards import ShardDataset
 
 def collate(batch):
     items=[]
     for chunks in batch:
+        if isinstance(chunks, tuple):  # AMTChunkDataset は1チャンクずつ返す
+            chunks = [chunks]
         for mel, ids, _ in chunks:
             items.append((torch.tensor(mel, dtype=torch.float32),
                           torch.tensor(ids, dtype=torch.long)))
@@ -26,26 +34,294 @@ def collate(batch):
     assert mels.ndim==3 and ys_in.ndim==2 and ys_tg.ndim==2, (mels.shape, ys_in.shape, ys_tg.shape)
     return mels, ys_in, ys_tg
 
-def train_loop(pairs, epochs=5, bs=8, lr=2e-4, device="cuda"):
-    ds = AMTDataset(pairs)
-    dl = DataLoader(ds, batch_size=bs, shuffle=True,
-                    collate_fn=collate, num_workers=2)
+def train_loop(pairs, epochs=5, bs=8, lr=2e-4, device="cuda", cache_dir=None, chunked=False,
+               max_tokens=None, log_path=None, profile_steps=None, profile_dir="profile",
+               accum_steps=1, save_path=None, seed=0, num_workers=2, threads=None, model_cfg=None,
+               teacher=None, distill_alpha=0.5):
+    # chunked=True ならチャンク単位のデータセット（bs はチャンク数）
+    # max_tokens を指定するとチャンク単位 + トークン長バケット（bs の代わりにトークン予算でバッチを組む）
+    # log_path を指定するとステップごとの計測（StepMetrics）を .csv / .jsonl に書き出す
+    # profile_steps=(start, stop) で通し番号 [start, stop) のステップを torch.profiler で記録し profile_dir に保存
+    # pairs にディレクトリ（pack_shards の出力）を渡すとシャードをストリーミングで読む（bs はチャンク数）
+    # torchrun（WORLD_SIZE > 1）や train_ddp から呼ぶと DDP（gloo）で学習する。bs / max_tokens は1プロセスあたり
+    # accum_steps 個のマイクロバッチで勾配を累積してから更新する。save_path には各エポック後に rank 0 が保存する
+    # model_cfg は MT3Mini の引数（preset / subsample / frontend / codec など）。データセットは model_cfg の codec で符号化する
+    # teacher（MT3Mini かチェックポイントのパス）を渡すと蒸留: 正解との CE と teacher の分布への KL を distill_alpha で混ぜる
+    #   （speculative_decode のドラフトを本体に寄せて採用率を上げる用途）
+    rank, world, own_group = _init_distributed()
+    if world > 1:
+        if threads is None:  # torchrun は OMP_NUM_THREADS=1 にするので、コアをプロセス数で分ける
+            threads = max(1, (os.cpu_count() or 1) // int(os.environ.get("LOCAL_WORLD_SIZE", world)))
+        if str(device).startswith("cuda"):
+            device = f"cuda:{int(os.environ.get('LOCAL_RANK', 0))}"
+    if threads:
+        torch.set_num_threads(threads)
+    log = print if rank == 0 else (lambda *a, **k: None)
 
-    model = MT3Mini(vocab_size=len(VOCAB.itos)).to(device)
+    codec = (model_cfg or {}).get("codec", "absolute")
+    sampler = None
+    if isinstance(pairs, (str, os.PathLike)):
+        ds = ShardDataset(pairs, seed=seed, rank=rank, num_replicas=world)
+        if ds.params.get("codec", "absolute") != codec:
+            raise ValueError(f"shards in {pairs} use codec {ds.params.get('codec', 'absolute')!r}, "
+                             f"but model_cfg has {codec!r}")
+        dl = DataLoader(ds, batch_size=bs, collate_fn=collate, num_workers=num_workers)
+    elif max_tokens is not None:
+        ds = AMTChunkDataset(pairs, cache_dir=cache_dir, codec=codec)
+        sampler = BucketBatchSampler(ds.token_lengths(), max_tokens, seed=seed, rank=rank, num_replicas=world)
+        dl = DataLoader(ds, batch_sampler=sampler, collate_fn=collate, num_workers=num_workers)
+    else:
+        ds = (AMTChunkDataset if chunked else AMTDataset)(pairs, cache_dir=cache_dir, codec=codec)
+        # 1プロセスでも DistributedSampler（num_replicas=1）で並べるので、
+        # bs を world 倍した単一プロセス学習と DDP の各ステップが同じサンプルを見る
+        sampler = DistributedSampler(ds, num_replicas=world, rank=rank, shuffle=True, seed=seed)
+        dl = DataLoader(ds, batch_size=bs, sampler=sampler,
+                        collate_fn=collate, num_workers=num_workers)
+
+    torch.manual_seed(seed)
+    model = MT3Mini(vocab_size=len(VOCAB.itos), **(model_cfg or {})).to(device)
+    net = model
+    if world > 1:
+        net = DistributedDataParallel(model, device_ids=[device] if str(device).startswith("cuda") else None)
     opt = optim.AdamW(model.parameters(), lr=lr)
-    crit= nn.CrossEntropyLoss(ignore_index=VOCAB.pad)
-    print(f"dataset size (chunks): {len(ds)}")
-    for ep in range(epochs):
-        model.train()
-        running_loss = 0.0
-        # tqdmでエポック単位の進捗バー
-        pbar = tqdm(dl, desc=f"Epoch {ep+1}/{epochs}", unit="batch")
-        for mels, y_in, y_tg in pbar:
-            mels, y_in, y_tg = mels.to(device), y_in.to(device), y_tg.to(device)
-            logits = model(mels, y_in)
-            loss = crit(logits.reshape(-1, logits.size(-1)), y_tg.reshape(-1))
-            opt.zero_grad(); loss.backward(); opt.step()
-            running_loss += loss.item()
-            pbar.set_postfix(loss=f"{loss.item():.3f}")
-        print(f"[epoch {ep+1}] avg_loss={running_loss/len(dl):.3f}")
-    return model
\ No newline at end of file
+    if isinstance(teacher, (str, os.PathLike)):
+        teacher = load_checkpoint(teacher, map_location=device)
+    if teacher is not None:
+        teacher = teacher.to(device).eval().requires_grad_(False)
+        if teacher.config.get("codec", "absolute") != codec:
+            raise ValueError(f"teacher uses codec {teacher.config.get('codec', 'absolute')!r}, but model_cfg has {codec!r}")
+    # トークン総数で割る（DDP では全ランクの総数）。勾配の平均と合わせて、全ランクを1つのバッチにしたのと同じ損失になる
+    crit= nn.CrossEntropyLoss(ignore_index=VOCAB.pad, reduction="sum")
+    metrics = StepMetrics(device, log_path) if (log_path or profile_steps) and rank == 0 else None
+    prof = StepProfiler(profile_steps, profile_dir) if profile_steps and rank == 0 else None
+    phase = metrics.phase if metrics else (lambda name: contextlib.nullcontext())
+    log(f"dataset size (chunks): {len(ds)}" + (f"  processes: {world} x {torch.get_num_threads()} threads" if world > 1 else ""))
+    step = 0
+    try:
+        for ep in range(epochs):
+            if sampler is not None:
+                sampler.set_epoch(ep)
+            if isinstance(ds, ShardDataset):
+                ds.set_epoch(ep)  # シャード順・シャッフルバッファの乱数をエポックごとに変える
+            net.train()
+            running_loss, n_batches = 0.0, 0
+            # tqdmでエポック単位の進捗バー
+            pbar = tqdm(dl, desc=f"Epoch {ep+1}/{epochs}", unit="batch", disable=rank != 0)
+            if metrics:
+                metrics.start_epoch(ep)
+            opt.zero_grad()
+            for mels, y_in, y_tg in pbar:
+                if prof:
+                    t0 = time.perf_counter()
+                    prof.step(step)
+                    metrics.t_last += time.perf_counter() - t0  # プロファイラの開始/書き出しはデータ待ちに含めない
+                update = (n_batches + 1) % accum_steps == 0
+                with phase("transfer"):
+                    mels, y_in, y_tg = mels.to(device), y_in.to(device), y_tg.to(device)
+                # 累積途中のマイクロバッチでは DDP の勾配 all-reduce を省く
+                with net.no_sync() if world > 1 and not update else contextlib.nullcontext():
+                    with phase("forward"):
+                        n_tok = (y_tg != VOCAB.pad).sum()
+                        if world > 1:
+                            dist.all_reduce(n_tok)
+                        logits = net(mels, y_in)
+                        logits = logits.reshape(-1, logits.size(-1))
+                        loss = crit(logits, y_tg.reshape(-1))
+                        if teacher is not None:
+                            keep = y_tg.reshape(-1) != VOCAB.pad
+                            with torch.no_grad():
+                                t_logp = teacher(mels, y_in).reshape(-1, logits.size(-1))[keep].log_softmax(-1)
+                            kl = F.kl_div(logits[keep].log_softmax(-1), t_logp, log_target=True, reduction="sum")
+                            loss = (1 - distill_alpha) * loss + distill_alpha * kl
+                        loss = loss * world / n_tok.clamp(min=1)
+                    with phase("backward"):
+                        (loss / accum_steps).backward()
+                if update:
+                    with phase("optimizer"):
+                        opt.step(); opt.zero_grad()
+                running_loss += loss.item(); n_batches += 1
+                if metrics:
+                    metrics.end_step(step, mels, y_tg, loss.item())
+                pbar.set_postfix(loss=f"{loss.item():.3f}")
+                step += 1
+            if n_batches % accum_steps:  # エポック末の端数マイクロバッチ（DDP では未同期なので手で平均する）
+                if world > 1:
+                    for p in model.parameters():
+                        if p.grad is not None:
+                            dist.all_reduce(p.grad); p.grad /= world
+                opt.step(); opt.zero_grad()
+            avg = torch.tensor([running_loss, n_batches], dtype=torch.float64)
+            if world > 1:
+                dist.all_reduce(avg)
+            log(f"[epoch {ep+1}] avg_loss={avg[0].item()/max(1, avg[1].item()):.3f}")
+            if isinstance(sampler, BucketBatchSampler):
+                st = sampler.stats()
+                log(f"[epoch {ep+1}] batches={st['batches']} padding_efficiency={st['efficiency']:.1%}")
+            if metrics:
+                metrics.end_epoch()
+            if save_path and rank == 0:
+                save_checkpoint(model, save_path)
+    finally:
+        if prof:
+            prof.close()
+        if metrics:
+            metrics.close()
+        if own_group:
+            dist.destroy_process_group()
+    return model
+
+def _init_distributed():
+    """環境変数（torchrun / train_ddp が設定）から gloo のプロセスグループを作る -> (rank, world, 自分で作ったか)"""
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size(), False
+    world = int(os.environ.get("WORLD_SIZE", "1"))
+    if world <= 1:
+        return 0, 1, False
+    dist.init_process_group("gloo", rank=int(os.environ["RANK"]), world_size=world)
+    return dist.get_rank(), world, True
+
+def train_ddp(pairs, world_size=2, save_path=None, **kwargs):
+    """
+    torchrun を使わずに、このマシン上で world_size 個のプロセスを起動して DDP 学習する（gloo）。
+    kwargs は train_loop の引数。学習後のモデル（rank 0 が保存したもの）を読み込んで返す
+    """
+    import torch.multiprocessing as mp
+    with tempfile.TemporaryDirectory() as tmp:
+        path = save_path or os.path.join(tmp, "ckpt.pt")
+        with socket.socket() as sock:  # 空いているポートを選ぶ
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        mp.spawn(_ddp_worker, args=(world_size, port, pairs, dict(kwargs, save_path=path)), nprocs=world_size)
+        model = load_checkpoint(path, mmap=False)  # 一時ディレクトリごと消すので写像せずに読む
+    return model
+
+def _ddp_worker(rank, world_size, port, pairs, kwargs):
+    os.environ.update(RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(world_size),
+                      LOCAL_WORLD_SIZE=str(world_size), MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port))
+    train_loop(pairs, **kwargs)
+
+def compare_ddp(pairs, world_size=2, bs=2, **kwargs):
+    """
+    world_size プロセス x bs の DDP 学習（train_ddp）と、1 プロセス x (world_size * bs) の train_loop を同じ条件で回し、
+    パラメータの最大差と所要時間を返す（DistributedSampler で各ステップが同じサンプルを見るので、差は丸め誤差だけになる）。
+    kwargs は両方の train_loop に渡す（初期値をそろえるため seed と、dropout=0 の model_cfg を渡すこと）。
+    返り値: {max_diff, single_sec, ddp_sec, speedup, scaling_efficiency}（ddp_sec はプロセス起動込み）
+    """
+    kwargs = dict(kwargs, num_workers=kwargs.get("num_workers", 0))
+    t0 = time.perf_counter()
+    single = train_loop(pairs, bs=bs * world_size, threads=os.cpu_count(), **kwargs)
+    t_single = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ddp = train_ddp(pairs, world_size=world_size, bs=bs, **kwargs)
+    t_ddp = time.perf_counter() - t0
+    sd = ddp.state_dict()
+    diff = max((v - sd[k]).abs().max().item() for k, v in single.state_dict().items())
+    return {"max_diff": diff, "single_sec": t_single, "ddp_sec": t_ddp,
+            "speedup": t_single / t_ddp, "scaling_efficiency": t_single / t_ddp / world_size}
+
+PHASES = ("data_wait", "transfer", "forward", "backward", "optimizer")
+
+class StepMetrics:
+    """
+    学習ステップごとの時間内訳（data_wait / transfer / forward / backward / optimizer）とスループットを記録する。
+    data_wait は前ステップの終了から次のバッチが出てくるまで（DataLoader 待ち）。
+    CUDA では各区間の終わりで同期するので、計測中は非同期実行の重なりが無くなる点に注意
+    """
+    def __init__(self, device, log_path=None):
+        self.sync = torch.cuda.synchronize if str(device).startswith("cuda") else (lambda: None)
+        self.log_path = log_path
+        self._f = self._writer = None
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            self._f = open(log_path, "w", newline="")
+
+    def start_epoch(self, epoch):
+        self.epoch, self.rows, self.slots = epoch, [], 0
+        self.cur = dict.fromkeys(PHASES, 0.0)
+        self.t_last = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if name == "transfer":  # ループ先頭: ここまでがデータ待ち
+            self.cur["data_wait"] = time.perf_counter() - self.t_last
+        t0 = time.perf_counter()
+        with record_function(name):
+            yield
+            self.sync()
+        self.cur[name] = time.perf_counter() - t0
+
+    def end_step(self, step, mels, y_tg, loss):
+        now = time.perf_counter()
+        tokens = int((y_tg != VOCAB.pad).sum())
+        self.slots += y_tg.numel()
+        row = {"epoch": self.epoch, "step": step, **self.cur,
+               "step_sec": now - self.t_last, "chunks": mels.size(0), "tokens": tokens,
+               "padding_ratio": 1 - tokens / max(1, y_tg.numel()), "loss": loss}
+        row["chunks_per_sec"] = row["chunks"] / max(row["step_sec"], 1e-9)
+        row["tokens_per_sec"] = tokens / max(row["step_sec"], 1e-9)
+        self.rows.append(row)
+        self._write(row)
+        self.cur = dict.fromkeys(PHASES, 0.0)
+        self.t_last = now
+
+    def end_epoch(self):
+        """エポックの集計を表示し、データ待ちが計算時間を上回っていれば警告する"""
+        if not self.rows:
+            return {}
+        tot = {k: sum(r[k] for r in self.rows) for k in (*PHASES, "step_sec", "chunks", "tokens")}
+        compute = tot["transfer"] + tot["forward"] + tot["backward"] + tot["optimizer"]
+        pad = 1 - tot["tokens"] / max(1, self.slots)
+        ep = self.epoch + 1
+        print(f"[epoch {ep}] " + " ".join(f"{k}={tot[k]:.2f}s" for k in PHASES) +
+              f" chunks/s={tot['chunks'] / tot['step_sec']:.1f} tokens/s={tot['tokens'] / tot['step_sec']:.0f}"
+              f" padding={pad:.1%}")
+        if tot["data_wait"] > compute:
+            print(f"[epoch {ep}] warning: data wait ({tot['data_wait']:.2f}s) > compute ({compute:.2f}s); "
+                  "the input pipeline is the bottleneck (try more num_workers, cache_dir or chunked=True)")
+        return tot
+
+    def _write(self, row):
+        if self._f is None:
+            return
+        if self.log_path.endswith(".csv"):
+            if self._writer is None:
+                self._writer = csv.DictWriter(self._f, fieldnames=list(row))
+                self._writer.writeheader()
+            self._writer.writerow(row)
+        else:
+            self._f.write(json.dumps(row) + "\n")
+        self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close(); self._f = None
+
+class StepProfiler:
+    """通し番号 [start, stop) の学習ステップを torch.profiler で記録し、Chrome trace と集計表を保存する"""
+    def __init__(self, steps, out_dir="profile"):
+        self.start, self.stop = steps
+        self.out_dir = out_dir
+        self.prof = None
+
+    def step(self, step):
+        if step == self.start and self.prof is None:
+            acts = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                acts.append(torch.profiler.ProfilerActivity.CUDA)
+            self.prof = torch.profiler.profile(activities=acts, record_shapes=True)
+            self.prof.__enter__()
+        elif step == self.stop:
+            self.close()
+
+    def close(self):
+        if self.prof is None:
+            return
+        prof, self.prof = self.prof, None
+        prof.__exit__(None, None, None)
+        os.makedirs(self.out_dir, exist_ok=True)
+        trace = os.path.join(self.out_dir, f"trace_steps_{self.start}-{self.stop}.json")
+        prof.export_chrome_trace(trace)
+        table = prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=20)
+        with open(os.path.join(self.out_dir, f"summary_steps_{self.start}-{self.stop}.txt"), "w") as f:
+            f.write(table)
+        print(f"profiler trace -> {trace}")
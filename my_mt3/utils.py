@@ -0,0 +1,11 @@
+# amtx/utils.py  (標準ライブラリだけで動く小物。cli から torch なしで import される)
+import glob, os
+
+def collect_pairs(wav_dir="data/wavs", midi_dir="data/midis", program=0):
+    """wav_dir/*.wav と同名の midi_dir/*.mid を組にする -> [(wav, midi, program_id), ...]（既定 program 0: piano）"""
+    pairs = []
+    for w in sorted(glob.glob(os.path.join(wav_dir, "*.wav"))):
+        m = os.path.join(midi_dir, os.path.splitext(os.path.basename(w))[0] + ".mid")
+        if os.path.exists(m):
+            pairs.append((w, m, program))
+    return pairs
@@ -0,0 +1,55 @@
+# run/bench_decode.py
+# greedy_decode の KVキャッシュ版と従来版（毎ステップ全プレフィックス再計算）の steps/sec 比較
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, time
+import numpy as np
+import torch
+from my_mt3 import infer
+from my_mt3.infer import greedy_decode
+from my_mt3.model import MT3Mini, load_checkpoint
+from my_mt3.tokenizer import VOCAB
+
+def bench(model, mel, device, use_cache, repeat):
+    greedy_decode(model, mel, device=device, use_cache=use_cache)  # warmup
+    steps, t0 = 0, time.perf_counter()
+    for _ in range(repeat):
+        steps += len(greedy_decode(model, mel, device=device, use_cache=use_cache))
+    return steps, time.perf_counter() - t0
+
+def main():
+    ap = argparse.ArgumentParser(description="greedy_decode steps/sec 比較")
+    ap.add_argument("--ckpt", help="学習済みチェックポイント（省略時はランダム初期化）")
+    ap.add_argument("--steps", type=int, default=300, help="1チャンクあたりのデコード長")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--device", default="cpu")
+    args = ap.parse_args()
+
+    torch.manual_seed(0)
+    if args.ckpt:
+        model = load_checkpoint(args.ckpt, map_location=args.device).to(args.device)
+    else:
+        model = MT3Mini(vocab_size=len(VOCAB.itos)).to(args.device)
+        # ランダム重みでは即<eos>になり得るので、長さを固定するため<eos>を抑制
+        with torch.no_grad():
+            model.dec.lm.bias[VOCAB.eos] = -1e4
+    infer.MAX_STEPS = args.steps
+    mel = np.random.default_rng(0).standard_normal((177, 256)).astype(np.float32)
+
+    ref = greedy_decode(model, mel, device=args.device, use_cache=False)
+    out = greedy_decode(model, mel, device=args.device, use_cache=True)
+    print(f"tokens identical: {ref == out}  (len={len(out)})")
+
+    res = {}
+    for name, use_cache in [("full", False), ("kv_cache", True)]:
+        steps, sec = bench(model, mel, args.device, use_cache, args.repeat)
+        res[name] = steps / sec
+        print(f"{name:>8}: {steps/sec:8.1f} steps/sec  ({sec/args.repeat:.3f} s/chunk)")
+    print(f" speedup: x{res['kv_cache']/res['full']:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# run/bench_engine.py
+# 推論エンジンのバリアント（fp32 / int8 / compile / torchscript / onnx）のパリティとレイテンシを比較する
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, json
+import torch
+from my_mt3.dataset import AMTDataset
+from my_mt3.engine import VARIANTS, compare_variants, load_model
+from my_mt3.infer import to_midi_from_tokens
+from my_mt3.utils import collect_pairs
+
+def main():
+    ap = argparse.ArgumentParser(description="推論エンジンのパリティ/レイテンシ比較")
+    ap.add_argument("--ckpt", default="ckpt_piano.pt")
+    ap.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=VARIANTS)
+    ap.add_argument("--max_chunks", type=int, default=32)
+    ap.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    ap.add_argument("--export_dir", default=None, help="TorchScript/ONNX の書き出し先")
+    ap.add_argument("--json", default=None, help="結果をJSONで保存")
+    args = ap.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    # 評価チャンク: データセットの mel と正解トークン（-> 正解MIDI）
+    ds = AMTDataset(collect_pairs())
+    mels, refs = [], []
+    for i in range(len(ds)):
+        for mel, ids, _ in ds[i]:
+            mels.append(mel); refs.append(to_midi_from_tokens(ids))
+        if len(mels) >= args.max_chunks:
+            break
+    mels, refs = mels[:args.max_chunks], refs[:args.max_chunks]
+
+    res = compare_variants(load_model(args.ckpt), mels, variants=args.variants, refs=refs,
+                           export_dir=args.export_dir)
+    print(f"chunks: {len(mels)}  threads: {torch.get_num_threads()}")
+    print(f"{'variant':>12} {'agree':>7} {'batch':>7} {'onsetF1':>8} {'dF1':>7} {'ms/chunk':>9} {'chunks/s':>9} {'tok/s':>8}")
+    for v, r in res.items():
+        print(f"{v:>12} {r['agreement']:7.3f} {r['batch_agreement']:7.3f} {r['onset_f1']:8.3f} {r['onset_f1_delta']:+7.3f} "
+              f"{r['ms_per_chunk']:9.1f} {r['chunks_per_sec']:9.2f} {r['tokens_per_sec']:8.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(res, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# run/bench_presets.py
+# モデルプリセット x エンコーダ間引き（subsample / frontend）ごとのパラメータ数・FLOPs・CPU レイテンシ
+#
+#   python run/bench_presets.py --presets tiny small base --subsample 1 2 4 --out presets.json
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, itertools, json, time
+import torch
+from torch.utils.flop_counter import FlopCounterMode, flop_registry, register_flop_formula, sdpa_flop_count
+from my_mt3 import infer
+from my_mt3.engine import _no_fastpath
+from my_mt3.infer import greedy_decode
+from my_mt3.model import FRONTENDS, PRESETS, MT3Mini
+from my_mt3.tokenizer import VOCAB
+
+# CPU の scaled_dot_product_attention（デコーダの KV キャッシュ経路）は FlopCounterMode に式が無いので足す
+_SDPA_CPU = torch.ops.aten._scaled_dot_product_flash_attention_for_cpu
+if _SDPA_CPU not in flop_registry:
+    @register_flop_formula(_SDPA_CPU)
+    def _sdpa_cpu_flop(query, key, value, *args, out_shape=None, **kwargs):
+        return sdpa_flop_count(query, key, value)
+
+def count_flops(fn):
+    with FlopCounterMode(display=False) as fc:
+        fn()
+    return fc.get_total_flops()
+
+def median_ms(fn, repeat):
+    fn()  # warmup
+    ts = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); ts.append(time.perf_counter() - t0)
+    return 1000 * sorted(ts)[len(ts) // 2]
+
+def bench(model, mel, args):
+    """1チャンクあたりの エンコーダ / デコーダ1ステップ（プレフィックス長 decode_steps/2）の FLOPs と、エンコード・デコードの時間"""
+    y = torch.full((1, args.decode_steps // 2), VOCAB.pad)
+    with torch.no_grad():
+        mem = model.enc(mel)
+        def dec_step():
+            cache = model.dec.init_cache(mem)
+            model.dec.step(y[:, :-1], cache)
+            return lambda: model.dec.step(y[:, -1:], [list(c) for c in cache])
+        with _no_fastpath():  # fused encoder op は FlopCounter に数えられないので通常経路で数える
+            enc_flops = count_flops(lambda: model.enc(mel))
+            init_flops = count_flops(lambda: model.dec.init_cache(mem))
+        step = dec_step()
+        step_flops = count_flops(step)
+        enc_ms = median_ms(lambda: model.enc(mel), args.repeat)
+    with torch.no_grad():
+        model.dec.lm.bias[VOCAB.eos] = -1e4  # ランダム重みでも長さを decode_steps に固定する
+    prev, infer.MAX_STEPS = infer.MAX_STEPS, args.decode_steps
+    try:
+        decode_ms = median_ms(lambda: greedy_decode(model, mel[0].numpy(), device="cpu"), args.repeat)
+    finally:
+        infer.MAX_STEPS = prev
+    return {"params_M": sum(p.numel() for p in model.parameters()) / 1e6,
+            "enc_frames": mem.size(1),
+            "enc_gflops": (enc_flops + init_flops) / 1e9,
+            "step_mflops": step_flops / 1e6,
+            "chunk_gflops": (enc_flops + init_flops + args.decode_steps * step_flops) / 1e9,
+            "enc_ms": enc_ms, "decode_ms": decode_ms}
+
+def main():
+    ap = argparse.ArgumentParser(description="プリセット / エンコーダ間引きごとの FLOPs とレイテンシ")
+    ap.add_argument("--presets", nargs="+", choices=list(PRESETS), default=list(PRESETS))
+    ap.add_argument("--subsample", nargs="+", type=int, choices=[1, 2, 4], default=[1, 2, 4])
+    ap.add_argument("--frontends", nargs="+", choices=FRONTENDS, default=["stack"])
+    ap.add_argument("--frames", type=int, default=177, help="1チャンクの mel フレーム数（2.048s）")
+    ap.add_argument("--decode_steps", type=int, default=128)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--threads", type=int, default=None)
+    ap.add_argument("--out", default=None, help="結果の JSON 出力先")
+    args = ap.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    mel = torch.randn(1, args.frames, 256)
+    results = {}
+    print(f"{'config':>16} {'params':>8} {'frames':>6} {'encGF':>7} {'stepMF':>7} {'chunkGF':>8} {'enc ms':>8} {'dec ms':>8}")
+    for preset, k, fe in itertools.product(args.presets, args.subsample, args.frontends):
+        if k == 1 and fe != args.frontends[0]:
+            continue  # subsample=1 では frontend は関係ない
+        name = f"{preset}/x{k}" + (f"/{fe}" if k > 1 else "")
+        torch.manual_seed(0)
+        model = MT3Mini(vocab_size=len(VOCAB.itos), preset=preset, subsample=k, frontend=fe).eval()
+        results[name] = r = bench(model, mel, args)
+        print(f"{name:>16} {r['params_M']:7.2f}M {r['enc_frames']:6d} {r['enc_gflops']:7.2f} {r['step_mflops']:7.1f} "
+              f"{r['chunk_gflops']:8.2f} {r['enc_ms']:8.1f} {r['decode_ms']:8.1f}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"meta": {"frames": args.frames, "decode_steps": args.decode_steps,
+                                "threads": torch.get_num_threads(), "torch": torch.__version__},
+                       "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# run/bench_speculative.py
+# 投機的デコード（ドラフトモデルで先読み + 本体で一括検証）と通常の greedy_decode の比較:
+# 出力の一致、採用率、1回の本体 step あたりのトークン数、速度向上
+#
+# ドラフトは同じデータで tiny プリセットを本体から蒸留して作る:
+#   train_loop(pairs, model_cfg={"preset": "tiny"}, teacher="ckpt_piano.pt", save_path="ckpt_draft.pt")
+#
+#   python run/bench_speculative.py --ckpt ckpt_piano.pt --draft_ckpt ckpt_draft.pt --k 2 4 8
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, glob, json, time
+import torch
+from my_mt3.audio import load_wav_mono
+from my_mt3.engine import load_model
+from my_mt3.infer import chunk_logmels, greedy_decode, speculative_decode, speculative_stats
+
+def main():
+    ap = argparse.ArgumentParser(description="投機的デコードの採用率と速度向上")
+    ap.add_argument("--ckpt", default="ckpt_piano.pt")
+    ap.add_argument("--draft_ckpt", default="ckpt_draft.pt")
+    ap.add_argument("--wavs", default="data/wavs/*.wav", help="入力 WAV の glob")
+    ap.add_argument("--max_chunks", type=int, default=32)
+    ap.add_argument("--k", nargs="+", type=int, default=[2, 4, 8], help="1ラウンドで先読みするトークン数")
+    ap.add_argument("--threads", type=int, default=None)
+    ap.add_argument("--out", default=None, help="結果の JSON 出力先")
+    args = ap.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model, draft = load_model(args.ckpt), load_model(args.draft_ckpt)
+    mels = []
+    for wav in sorted(glob.glob(args.wavs)):
+        mels += [mel for mel, _ in chunk_logmels(load_wav_mono(wav)[0])]
+        if len(mels) >= args.max_chunks:
+            break
+    mels = mels[:args.max_chunks]
+    if not mels:
+        raise SystemExit(f"WAV が見つかりません: {args.wavs}")
+
+    greedy_decode(model, mels[0], device="cpu")  # warmup
+    t0 = time.perf_counter()
+    ref = [greedy_decode(model, m, device="cpu") for m in mels]
+    t_greedy = time.perf_counter() - t0
+    n_tok = sum(map(len, ref))
+    print(f"greedy: {len(mels)} chunks, {n_tok} tokens, {t_greedy:.2f}s ({n_tok / t_greedy:.1f} tok/s)")
+
+    results = {"greedy": {"sec": t_greedy, "tokens": n_tok}}
+    for k in args.k:
+        stats = {}
+        t0 = time.perf_counter()
+        outs = [speculative_decode(model, draft, m, device="cpu", k=k, stats=stats) for m in mels]
+        sec = time.perf_counter() - t0
+        r = speculative_stats(stats)
+        r.update(sec=sec, speedup=t_greedy / sec, identical=outs == ref)
+        results[f"k={k}"] = r
+        print(f"k={k}: {sec:.2f}s  speedup=x{r['speedup']:.2f}  acceptance={r['acceptance_rate']:.1%}  "
+              f"tokens/main_step={r['tokens_per_main_step']:.2f}  identical={r['identical']}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if not all(r.get("identical", True) for r in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
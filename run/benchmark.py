@@ -0,0 +1,167 @@
+# run/benchmark.py
+# 前処理・データ・学習・デコードのホットパスのベンチマーク（CPU・オフライン）
+# 入力は run/make_synth_piano.py の合成データ。結果を JSON に保存し、--compare で保存済みベースラインと比べる
+#
+#   python run/benchmark.py --out bench.json                      # 計測して保存
+#   python run/benchmark.py --compare bench.json --threshold 0.2  # ベースラインより 20% 以上遅い項目があれば exit 1
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, json, os, platform, statistics, tempfile, time
+import numpy as np
+import torch, torch.nn as nn
+from my_mt3 import infer
+from my_mt3.audio import load_wav_mono, wav_to_logmel
+from my_mt3.dataset import AMTDataset, assign_notes, load_notes
+from my_mt3.infer import greedy_decode
+from my_mt3.model import MT3Mini
+from my_mt3.tokenizer import VOCAB, encode_events
+from my_mt3.train import collate
+import make_synth_piano
+
+def timeit(fn, repeat, warmup=1):
+    """fn() を warmup 回捨ててから repeat 回測る -> 1回あたりの秒数のリスト"""
+    for _ in range(warmup):
+        fn()
+    ts = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); ts.append(time.perf_counter() - t0)
+    return ts
+
+def result(ts, items=1, unit="items"):
+    med = statistics.median(ts)
+    return {"median_ms": 1000 * med, "min_ms": 1000 * min(ts), "repeat": len(ts),
+            f"{unit}_per_sec": items / med}
+
+def make_data(root, n_files, seed=42):
+    wav_dir, mid_dir = os.path.join(root, "wavs"), os.path.join(root, "midis")
+    make_synth_piano.generate(n_files, wav_dir, mid_dir, workers=1, seed=seed)
+    return [(os.path.join(wav_dir, f"pno_{i:04d}.wav"), os.path.join(mid_dir, f"pno_{i:04d}.mid"), 0)
+            for i in range(n_files)]
+
+# ===== 各ベンチマーク（名前 -> 関数(pairs, args) -> 結果 dict） =====
+def bench_load_wav_mono(pairs, args):
+    wavs = [p[0] for p in pairs]
+    return result(timeit(lambda: [load_wav_mono(w) for w in wavs], args.repeat), len(wavs), "files")
+
+def bench_wav_to_logmel(pairs, args):
+    y = np.concatenate([load_wav_mono(p[0])[0] for p in pairs])  # 全ファイルを連結した長い信号
+    sec = len(y) / make_synth_piano.SR
+    r = result(timeit(lambda: wav_to_logmel(y), args.repeat), sec, "audio_sec")
+    r["audio_sec"] = sec
+    return r
+
+def bench_dataset_getitem(pairs, args):
+    ds = AMTDataset(pairs)
+    return result(timeit(lambda: [ds[i] for i in range(len(ds))], args.repeat), len(ds), "items")
+
+def bench_collate(pairs, args):
+    ds = AMTDataset(pairs)
+    items = [ds[i % len(ds)] for i in range(args.batch_size)]
+    return result(timeit(lambda: collate(items), args.repeat * 10), 1, "batches")
+
+def bench_encode_events(pairs, args):
+    per_chunk = []
+    for _, midi, _ in pairs:
+        notes = load_notes(midi)
+        per_chunk += assign_notes(notes, [0.0], [make_synth_piano.CHUNK_SEC])
+    return result(timeit(lambda: [encode_events(ev, 0, ties) for ev, ties in per_chunk], args.repeat * 10),
+                  len(per_chunk), "calls")
+
+def bench_train_step(pairs, args):
+    torch.manual_seed(0)
+    ds = AMTDataset(pairs)
+    mels, y_in, y_tg = collate([ds[i % len(ds)] for i in range(args.batch_size)])
+    model = MT3Mini(vocab_size=len(VOCAB.itos)).train()
+    opt = torch.optim.AdamW(model.parameters(), lr=2e-4)
+    crit = nn.CrossEntropyLoss(ignore_index=VOCAB.pad)
+    def step():
+        logits = model(mels, y_in)
+        loss = crit(logits.reshape(-1, logits.size(-1)), y_tg.reshape(-1))
+        opt.zero_grad(); loss.backward(); opt.step()
+    return result(timeit(step, args.repeat), mels.size(0), "chunks")
+
+def bench_greedy_decode(pairs, args):
+    torch.manual_seed(0)
+    model = MT3Mini(vocab_size=len(VOCAB.itos)).eval()
+    with torch.no_grad():
+        model.dec.lm.bias[VOCAB.eos] = -1e4  # ランダム重みでも長さを decode_steps に固定する
+    mel = AMTDataset(pairs[:1])[0][0][0]
+    prev, infer.MAX_STEPS = infer.MAX_STEPS, args.decode_steps
+    try:
+        n = len(greedy_decode(model, mel, device="cpu"))
+        r = result(timeit(lambda: greedy_decode(model, mel, device="cpu"), args.repeat), n, "tokens")
+    finally:
+        infer.MAX_STEPS = prev
+    r["tokens"] = n
+    return r
+
+BENCHMARKS = {
+    "load_wav_mono": bench_load_wav_mono,
+    "wav_to_logmel": bench_wav_to_logmel,
+    "dataset_getitem": bench_dataset_getitem,
+    "collate": bench_collate,
+    "encode_events": bench_encode_events,
+    "train_step": bench_train_step,
+    "greedy_decode": bench_greedy_decode,
+}
+
+def compare(results, baseline, threshold):
+    """median_ms がベースラインの (1 + threshold) 倍を超えた項目を返す"""
+    regressions = []
+    print(f"{'benchmark':>16} {'base ms':>10} {'now ms':>10} {'ratio':>7}")
+    for name, r in results.items():
+        b = baseline.get("results", {}).get(name)
+        if b is None:
+            print(f"{name:>16} {'-':>10} {r['median_ms']:10.2f}    new")
+            continue
+        ratio = r["median_ms"] / max(b["median_ms"], 1e-9)
+        slow = ratio > 1 + threshold
+        print(f"{name:>16} {b['median_ms']:10.2f} {r['median_ms']:10.2f} {ratio:7.2f}" + ("  SLOWER" if slow else ""))
+        if slow:
+            regressions.append(name)
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser(description="ホットパスのベンチマーク（JSON 保存 / ベースライン比較）")
+    ap.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    ap.add_argument("--n_files", type=int, default=16, help="合成データのファイル数")
+    ap.add_argument("--data_dir", default=None, help="合成データの置き場所（省略時は一時ディレクトリ）")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--batch_size", type=int, default=8, help="collate / train_step のチャンク数")
+    ap.add_argument("--decode_steps", type=int, default=256)
+    ap.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    ap.add_argument("--out", default=None, help="結果の JSON 出力先")
+    ap.add_argument("--compare", default=None, help="比較するベースライン JSON")
+    ap.add_argument("--threshold", type=float, default=0.1, help="この割合を超えて遅くなったら回帰とみなす")
+    args = ap.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pairs = make_data(args.data_dir or tmp, args.n_files)
+        results = {}
+        for name in args.only:
+            results[name] = r = BENCHMARKS[name](pairs, args)
+            rate = next(f"{v:.1f} {k}" for k, v in r.items() if k.endswith("_per_sec"))
+            print(f"{name:>16}: {r['median_ms']:9.2f} ms  ({rate})")
+
+    out = {"meta": {"python": platform.python_version(), "torch": torch.__version__,
+                    "platform": platform.platform(), "threads": torch.get_num_threads(),
+                    "n_files": args.n_files, "repeat": args.repeat},
+           "results": results}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(out, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"regressions (> +{args.threshold:.0%}): {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
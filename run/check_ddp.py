@@ -0,0 +1,46 @@
+# run/check_ddp.py
+# DDP（gloo、CPU）学習の確認: 2 プロセス x bs と 1 プロセス x (2*bs) が同じパラメータになるか、
+# またスケーリング効率（速度向上 / プロセス数）を表示する（train.compare_ddp の薄いラッパ。同じ確認は tests/test_ddp.py）
+#
+#   python run/check_ddp.py --n_files 32 --world_size 2
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, os, tempfile
+from my_mt3.train import compare_ddp
+import make_synth_piano
+
+def main():
+    ap = argparse.ArgumentParser(description="DDP 学習の一致確認とスケーリング効率")
+    ap.add_argument("--n_files", type=int, default=32, help="合成データのファイル数（world_size * bs の倍数にする）")
+    ap.add_argument("--world_size", type=int, default=2)
+    ap.add_argument("--bs", type=int, default=2, help="1プロセスあたりのバッチサイズ")
+    ap.add_argument("--epochs", type=int, default=1)
+    ap.add_argument("--accum_steps", type=int, default=1)
+    ap.add_argument("--lr", type=float, default=1e-4)
+    ap.add_argument("--atol", type=float, default=None, help="許容するパラメータ差（既定: lr。Adam は勾配の丸め誤差を最大 lr 程度に増幅する）")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wav_dir, mid_dir = os.path.join(tmp, "wavs"), os.path.join(tmp, "midis")
+        make_synth_piano.generate(args.n_files, wav_dir, mid_dir, workers=1)
+        pairs = [(os.path.join(wav_dir, f"pno_{i:04d}.wav"), os.path.join(mid_dir, f"pno_{i:04d}.mid"), 0)
+                 for i in range(args.n_files)]
+        # dropout=0 と同じ seed で、初期値・データ順を両者でそろえる
+        r = compare_ddp(pairs, world_size=args.world_size, bs=args.bs, epochs=args.epochs, lr=args.lr,
+                        device="cpu", seed=0, accum_steps=args.accum_steps, model_cfg={"dropout": 0.0})
+
+    print(f"single: {r['single_sec']:.2f}s  ddp x{args.world_size}: {r['ddp_sec']:.2f}s  (プロセス起動込み)")
+    print(f"speedup={r['speedup']:.2f}  scaling_efficiency={r['scaling_efficiency']:.1%}  cores={os.cpu_count()}")
+    print(f"max |param diff| = {r['max_diff']:.2e}")
+    atol = args.atol if args.atol is not None else args.lr
+    if r["max_diff"] > atol:
+        print(f"MISMATCH (> {atol:g})")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
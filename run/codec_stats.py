@@ -0,0 +1,87 @@
+# run/codec_stats.py
+# トークンの符号化方式（tokenizer.CODECS）ごとのコーパス統計: チャンクあたりの系列長（平均 / p95 / 最大）、
+# 総トークン数と absolute 比、使われた語彙の数、デコードのステップ数と自己注意のコスト（系列長の2乗和）の見積り。
+# 併せて全チャンクで encode -> decode の往復がノートを失わないか確認する（失敗があれば終了コード 1）
+#
+#   python run/codec_stats.py                 # data/wavs, data/midis
+#   python run/codec_stats.py --random 200    # 和音・連打・長い音を含むランダムな曲を足して往復を確認する
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, json
+import numpy as np
+from my_mt3.dataset import AMTChunkDataset, assign_notes, load_notes, random_chunks
+from my_mt3.tokenizer import CHUNK_SEC, CODECS, KIND_TIME, VOCAB, decode_events, encode_events
+from my_mt3.utils import collect_pairs
+
+# absolute は同じピッチの連打（同時刻の NOF と NON）を取り違えることがある（従来どおりの既知の制限）
+LOSSY_OK = {"absolute"}
+
+def corpus_chunks(pairs):
+    """データセットと同じチャンク分割でノートを割り当てる -> [(ev, ties), ...]"""
+    ds = AMTChunkDataset(pairs)
+    by_file = {}
+    for i, _, s, e, _, _ in ds.index:
+        by_file.setdefault(i, []).append((s, e))
+    out = []
+    for i, spans in by_file.items():
+        out += assign_notes(load_notes(pairs[i][1]), [s for s, _ in spans], [e for _, e in spans], ds.step_ms)
+    return out
+
+def codec_stats(chunks, codec):
+    key = lambda notes: sorted(map(tuple, np.asarray(notes).tolist()))
+    seqs = [encode_events(ev, 0, ties, codec=codec) for ev, ties in chunks]
+    decoded = decode_events(seqs, codec=codec)
+    failed = sum(key(d) != key(ev) for d, (ev, _) in zip(decoded, chunks))
+    lengths = np.array([len(s) for s in seqs])
+    ids = np.concatenate([np.asarray(s) for s in seqs])
+    used = np.unique(ids)
+    return {"chunks": len(seqs), "tokens": int(lengths.sum()),
+            "len_mean": float(lengths.mean()), "len_p95": float(np.percentile(lengths, 95)),
+            "len_max": int(lengths.max()),
+            "time_token_share": float(np.mean(VOCAB.kind[ids] == KIND_TIME)),
+            "vocab_used": len(used), "time_vocab_used": int(np.sum(VOCAB.kind[used] == KIND_TIME)),
+            "decode_steps": int((lengths - 1).sum()),       # 先頭の PRG はデコーダに与える側
+            "attn_cost": float(np.sum(lengths.astype(np.float64) ** 2)),
+            "roundtrip_failed": int(failed)}
+
+def main():
+    ap = argparse.ArgumentParser(description="符号化方式ごとの系列長・語彙の統計と往復確認")
+    ap.add_argument("--codecs", nargs="+", default=list(CODECS), choices=list(CODECS))
+    ap.add_argument("--random", type=int, default=0, help="ランダムな多声の曲をこの数だけ足す")
+    ap.add_argument("--no_corpus", action="store_true", help="data/ のコーパスを使わない（--random だけ）")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", default=None, help="結果をJSONで保存")
+    args = ap.parse_args()
+
+    chunks = [] if args.no_corpus else corpus_chunks(collect_pairs())
+    chunks += random_chunks(args.random, seed=args.seed)
+    if not chunks:
+        raise SystemExit("チャンクがありません（data/wavs, data/midis を用意するか --random を指定）")
+    print(f"chunks: {len(chunks)}  notes: {sum(len(ev) for ev, _ in chunks)}  "
+          f"ties: {sum(len(t) for _, t in chunks)}  vocab: {len(VOCAB.itos)}  chunk: {CHUNK_SEC}s")
+
+    results = {c: codec_stats(chunks, c) for c in args.codecs}
+    base = results.get("absolute")
+    print(f"{'codec':<10} {'mean':>7} {'p95':>6} {'max':>5} {'tokens':>8} {'ratio':>6} {'attn':>6} "
+          f"{'vocab':>5} {'TIM':>4} {'TIM%':>5} {'rt_fail':>7}")
+    for c, r in results.items():
+        if base:
+            r["token_ratio"] = r["tokens"] / base["tokens"]
+            r["attn_ratio"] = r["attn_cost"] / base["attn_cost"]
+        print(f"{c:<10} {r['len_mean']:7.1f} {r['len_p95']:6.0f} {r['len_max']:5d} {r['tokens']:8d} "
+              f"{r.get('token_ratio', 1.0):6.3f} {r.get('attn_ratio', 1.0):6.3f} {r['vocab_used']:5d} "
+              f"{r['time_vocab_used']:4d} {r['time_token_share']:5.1%} {r['roundtrip_failed']:7d}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    bad = [c for c, r in results.items() if r["roundtrip_failed"] and c not in LOSSY_OK]
+    if bad:
+        print(f"round-trip FAILED: {bad}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
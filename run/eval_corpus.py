@@ -0,0 +1,32 @@
+# run/eval_corpus.py
+# テストセットを並列に転写・評価し、ファイルごとの結果を JSONL に逐次書き出す（中断しても再実行で続きから）
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, json
+from my_mt3.corpus import run_corpus
+from my_mt3.engine import VARIANTS
+from my_mt3.utils import collect_pairs
+
+def main():
+    ap = argparse.ArgumentParser(description="コーパス一括転写＋評価")
+    ap.add_argument("--ckpt", default="ckpt_piano.pt")
+    ap.add_argument("--out", default="eval_results.jsonl")
+    ap.add_argument("--pred_dir", default=None, help="予測MIDIの保存先（省略時は JSONL のみ）")
+    ap.add_argument("--workers", type=int, default=None, help="プロセス数（既定: コア数）")
+    ap.add_argument("--variant", default="fp32", choices=VARIANTS)
+    ap.add_argument("--batch_size", type=int, default=64)
+    ap.add_argument("--silence_db", type=float, default=None, help="log-Mel の最大値がこれ未満のチャンクは無音として飛ばす")
+    ap.add_argument("--cache_size", type=int, default=0, help="ワーカーごとのチャンク転写キャッシュの件数（0 で無効）")
+    args = ap.parse_args()
+
+    summary = run_corpus(collect_pairs(), args.ckpt, args.out, workers=args.workers, variant=args.variant,
+                         batch_size=args.batch_size, pred_dir=args.pred_dir,
+                         silence_db=args.silence_db, cache_size=args.cache_size)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# run/load_test.py
+# 転写サーバの負荷テスト: 同時に concurrency 本のリクエストを流し、スループットと遅延を測る。
+# --url を省略するとこのプロセス内でサーバを起動し、max_batch=1（リクエストごとに逐次）と動的バッチを比べる
+#
+#   python run/load_test.py --requests 64 --concurrency 16 --max_batch 32
+#   python run/load_test.py --url http://127.0.0.1:8000 --requests 64 --concurrency 16
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, asyncio, glob, json, os, tempfile, threading, time
+from urllib.parse import urlparse
+import numpy as np
+import torch
+from my_mt3 import infer
+from my_mt3.engine import load_engine
+from my_mt3.model import MT3Mini
+from my_mt3.server import TranscriptionServer
+from my_mt3.tokenizer import VOCAB
+import make_synth_piano
+
+async def post(host, port, path, body):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    data = await reader.read()
+    writer.close()
+    return status, data.split(b"\r\n\r\n", 1)[1]
+
+async def get_json(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    return json.loads(data.split(b"\r\n\r\n", 1)[1])
+
+async def load(host, port, bodies, n_requests, concurrency):
+    """n_requests 本を最大 concurrency 本同時に送る -> (経過秒, 各リクエストの遅延 [s])"""
+    sem, lat, failed = asyncio.Semaphore(concurrency), [], 0
+    async def one(i):
+        nonlocal failed
+        async with sem:
+            t0 = time.perf_counter()
+            status, _ = await post(host, port, "/transcribe", bodies[i % len(bodies)])
+            lat.append(time.perf_counter() - t0)
+            failed += status != 200
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_requests)))
+    if failed:
+        print(f"  failed requests: {failed}")
+    return time.perf_counter() - t0, lat
+
+def report(name, sec, lat, n_requests, server_metrics=None):
+    lat = np.asarray(lat) * 1000
+    r = {"sec": sec, "requests_per_sec": n_requests / sec,
+         "latency_ms_p50": float(np.percentile(lat, 50)), "latency_ms_p99": float(np.percentile(lat, 99))}
+    if server_metrics:
+        r["batch_size_mean"] = server_metrics["batch_size_mean"]
+        r["batch_size_hist"] = server_metrics["batch_size_hist"]
+    print(f"{name:>14}: {r['requests_per_sec']:6.2f} req/s  p50={r['latency_ms_p50']:8.1f} ms  "
+          f"p99={r['latency_ms_p99']:8.1f} ms" + (f"  mean_batch={r['batch_size_mean']:.1f}" if server_metrics else ""))
+    return r
+
+def run_local(model, bodies, args, max_batch):
+    """このプロセス内のスレッドでサーバを起動し、負荷をかけてから止める"""
+    server = TranscriptionServer(model, port=0, max_batch=max_batch, max_wait_ms=args.max_wait_ms)
+    ready, loop = threading.Event(), asyncio.new_event_loop()
+    task = loop.create_task(server.serve(ready=ready))
+    def serve():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+    th = threading.Thread(target=serve, daemon=True)
+    th.start(); ready.wait()
+    try:
+        sec, lat = asyncio.run(load("127.0.0.1", server.port, bodies, args.requests, args.concurrency))
+        return sec, lat, server.metrics()
+    finally:
+        loop.call_soon_threadsafe(task.cancel); th.join()
+
+def main():
+    ap = argparse.ArgumentParser(description="転写サーバの負荷テスト")
+    ap.add_argument("--url", default=None, help="既存サーバ（省略時はプロセス内で起動して比較）")
+    ap.add_argument("--ckpt", default=None, help="プロセス内サーバのチェックポイント（省略時はランダム初期化）")
+    ap.add_argument("--wavs", default=None, help="送る WAV の glob（省略時は合成データ）")
+    ap.add_argument("--duration", type=float, default=4.096, help="合成データ1本の長さ [s]")
+    ap.add_argument("--requests", type=int, default=32)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--max_batch", type=int, default=32)
+    ap.add_argument("--max_wait_ms", type=float, default=10)
+    ap.add_argument("--decode_steps", type=int, default=64, help="ランダム初期化時の1チャンクのデコード長")
+    ap.add_argument("--out", default=None, help="結果の JSON 出力先")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.wavs:
+            paths = sorted(glob.glob(args.wavs))
+        else:
+            make_synth_piano.generate(8, os.path.join(tmp, "w"), os.path.join(tmp, "m"), workers=1,
+                                      duration=args.duration, polyphony=2)
+            paths = sorted(glob.glob(os.path.join(tmp, "w", "*.wav")))
+        bodies = [open(p, "rb").read() for p in paths]
+
+    if args.url:
+        u = urlparse(args.url)
+        sec, lat = asyncio.run(load(u.hostname, u.port, bodies, args.requests, args.concurrency))
+        results = {"server": report("server", sec, lat, args.requests, asyncio.run(get_json(u.hostname, u.port, "/metrics")))}
+    else:
+        if args.ckpt:
+            model = load_engine(args.ckpt)
+        else:
+            torch.manual_seed(0)
+            model = MT3Mini(vocab_size=len(VOCAB.itos)).eval()
+            with torch.no_grad():
+                model.dec.lm.bias[VOCAB.eos] = -1e4  # ランダム重みでも長さを decode_steps に固定する
+            infer.MAX_STEPS = args.decode_steps
+        results = {}
+        for name, mb in (("batch=1", 1), (f"dynamic<={args.max_batch}", args.max_batch)):
+            sec, lat, m = run_local(model, bodies, args, mb)
+            results[name] = report(name, sec, lat, args.requests, m)
+        a, b = results.values()
+        print(f"throughput gain: x{b['requests_per_sec'] / a['requests_per_sec']:.2f}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
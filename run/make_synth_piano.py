@@ -1,63 +1,95 @@
 # run/make_synth_piano.py
-import os, math, random
+# サイン波の合成ピアノデータ（WAV + MIDI）を生成する。プロセスプールで並列化し、
+# 各サンプルの乱数は (seed, idx) から作るのでワーカー数に関係なく同じコーパスになる
+#
+#   python run/make_synth_piano.py --n 100000 --duration 10 --polyphony 3 --workers 8
+
+import argparse, os, math
+from functools import partial
+from multiprocessing import Pool
 import numpy as np
 import pretty_midi
-import torch
-import torchaudio
+import soundfile as sf
+from tqdm import tqdm
 
 SR = 22050
 CHUNK_SEC = 2.048
 N_SAMPLES = 50
 OUT_WAV = "data/wavs"
 OUT_MID = "data/midis"
-os.makedirs(OUT_WAV, exist_ok=True)
-os.makedirs(OUT_MID, exist_ok=True)
 
 def note_freq(p):
-    return 440.0 * (2.0 ** ((p - 69) / 12.0))
+    return 440.0 * (2.0 ** ((np.asarray(p) - 69) / 12.0))
 
 def synth_sine_midi(notes, sr=SR, length_sec=CHUNK_SEC):
-    """とても簡易なサイン波合成（ADSRもどき）"""
+    """
+    とても簡易なサイン波合成（ADSRもどき）。
+    ノートごとの区間長・周波数はまとめて配列で計算し、ループ内は共有の float32 ランプを切り出して
+    sin とエンベロープを掛けるだけにする（ノート単位のスライスはキャッシュに乗るので、全サンプルを
+    1本に連結するより速い）
+    """
     T = int(length_sec * sr)
     y = np.zeros(T, dtype=np.float32)
-    for (on, off, p) in notes:
-        f = note_freq(p)
-        on_i = int(on * sr)
-        off_i = int(off * sr)
-        t = np.arange(off_i - on_i, dtype=np.float32) / sr
-        # ぷちノイズ防止のADSR（攻0.01s 衰0.02s）
-        attack = min(0.01, off - on) 
-        decay  = min(0.02, max(0.0, off - on - attack))
-        sus    = max(0.0, (off - on) - (attack + decay))
-        env = np.ones_like(t)
-        a_len = max(1, int(attack * sr))
-        d_len = max(1, int(decay  * sr))
-        s_len = max(0, int(sus    * sr))
-        if a_len > 0:
-            env[:a_len] = np.linspace(0.0, 1.0, a_len, endpoint=False)
-        if d_len > 0 and a_len + d_len <= len(env):
-            env[a_len:a_len+d_len] = np.linspace(1.0, 0.7, d_len, endpoint=False)
-        if a_len + d_len + s_len < len(env):
-            env[a_len + d_len + s_len:] = np.linspace(0.7, 0.0, len(env)-(a_len+d_len+s_len), endpoint=False)
-        wave = 0.3 * env * np.sin(2 * math.pi * f * t)
-        y[on_i:off_i] += wave.astype(np.float32)
+    notes = np.asarray(notes, dtype=np.float64).reshape(-1, 3)
+    if not len(notes):
+        return y
+    on, off, p = notes[:, 0], notes[:, 1], notes[:, 2]
+    on_i = (on * sr).astype(np.int64)
+    n = np.clip((off * sr).astype(np.int64), on_i, T) - on_i
+    # ぷちノイズ防止のADSR（攻0.01s 衰0.02s）。持続部は 1 のまま
+    dur = off - on
+    attack = np.minimum(0.01, dur)
+    decay = np.minimum(0.02, np.maximum(0.0, dur - attack))
+    sus = np.maximum(0.0, dur - (attack + decay))
+    a_len = np.maximum(1, (attack * sr).astype(np.int64))
+    d_len = np.maximum(1, (decay * sr).astype(np.int64))
+    r_start = a_len + d_len + np.maximum(0, (sus * sr).astype(np.int64))
+    d_len = np.where(a_len + d_len <= n, d_len, 0)  # 衰の区間が収まらないノートは衰なし
+    w = (2 * math.pi * note_freq(p) / sr).astype(np.float32)
+
+    k = np.arange(max(int(n.max()), 1), dtype=np.float32)
+    for s, m, wi, a, d, r in zip(on_i.tolist(), n.tolist(), w, a_len.tolist(), d_len.tolist(), r_start.tolist()):
+        wave = np.sin(wi * k[:m])
+        wave *= 0.3
+        wave[:a] *= k[:min(a, m)] / a
+        if d:
+            wave[a:a + d] *= 1.0 - 0.3 * k[:d] / d
+        if r < m:
+            wave[r:] *= 0.7 - 0.7 * k[:m - r] / (m - r)
+        y[s:s + m] += wave
     # クリップ
-    y = np.clip(y, -1.0, 1.0)
-    return y
+    return np.clip(y, -1.0, 1.0)
+
+def random_notes(rng, duration=CHUNK_SEC, polyphony=1, pitch_range=(60, 72)):
+    """
+    polyphony 本の声部それぞれに、重ならないノート列（長さ 0.12-0.45s、間隔 0.02-0.18s）を並べる。
+    同じピッチのノートが重なる場合は後から始まる方を捨てる -> [(on, off, pitch), ...]（オンセット順）
+    """
+    n_max = int(duration / 0.14) + 2  # 1声部あたりの上限（最短の長さ+間隔で詰めた場合）
+    voices = []
+    for _ in range(polyphony):
+        dur = rng.uniform(0.12, 0.45, n_max)
+        gap = rng.uniform(0.02, 0.18, n_max)
+        on = rng.uniform(0.0, 0.1) + np.concatenate([[0.0], np.cumsum(dur + gap)[:-1]])
+        keep = on < duration - 0.12
+        pitch = rng.integers(pitch_range[0], pitch_range[1] + 1, n_max)
+        voices.append(np.stack([on, np.minimum(on + dur, duration), pitch], axis=1)[keep])
+    cand = np.concatenate(voices)
+    cand = cand[np.argsort(cand[:, 0], kind="stable")]
+    notes, busy = [], {}
+    for on, off, p in cand.tolist():
+        if on >= busy.get(p, -1.0):
+            notes.append((on, off, int(p))); busy[p] = off
+    return notes
 
-def make_one(idx):
-    # ランダム音符（2.048s 内に収まる）
-    n_notes = random.randint(6, 12)
-    notes = []
-    t = 0.0
-    for _ in range(n_notes):
-        dur = random.uniform(0.12, 0.45)
-        gap = random.uniform(0.02, 0.18)
-        on  = min(t, CHUNK_SEC - 0.12)
-        off = min(on + dur, CHUNK_SEC)
-        pitch = random.randint(60, 72)  # C4-D5 あたり
-        notes.append((on, off, pitch))
-        t = min(off + gap, CHUNK_SEC - 0.06)
+def make_one(idx, out_wav=OUT_WAV, out_mid=OUT_MID, seed=42, duration=CHUNK_SEC, polyphony=1,
+             pitch_range=(60, 72), overwrite=True):
+    name = f"pno_{idx:04d}"
+    wav_path, mid_path = os.path.join(out_wav, name + ".wav"), os.path.join(out_mid, name + ".mid")
+    if not overwrite and os.path.exists(wav_path) and os.path.exists(mid_path):
+        return False
+    rng = np.random.default_rng([seed, idx])  # サンプルごとに独立・再現可能な乱数
+    notes = random_notes(rng, duration, polyphony, pitch_range)
     # MIDI
     pm = pretty_midi.PrettyMIDI()
     inst = pretty_midi.Instrument(program=0)  # Acoustic Grand Piano
@@ -66,19 +98,41 @@ def make_one(idx):
     pm.instruments.append(inst)
 
     # WAV（サイン波簡易合成）
-    y = synth_sine_midi(notes)
-    torchaudio.save(
-        os.path.join(OUT_WAV, f"pno_{idx:04d}.wav"),
-        torch.from_numpy(y).unsqueeze(0),
-        SR
-    )
-    pm.write(os.path.join(OUT_MID, f"pno_{idx:04d}.mid"))
+    sf.write(wav_path, synth_sine_midi(notes, length_sec=duration), SR, subtype="FLOAT")
+    pm.write(mid_path)
+    return True
+
+def generate(n, out_wav=OUT_WAV, out_mid=OUT_MID, workers=None, start=0, **cfg):
+    """idx = start .. start+n-1 のサンプルを並列生成する。cfg は make_one の引数。生成した数を返す"""
+    os.makedirs(out_wav, exist_ok=True)
+    os.makedirs(out_mid, exist_ok=True)
+    job = partial(make_one, out_wav=out_wav, out_mid=out_mid, **cfg)
+    ids = range(start, start + n)
+    workers = workers or os.cpu_count()
+    if workers <= 1:
+        return sum(job(i) for i in tqdm(ids, unit="file"))
+    with Pool(workers) as pool:
+        return sum(tqdm(pool.imap_unordered(job, ids, chunksize=64), total=n, unit="file"))
 
 def main():
-    random.seed(42)
-    for i in range(N_SAMPLES):
-        make_one(i)
-    print(f"Generated {N_SAMPLES} pairs under {OUT_WAV} and {OUT_MID}")
+    ap = argparse.ArgumentParser(description="合成ピアノデータ（WAV + MIDI）の並列生成")
+    ap.add_argument("--n", type=int, default=N_SAMPLES, help="生成するペア数")
+    ap.add_argument("--start", type=int, default=0, help="最初のファイル番号")
+    ap.add_argument("--duration", type=float, default=CHUNK_SEC, help="1ファイルの長さ [s]（複数チャンク可）")
+    ap.add_argument("--polyphony", type=int, default=1, help="同時に鳴る声部数の上限")
+    ap.add_argument("--pitch_min", type=int, default=60)
+    ap.add_argument("--pitch_max", type=int, default=72)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--workers", type=int, default=None, help="プロセス数（既定: コア数）")
+    ap.add_argument("--skip_existing", action="store_true", help="WAV/MIDI が揃っている番号は作り直さない")
+    ap.add_argument("--out_wav", default=OUT_WAV)
+    ap.add_argument("--out_mid", default=OUT_MID)
+    args = ap.parse_args()
+
+    made = generate(args.n, args.out_wav, args.out_mid, workers=args.workers, start=args.start, seed=args.seed,
+                    duration=args.duration, polyphony=args.polyphony,
+                    pitch_range=(args.pitch_min, args.pitch_max), overwrite=not args.skip_existing)
+    print(f"Generated {made} pairs under {args.out_wav} and {args.out_mid}")
 
 if __name__ == "__main__":
     main()
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from midi2audio import FluidSynth
 from pathlib import Path
 import argparse
@@ -25,7 +26,10 @@ def convert_midi_to_wav(midi_file, soundfont_file, output_wav):
 
 def midi_to_wav_with_fs(fs: FluidSynth, midi_path: Path, wav_path: Path) -> None:
     print(f"変換中: {midi_path} ...")
-    fs.midi_to_audio(str(midi_path), str(wav_path))
+    # 一時ファイルに書いてから置き換える（中断で途中までのWAVが「既存」扱いでスキップされないように）
+    tmp_path = wav_path.with_name(wav_path.stem + ".part.wav")
+    fs.midi_to_audio(str(midi_path), str(tmp_path))
+    os.replace(tmp_path, wav_path)
     print(f"完了: {wav_path}")
 
 def find_midi_files(root: Path, recursive: bool):
@@ -54,6 +58,8 @@ def main():
     parser.add_argument("--out_dir", help="出力先ディレクトリ（--midi_dir指定時）")
     parser.add_argument("--recursive", action="store_true", help="サブディレクトリも再帰的に処理")
     parser.add_argument("--overwrite", action="store_true", help="既存のWAVがあっても上書きする")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="同時に走らせる fluidsynth の数（--midi_dir指定時、既定: コア数）")
     args = parser.parse_args()
 
     sf2_path = Path(args.sf2)
@@ -81,8 +87,9 @@ def main():
     if out_base:
         out_base.mkdir(parents=True, exist_ok=True)
 
-    fs = FluidSynth(args.sf2)
-    converted = 0
+    # 既存WAVのスキップは投入前に判定し、変換だけをスレッドで並列に流す
+    # （実際の合成は fluidsynth の子プロセスなので、スレッドでも CPU コア数ぶん並列になる）
+    jobs = []
     for midi_file in find_midi_files(dir_path, args.recursive):
         rel = midi_file.relative_to(dir_path)
         wav_path = (
@@ -90,15 +97,22 @@ def main():
             if out_base
             else midi_file.with_suffix(".wav")
         )
-        wav_path.parent.mkdir(parents=True, exist_ok=True)
         if wav_path.exists() and not args.overwrite:
             print(f"スキップ（既存）: {wav_path}")
             continue
-        try:
-            midi_to_wav_with_fs(fs, midi_file, wav_path)
-            converted += 1
-        except Exception as e:
-            print(f"失敗: {midi_file} -> {e}")
+        wav_path.parent.mkdir(parents=True, exist_ok=True)
+        jobs.append((midi_file, wav_path))
+
+    fs = FluidSynth(args.sf2)
+    converted = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+        futures = {ex.submit(midi_to_wav_with_fs, fs, m, w): m for m, w in jobs}
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+                converted += 1
+            except Exception as e:
+                print(f"失敗: {futures[fut]} -> {e}")
 
     print(f"処理完了: {converted} ファイル変換")
 
@@ -0,0 +1,34 @@
+# run/pack_shards.py
+# WAV/MIDI ペアをチャンク単位のシャードに詰める（train_loop にディレクトリを渡すとストリーミングで学習できる）
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, os, time
+from my_mt3.shards import pack_shards
+from my_mt3.tokenizer import CODECS
+from my_mt3.utils import collect_pairs
+
+def main():
+    ap = argparse.ArgumentParser(description="学習データのシャード化")
+    ap.add_argument("--out", default="data/shards")
+    ap.add_argument("--kind", default="mel", choices=["mel", "audio"], help="log-Mel を保存するか波形を保存するか")
+    ap.add_argument("--shard_mb", type=int, default=512, help="1シャードの目安サイズ [MB]")
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--cache_dir", default=None, help="AMTDataset のキャッシュがあれば再利用する")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--codec", default="absolute", choices=list(CODECS), help="トークンの符号化方式")
+    args = ap.parse_args()
+
+    pairs = collect_pairs()
+    t0 = time.perf_counter()
+    man = pack_shards(pairs, args.out, kind=args.kind, shard_bytes=args.shard_mb << 20, workers=args.workers,
+                      seed=args.seed, cache_dir=args.cache_dir, codec=args.codec)
+    size = sum(s["bytes"] for s in man["shards"])
+    print(f"pairs: {len(pairs)}  chunks: {man['records']}  shards: {len(man['shards'])}  "
+          f"{size / 2**20:.1f} MB ({time.perf_counter() - t0:.1f}s) -> {args.out}")
+
+if __name__ == "__main__":
+    main()
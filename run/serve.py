@@ -0,0 +1,39 @@
+# run/serve.py
+# ローカル転写サーバ（リクエストをまたいでチャンクを動的バッチでデコード）
+#
+#   python run/serve.py --ckpt ckpt_piano.pt --port 8000 --max_batch 32 --max_wait_ms 10
+#   curl --data-binary @song.wav http://127.0.0.1:8000/transcribe -o song.mid
+#   curl http://127.0.0.1:8000/metrics
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse
+import torch
+from my_mt3.engine import VARIANTS, load_engine
+from my_mt3.server import TranscriptionServer
+
+def main():
+    ap = argparse.ArgumentParser(description="ローカル転写サーバ")
+    ap.add_argument("--ckpt", default="ckpt_piano.pt")
+    ap.add_argument("--variant", default="fp32", choices=VARIANTS)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--max_batch", type=int, default=32, help="1バッチのチャンク数の上限（int8 は 1 のみ）")
+    ap.add_argument("--max_wait_ms", type=float, default=10, help="バッチを集めるときの最大待ち時間")
+    ap.add_argument("--workers", type=int, default=1, help="デコードスレッド数")
+    ap.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    args = ap.parse_args()
+    if args.variant == "int8" and args.max_batch > 1:
+        # 動的 int8 は活性のスケールをバッチ全体で決めるので、結果が同じバッチの他のリクエストに左右される
+        ap.error("--variant int8 is not batch-invariant; use --max_batch 1")
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    TranscriptionServer(load_engine(args.ckpt, args.variant), host=args.host, port=args.port,
+                        max_batch=args.max_batch, max_wait_ms=args.max_wait_ms, workers=args.workers).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# run/stream_demo.py
+# WAV を小さなブロックで StreamingTranscriber に流し込み、オフラインの transcribe と比較する
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse
+from my_mt3.audio import load_wav_mono
+from my_mt3.engine import load_engine
+from my_mt3.infer import transcribe
+from my_mt3.stream import StreamingTranscriber
+
+def main():
+    ap = argparse.ArgumentParser(description="ストリーミング転写のデモ（オフライン出力との比較つき）")
+    ap.add_argument("wav")
+    ap.add_argument("--ckpt", default="ckpt_piano.pt")
+    ap.add_argument("--block", type=int, default=512, help="1回に push するサンプル数")
+    ap.add_argument("--hop_sec", type=float, default=None, help="窓の移動量（既定: チャンク長）")
+    ap.add_argument("--out", default=None, help="ストリーミング結果のMIDI出力先")
+    args = ap.parse_args()
+
+    model = load_engine(args.ckpt)
+    y, sr = load_wav_mono(args.wav)
+    st = StreamingTranscriber(model, sr=sr, hop_sec=args.hop_sec)
+    for i in range(0, len(y), args.block):
+        for n in st.push(y[i:i + args.block]):
+            print(f"  t={i / sr:7.3f}s  note pitch={n.pitch:3d} {n.start:7.3f}-{n.end:7.3f}")
+    for n in st.flush():
+        print(f"  [flush]    note pitch={n.pitch:3d} {n.start:7.3f}-{n.end:7.3f}")
+    print(st.stats())
+
+    key = lambda n: (round(n.start, 6), round(n.end, 6), n.pitch)
+    ref = transcribe(y, model, sr=sr, device="cpu").instruments[0].notes
+    print(f"offline notes: {len(ref)}  streaming notes: {len(st.notes)}  "
+          f"identical: {sorted(map(key, ref)) == sorted(map(key, st.notes))}")
+    if args.out:
+        st.midi().write(args.out)
+
+if __name__ == "__main__":
+    main()
@@ -5,19 +5,10 @@ import sys, pathlib
 sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
 # ==================================
 
-import glob, os, torch
+import torch
+from my_mt3.model import save_checkpoint
 from my_mt3.train import train_loop
-
-def collect_pairs():
-    wavs = sorted(glob.glob("data/wavs/*.wav"))
-    pairs = []
-    for w in wavs:
-        base = os.path.splitext(os.path.basename(w))[0]
-        m = os.path.join("data/midis", base + ".mid")
-        if os.path.exists(m):
-            # (wav_path, midi_path, program_id=0: piano)
-            pairs.append((w, m, 0))
-    return pairs
+from my_mt3.utils import collect_pairs
 
 if __name__ == "__main__":
     pairs = collect_pairs()
@@ -29,5 +20,5 @@ if __name__ == "__main__":
         lr=2e-4,
         device="cuda" if torch.cuda.is_available() else "cpu"
     )
-    torch.save(model.state_dict(), "ckpt_piano.pt")
+    save_checkpoint(model, "ckpt_piano.pt")  # 構成（preset など）も一緒に保存
     print("saved -> ckpt_piano.pt")
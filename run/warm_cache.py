@@ -0,0 +1,44 @@
+# run/warm_cache.py
+# AMTDataset のディスクキャッシュ（log-Mel / トークン）を並列に事前生成する
+# トークンは --codec で符号化したものを保存する（学習時の --codec と同じものを指定する。codec ごとに別エントリ）
+
+# ==== add this at the very top ====
+import sys, pathlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+# ==================================
+
+import argparse, os, time
+from multiprocessing import Pool
+from my_mt3.dataset import AMTDataset
+from my_mt3.tokenizer import CODECS
+from my_mt3.utils import collect_pairs
+
+_DS = None
+
+def _init(pairs, cache_dir, codec):
+    global _DS
+    _DS = AMTDataset(pairs, cache_dir=cache_dir, codec=codec)
+
+def _warm(i):
+    wav, midi, pid = _DS.pairs[i]
+    if _DS.cache.load(wav, midi, pid) is not None:
+        return False
+    _DS.load(i)
+    return True
+
+def main():
+    ap = argparse.ArgumentParser(description="AMTDataset キャッシュの事前生成")
+    ap.add_argument("--cache_dir", default="data/cache")
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--codec", default="absolute", choices=list(CODECS), help="トークンの符号化方式")
+    args = ap.parse_args()
+
+    pairs = collect_pairs()
+    t0 = time.perf_counter()
+    with Pool(args.workers, initializer=_init, initargs=(pairs, args.cache_dir, args.codec)) as pool:
+        built = sum(pool.imap_unordered(_warm, range(len(pairs)), chunksize=4))
+    print(f"pairs: {len(pairs)}  built: {built}  cached: {len(pairs) - built}  "
+          f"({time.perf_counter() - t0:.1f}s) -> {args.cache_dir}  codec: {args.codec}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# tests/conftest.py
+import numpy as np, pytest, torch
+from my_mt3 import infer
+from my_mt3.model import MT3Mini
+from my_mt3.tokenizer import VOCAB
+
+N_MELS = 32
+
+def tiny_model(seed=0, n_mels=N_MELS, eos_bias=0.8):
+    """
+    乱数初期化の1層 tiny MT3Mini。<eos> の logit のバイアスを調整して、チャンクごとに違うステップで止まる
+    （または MAX_STEPS まで続く）ようにする（batch_greedy_decode の行の打ち切りまで通すため）
+    """
+    torch.manual_seed(seed)
+    model = MT3Mini(len(VOCAB.itos), n_mels=n_mels, preset="tiny", dropout=0.0, L=1).eval()
+    with torch.no_grad():
+        model.dec.lm.bias[VOCAB.eos] = eos_bias
+    return model
+
+@pytest.fixture(autouse=True)
+def short_decode(monkeypatch):
+    """デコードの上限を短くしてテストを速くする"""
+    monkeypatch.setattr(infer, "MAX_STEPS", 64)
+
+@pytest.fixture
+def model():
+    return tiny_model(0)
+
+@pytest.fixture
+def mels():
+    """長さの違うチャンク（176/177 フレームのように）を混ぜる"""
+    rng = np.random.default_rng(0)
+    return [rng.standard_normal((T, N_MELS)).astype(np.float32) for T in (40, 40, 41, 40, 41, 40)]
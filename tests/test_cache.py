@@ -0,0 +1,39 @@
+# tests/test_cache.py  (チャンク転写キャッシュ)
+import numpy as np, pytest, torch
+from my_mt3.cache import ChunkCache, model_digest
+from my_mt3.engine import build_engine
+from my_mt3.infer import transcribe
+from conftest import tiny_model
+
+def test_model_digest(model):
+    q = build_engine(tiny_model(0), "int8")
+    assert model_digest(model) == model_digest(tiny_model(0))
+    assert model_digest(q) != model_digest(model)
+    with pytest.raises(ValueError):
+        model_digest(build_engine(tiny_model(0), "torchscript"))  # 重みを持たないので ckpt_id が要る
+
+def test_transcribe_with_cache():
+    """同じ音のチャンクはキャッシュから返し、出力はキャッシュなしと同じ"""
+    model = tiny_model(0, n_mels=256)
+    y = 0.1 * np.sin(2 * np.pi * np.arange(6 * 45158) / 64).astype(np.float32)  # 周期が hop を割り切る → 内側のチャンクは同じ mel
+    notes = lambda pm: [(n.start, n.end, n.pitch) for i in pm.instruments for n in i.notes]
+    ref, cache, skip = notes(transcribe(y, model, device="cpu")), ChunkCache(), {}
+    assert notes(transcribe(y, model, device="cpu", cache=cache, skip_stats=skip)) == ref
+    assert skip["decoded"] < skip["chunks"]                  # 曲内の繰り返しは1回だけデコード
+    assert notes(transcribe(y, model, device="cpu", cache=cache)) == ref
+    assert cache.misses == len(cache)                        # 2回目は全部キャッシュから
+
+def test_save_needs_path():
+    with pytest.raises(ValueError):
+        ChunkCache().save()
+
+def test_model_digest_memoized(model, monkeypatch):
+    """2回目以降は重みを読まず、重みを in-place で書き換えたら計算し直す"""
+    d = model_digest(model)
+    sd = model.state_dict
+    monkeypatch.setattr(model, "state_dict", lambda: pytest.fail("weights hashed again"))
+    assert model_digest(model) == d
+    monkeypatch.setattr(model, "state_dict", sd)
+    with torch.no_grad():
+        model.dec.lm.bias.add_(1.0)
+    assert model_digest(model) != d
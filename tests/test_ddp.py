@@ -0,0 +1,19 @@
+# tests/test_ddp.py  (2 プロセスの DDP 学習と 1 プロセス学習の一致。run/check_ddp.py と同じ確認)
+import os, pathlib, sys
+import pytest
+from my_mt3.train import compare_ddp
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "run"))
+import make_synth_piano
+
+@pytest.mark.slow
+@pytest.mark.parametrize("accum_steps", [1, 2])
+def test_ddp_matches_single_process(tmp_path, accum_steps):
+    n, lr = 8, 1e-4
+    wav_dir, mid_dir = str(tmp_path / "wavs"), str(tmp_path / "midis")
+    make_synth_piano.generate(n, wav_dir, mid_dir, workers=1)
+    pairs = [(os.path.join(wav_dir, f"pno_{i:04d}.wav"), os.path.join(mid_dir, f"pno_{i:04d}.mid"), 0)
+             for i in range(n)]
+    r = compare_ddp(pairs, world_size=2, bs=2, epochs=1, lr=lr, device="cpu", seed=0, accum_steps=accum_steps,
+                    model_cfg={"preset": "tiny", "dropout": 0.0})
+    assert r["max_diff"] <= lr  # Adam は勾配の丸め誤差を最大 lr 程度に増幅する
@@ -0,0 +1,38 @@
+# tests/test_decode.py  (デコード経路の一致: KVキャッシュ / バッチ / 投機的デコード)
+import pytest
+from my_mt3.engine import build_engine
+from my_mt3.infer import batch_greedy_decode, greedy_decode, speculative_decode
+from my_mt3.tokenizer import VOCAB
+from conftest import tiny_model
+
+def test_kv_cache_matches_full_decode(model, mels):
+    for mel in mels:
+        assert greedy_decode(model, mel, device="cpu") == greedy_decode(model, mel, device="cpu", use_cache=False)
+
+def test_batch_matches_single(model, mels):
+    single = [greedy_decode(model, mel, device="cpu") for mel in mels]
+    assert len({len(o) for o in single}) > 1  # 行ごとに違うステップで <eos> になる
+    assert any(o[-1] == VOCAB.eos for o in single)
+    assert batch_greedy_decode(model, mels, device="cpu") == single
+
+@pytest.mark.parametrize("k", [1, 4])
+@pytest.mark.parametrize("draft_seed", [0, 1])
+def test_speculative_matches_greedy(model, mels, k, draft_seed):
+    draft = model if draft_seed == 0 else tiny_model(draft_seed)
+    stats = {}
+    for mel in mels:
+        assert speculative_decode(model, draft, mel, device="cpu", k=k, stats=stats) == \
+            greedy_decode(model, mel, device="cpu")
+    if draft is model:
+        assert stats["accepted"] == stats["proposed"]
+
+def test_speculative_int8_draft_matches_greedy(model, mels):
+    draft = build_engine(tiny_model(1), "int8")
+    for mel in mels:
+        assert speculative_decode(model, draft, mel, device="cpu") == greedy_decode(model, mel, device="cpu")
+
+@pytest.mark.parametrize("variant", ["int8", "torchscript"])
+def test_speculative_rejects_non_fp32_main(model, mels, variant):
+    engine = build_engine(tiny_model(0), variant)
+    with pytest.raises(ValueError):
+        speculative_decode(engine, model, mels[0], device="cpu")
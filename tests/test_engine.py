@@ -0,0 +1,11 @@
+# tests/test_engine.py  (推論エンジンのバリアントのパリティ比較)
+from my_mt3.engine import compare_variants
+
+def test_compare_variants_uses_fp32_reference(model, mels):
+    """fp32 を含めずに渡しても、各バリアントは元の fp32 モデルの出力と比べる"""
+    full = compare_variants(model, mels, variants=["fp32", "int8", "torchscript"])
+    part = compare_variants(model, mels, variants=["int8", "torchscript"])
+    assert full["fp32"]["agreement"] == 1.0 and full["fp32"]["batch_invariant"]
+    assert full["torchscript"]["agreement"] == part["torchscript"]["agreement"] == 1.0
+    assert part["int8"]["agreement"] == full["int8"]["agreement"]
+    assert part["int8"]["onset_f1_delta"] == full["int8"]["onset_f1_delta"]
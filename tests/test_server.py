@@ -0,0 +1,46 @@
+# tests/test_server.py  (転写サーバのリクエスト横断の動的バッチ)
+import asyncio, io
+import numpy as np, pytest, soundfile as sf
+from my_mt3 import server as server_mod
+from my_mt3.engine import build_engine
+from my_mt3.infer import chunk_logmels, greedy_decode, is_batch_invariant
+from my_mt3.server import TranscriptionServer
+from conftest import tiny_model
+
+def test_batched_requests_match_single_decode(monkeypatch):
+    """同時に来たリクエストのチャンクを1つのバッチでデコードしても、各リクエストの各チャンクには自分の greedy_decode の結果が返る"""
+    model = tiny_model(0, n_mels=256)
+    rng = np.random.default_rng(0)
+    clips = [rng.standard_normal(int(sec * 22050)).astype(np.float32) * 0.1 for sec in (2.5, 4.3, 1.0, 6.2)]
+    got = {}  # 最後のチャンクの終端（クリップごとに違う）-> そのリクエストに返ったトークン列
+    merge = server_mod.merge_chunks
+    monkeypatch.setattr(server_mod, "merge_chunks",
+                        lambda spans, tl, **kw: got.setdefault(spans[-1][1], tl) and merge(spans, tl, **kw))
+
+    def wav_bytes(y):
+        buf = io.BytesIO()
+        sf.write(buf, y, 22050, format="WAV", subtype="FLOAT")
+        return buf.getvalue()
+
+    async def run():
+        srv = TranscriptionServer(model, port=0, max_batch=8, max_wait_ms=50)
+        ready = asyncio.Event()
+        task = asyncio.create_task(srv.serve(ready=ready))
+        await ready.wait()
+        try:
+            return srv, await asyncio.gather(*[srv.transcribe(wav_bytes(y)) for y in clips])
+        finally:
+            task.cancel()
+    srv, outs = asyncio.run(run())
+    assert all(o.startswith(b"MThd") for o in outs)
+    assert max(srv.batch_hist) > 1  # 複数リクエストのチャンクが同じバッチに入った
+    for y in clips:
+        chunks = chunk_logmels(y)
+        assert got[chunks[-1][1][1]] == [greedy_decode(model, mel, device="cpu") for mel, _ in chunks]
+
+def test_rejects_int8_batching():
+    q = build_engine(tiny_model(0), "int8")
+    assert not is_batch_invariant(q) and is_batch_invariant(tiny_model(0))
+    with pytest.raises(ValueError):
+        TranscriptionServer(q, max_batch=4)
+    TranscriptionServer(q, max_batch=1)
@@ -0,0 +1,35 @@
+# tests/test_shards.py  (ShardDataset の rank / ワーカーへの振り分け)
+from types import SimpleNamespace
+import numpy as np, pytest
+from my_mt3 import shards
+from my_mt3.shards import ShardDataset, ShardWriter
+
+def _pack(root, n_records, shard_bytes):
+    """レコード i の mel を全要素 i にした偽のシャードを書く"""
+    w = ShardWriter(str(root), shard_bytes=shard_bytes, sr=22050, hop=256, step_ms=10, n_fft=2048, n_mels=4)
+    for i in range(n_records):
+        w.write(np.full((3, 4), i, np.float32), [1, 2, i], (0.0, 2.048))
+    return w.close()
+
+def _read(root, monkeypatch, rank, world, wid, nw, epoch=0):
+    monkeypatch.setattr(shards, "get_worker_info", lambda: SimpleNamespace(id=wid, num_workers=nw))
+    ds = ShardDataset(str(root), shuffle_buffer=0, rank=rank, num_replicas=world)
+    ds.set_epoch(epoch)
+    return [int(feat[0, 0]) for feat, _, _ in ds]
+
+@pytest.mark.parametrize("n_records,shard_bytes", [(10, 1 << 20), (23, 200), (40, 100)])
+@pytest.mark.parametrize("world,nw", [(1, 1), (2, 1), (2, 3)])
+def test_split_by_record(tmp_path, monkeypatch, n_records, shard_bytes, world, nw):
+    _pack(tmp_path, n_records, shard_bytes)
+    for epoch in (0, 1):
+        got = [_read(tmp_path, monkeypatch, r, world, w, nw, epoch) for r in range(world) for w in range(nw)]
+        flat = [i for g in got for i in g]
+        assert {len(g) for g in got} == {n_records // (world * nw)}  # 全スロット同じ件数（シャード1つでも）
+        assert len(set(flat)) == len(flat)                            # 重複なし
+        assert len(flat) > n_records - world * nw                     # 落とすのは端数だけ
+        assert set(flat) <= set(range(n_records))
+
+def test_too_few_records(tmp_path, monkeypatch):
+    _pack(tmp_path, 3, 1 << 20)
+    with pytest.raises(ValueError):
+        _read(tmp_path, monkeypatch, 0, 2, 0, 2)
@@ -0,0 +1,35 @@
+# tests/test_stream.py  (ストリーミング転写とオフライン転写の一致)
+import numpy as np, pytest
+from my_mt3.infer import transcribe
+from my_mt3.stream import StreamingTranscriber
+from conftest import tiny_model
+
+def _run(model, fn):
+    """fn() を実行し、エンコーダに入ったチャンクの log-Mel [T,F] のリストと出力ノートを返す"""
+    seen = []
+    hook = model.enc.register_forward_pre_hook(lambda m, args: seen.extend(args[0].numpy()))
+    try:
+        pm = fn()
+    finally:
+        hook.remove()
+    return seen, sorted((round(n.start, 4), round(n.end, 4), n.pitch) for i in pm.instruments for n in i.notes)
+
+# n_fft//2 + 1 = 1025 サンプルより短い入力（反射パディングが入力をはみ出す）を含む
+@pytest.mark.parametrize("n", [1, 100, 1024, 1025, 5000, 60000])
+@pytest.mark.parametrize("block", [7, 4096])
+def test_stream_matches_offline(n, block):
+    model = tiny_model(0, n_mels=256)
+    y = np.random.default_rng(n).standard_normal(n).astype(np.float32) * 0.1
+
+    def stream():
+        st = StreamingTranscriber(model)
+        for i in range(0, n, block):
+            st.push(y[i:i + block])
+        st.flush()
+        return st.midi()
+    mels, notes = _run(model, stream)
+    ref_mels, ref_notes = _run(model, lambda: transcribe(y, model, device="cpu"))
+    assert notes == ref_notes
+    assert len(mels) == len(ref_mels)
+    for a, b in zip(mels, ref_mels):
+        np.testing.assert_allclose(a, b, atol=1e-3)
@@ -0,0 +1,31 @@
+# tests/test_tokenizer.py  (符号化方式ごとの encode -> decode の往復)
+import numpy as np, pytest
+from my_mt3.dataset import random_chunks
+from my_mt3.tokenizer import CODECS, VOCAB, decode_events, encode_events
+
+def _key(notes):
+    return sorted(map(tuple, np.asarray(notes).reshape(-1, 3).tolist()))
+
+@pytest.mark.parametrize("codec", [c for c in CODECS if c != "absolute"])
+def test_roundtrip(codec):
+    chunks = random_chunks(30, song_sec=10.0)
+    seqs = [encode_events(ev, 0, ties, codec=codec) for ev, ties in chunks]
+    for (ev, _), notes in zip(chunks, decode_events(seqs, codec=codec)):
+        assert _key(notes) == _key(ev)
+
+def test_roundtrip_absolute_without_repeats():
+    """absolute は同時刻の同じピッチの NOF / NON を取り違え得る（既知の制限）ので連打なしで確かめる"""
+    for ev, ties in random_chunks(30, song_sec=10.0, repeats=False):
+        assert _key(decode_events(encode_events(ev, 0, ties))) == _key(ev)
+
+@pytest.mark.parametrize("codec", list(CODECS))
+def test_batch_decode_matches_single(codec):
+    seqs = [encode_events(ev, 0, ties, codec=codec) for ev, ties in random_chunks(5, song_sec=10.0)]
+    for seq, notes in zip(seqs, decode_events(seqs, codec=codec)):
+        assert np.array_equal(notes, decode_events(seq, codec=codec))
+
+@pytest.mark.parametrize("codec", list(CODECS))
+def test_empty_chunk(codec):
+    seq = encode_events([], 0, [], codec=codec)
+    assert seq == [int(VOCAB.program_ids[0]), VOCAB.eos]
+    assert len(decode_events(seq, codec=codec)) == 0